@@ -0,0 +1,339 @@
+'''
+End-to-end and per-stage crawler benchmark on a fixed synthetic corpus
+(utils.cacheserver.SyntheticWeb), written as JSON so runs on different
+commits can be compared.
+
+    python benchmarks/bench_crawl.py [--sizes 10000,100000,1000000]
+        [--pages 2000] [--crawl-pages 10000] [--output results.json]
+
+For every size N in --sizes:
+    is_banned       scraper.is_banned on N link urls (in-domain, off-domain,
+                    traps, files), plus canonicalize + screen_url
+    frontier        Frontier.add_url of N urls, then get_tbd_url and
+                    mark_url_complete until it is empty
+Once, on --pages synthetic pages:
+    tokenize        tokenizewords.tokenize_string of each page's text
+    is_valid_current, scraper
+                    the scraper functions on each page's Response
+Once, unless --crawl-pages is 0:
+    crawl           Crawler with Worker threads against a local cache server
+                    serving a site of --crawl-pages pages, with the time of
+                    each Worker step
+
+Each stage reports calls, seconds, calls/sec and p50/p99 latency per call;
+for the crawl stages seconds are added up over all worker threads. The crawl
+also reports pages/sec, links added/sec and the size of every file
+it wrote. Peak RSS is reported at the end. Everything runs in a temporary
+directory.
+'''
+import os
+import sys
+import json
+import time
+import random
+import shutil
+import tempfile
+import platform
+import resource
+import subprocess
+from contextlib import redirect_stdout
+from threading import current_thread
+from argparse import ArgumentParser
+from configparser import ConfigParser
+from urllib.parse import urlparse
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+import cbor
+
+import scraper
+from tokenizewords import tokenize_string
+from utils.config import Config
+from utils.response import Response
+from utils.page import ParsedPage
+from utils.canonical import canonicalize
+from utils.cacheserver import SyntheticWeb, CacheServer, response_body, HOSTS
+from crawler import Crawler
+from crawler.frontier import Frontier
+from crawler.worker import Worker
+
+OFF_DOMAIN = ["https://www.google.com/search?q=uci", "https://github.com/uci/repo",
+              "https://today.uci.edu/news", "mailto:someone@uci.edu"]
+# Steps of Worker.run timed by the crawl stage
+CRAWL_STAGES = ["get_tbd_url", "download", "is_valid_current", "scraper", "add_url",
+                "mark_url_complete"]
+# Files written by a crawl, relative to its directory
+ARTIFACTS = ["explored.json", "explored.json.log", "wordtotals.json", "subdomains.json",
+             "simhash.bin", "frontier.db", "frontier.db-wal", "frontier.db.bloom",
+             "frontier.shelve.dat", "frontier.shelve.dir", "frontier.shelve.bak"]
+
+
+def percentile(sorted_values, fraction):
+    if not sorted_values:
+        return 0.0
+    return sorted_values[min(int(fraction * len(sorted_values)), len(sorted_values) - 1)]
+
+
+def summarize(latencies, seconds=None):
+    ''' Stage result from the per-call latencies in seconds. '''
+    latencies = sorted(latencies)
+    seconds = seconds if seconds is not None else sum(latencies)
+    return {
+        "calls": len(latencies),
+        "seconds": round(seconds, 4),
+        "per_second": round(len(latencies) / seconds, 1) if seconds else None,
+        "p50_ms": round(percentile(latencies, 0.5) * 1000, 4),
+        "p99_ms": round(percentile(latencies, 0.99) * 1000, 4),
+    }
+
+
+def timed(func, items):
+    ''' Calls func on every item; returns (results, latencies, seconds). '''
+    results = list()
+    latencies = list()
+    clock = time.perf_counter
+    started = clock()
+    for item in items:
+        start = clock()
+        results.append(func(item))
+        latencies.append(clock() - start)
+    return results, latencies, clock() - started
+
+
+def make_config(overrides=None):
+    cparser = ConfigParser()
+    cparser.read(os.path.join(ROOT, "config.ini"))
+    with redirect_stdout(sys.stderr): # Config prints the user agent
+        config = Config(cparser)
+    config.time_delay = 0.0
+    for name, value in (overrides or dict()).items():
+        setattr(config, name, value)
+    return config
+
+
+def link_corpus(count, seed=121):
+    ''' count link urls, mostly in-domain pages, some traps, files and off-domain. '''
+    rand = random.Random(seed)
+    links = list()
+    for _ in range(count):
+        n = rand.randrange(count)
+        kind = rand.random()
+        if kind < 0.7:
+            links.append(f"https://{HOSTS[n % len(HOSTS)]}/page/{n}")
+        elif kind < 0.8:
+            links.append(f"https://{HOSTS[n % len(HOSTS)]}/page/{n}?share={n % 97}#top")
+        elif kind < 0.85:
+            links.append(f"https://www.ics.uci.edu/events/2019-{n % 12 + 1:02}-{n % 28 + 1:02}")
+        elif kind < 0.9:
+            links.append(f"https://wiki.ics.uci.edu/doku.php/topic{n % 50}?rev={n}&do=diff")
+        elif kind < 0.95:
+            links.append(f"https://{HOSTS[n % len(HOSTS)]}/files/paper{n}.pdf")
+        else:
+            links.append(rand.choice(OFF_DOMAIN))
+    return links
+
+
+def bench_is_banned(count):
+    links = link_corpus(count)
+    parsed = [urlparse(link) for link in links]
+    banned, latencies, seconds = timed(scraper.is_banned, parsed)
+    scraper.screen_url.cache_clear()
+    canonicalize.cache_clear()
+    _, screen_latencies, screen_seconds = timed(scraper.screen_url, links)
+    return {
+        "is_banned": dict(summarize(latencies, seconds), banned=sum(banned)),
+        "screen_url": summarize(screen_latencies, screen_seconds),
+    }
+
+
+def bench_frontier(count, config):
+    scraper.setup(config)
+    frontier = Frontier(config, True)
+    urls = [f"https://{HOSTS[n % len(HOSTS)]}/page/{n}" for n in range(count)]
+    _, add_latencies, add_seconds = timed(frontier.add_url, urls)
+    pop_latencies = list()
+    clock = time.perf_counter
+    started = clock()
+    while True:
+        start = clock()
+        url = frontier.get_tbd_url(block=False)
+        if url is None:
+            break
+        frontier.mark_url_complete(url)
+        pop_latencies.append(clock() - start)
+    pop_seconds = clock() - started
+    start = clock()
+    frontier.close()
+    close_seconds = clock() - start
+    scraper.shutdown()
+    return {
+        "add_url": summarize(add_latencies, add_seconds),
+        "get_and_complete": summarize(pop_latencies, pop_seconds),
+        "dropped": frontier.dropped,
+        "close_seconds": round(close_seconds, 4),
+    }
+
+
+def page_responses(pages, seed=121):
+    ''' Responses of the first pages pages of the synthetic site, as the crawler gets them. '''
+    web = SyntheticWeb(pages, seed)
+    responses = list()
+    for n in range(pages):
+        url = f"https://{HOSTS[n % len(HOSTS)]}/page/{n}"
+        status, content = web.fetch(url)
+        responses.append((url, cbor.loads(response_body(url, status, content))))
+    return responses
+
+
+def bench_pages(pages, config):
+    scraper.setup(config)
+    responses = page_responses(pages)
+    texts = [ParsedPage(Response(resp).raw_response.content).text
+             for _, resp in responses if resp["status"] == 200]
+    _, token_latencies, token_seconds = timed(tokenize_string, texts)
+    fresh = [(url, Response(resp)) for url, resp in responses]
+    verdicts, valid_latencies, valid_seconds = timed(
+        lambda item: scraper.is_valid_current(*item), fresh)
+    scraped = [item for item, verdict in zip(fresh, verdicts) if verdict[0]]
+    links, scraper_latencies, scraper_seconds = timed(
+        lambda item: scraper.scraper(*item), scraped)
+    scraper.shutdown()
+    return {
+        "tokenize": dict(summarize(token_latencies, token_seconds),
+                         bytes=sum(len(text) for text in texts)),
+        "is_valid_current": dict(summarize(valid_latencies, valid_seconds),
+                                 scraped=len(scraped)),
+        "scraper": dict(summarize(scraper_latencies, scraper_seconds),
+                        links=sum(len(page_links) for page_links in links)),
+    }
+
+
+def timed_call(name, func):
+    ''' func, with the time of each call made by a TimedWorker added to its timings[name]. '''
+    def call(*args, **kwargs):
+        start = time.perf_counter()
+        try:
+            return func(*args, **kwargs)
+        finally:
+            timings = getattr(current_thread(), "timings", None)
+            if timings is not None:
+                timings[name].append(time.perf_counter() - start)
+    return call
+
+
+class TimedWorker(Worker):
+    '''
+    The Worker, unchanged, with the time of each step of its run recorded
+    in self.timings: fetch is timed here, the frontier calls by
+    TimedFrontier and the scraper calls by bench_crawl.
+    '''
+    def __init__(self, worker_id, config, frontier):
+        super().__init__(worker_id, config, frontier)
+        self.timings = {name: list() for name in CRAWL_STAGES}
+        self.fetch = timed_call("download", self.fetch)
+
+
+class TimedFrontier(Frontier):
+    ''' Frontier whose get_tbd_url, add_url and mark_url_complete are timed. '''
+    def __init__(self, config, restart):
+        super().__init__(config, restart)
+        for name in ("get_tbd_url", "add_url", "mark_url_complete"):
+            setattr(self, name, timed_call(name, getattr(self, name)))
+
+
+def bench_crawl(pages, config):
+    server = CacheServer(0, web=SyntheticWeb(pages)).start()
+    config.cache_server = server.address
+    # Worker.run looks these up on the scraper module at every call.
+    originals = {name: getattr(scraper, name) for name in ("is_valid_current", "scraper")}
+    for name, func in originals.items():
+        setattr(scraper, name, timed_call(name, func))
+    try:
+        crawler = Crawler(config, True, frontier_factory=TimedFrontier,
+                          worker_factory=TimedWorker)
+        started = time.perf_counter()
+        crawler.start()
+        seconds = time.perf_counter() - started
+    finally:
+        for name, func in originals.items():
+            setattr(scraper, name, func)
+        server.stop()
+    stages = dict()
+    for name in CRAWL_STAGES:
+        stages[name] = summarize(
+            [latency for worker in crawler.workers for latency in worker.timings[name]])
+    downloaded = stages["download"]["calls"]
+    links = stages["add_url"]["calls"]
+    return {
+        "site_pages": pages,
+        "threads": config.threads_count,
+        "seconds": round(seconds, 3),
+        "pages": downloaded,
+        "pages_per_second": round(downloaded / seconds, 1),
+        "links_added": links,
+        "links_per_second": round(links / seconds, 1),
+        "stages": stages,
+        "artifact_bytes": {
+            name: os.path.getsize(name) for name in ARTIFACTS if os.path.exists(name)},
+    }
+
+
+def git_commit():
+    try:
+        return subprocess.check_output(
+            ["git", "rev-parse", "HEAD"], cwd=ROOT, stderr=subprocess.DEVNULL).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def main():
+    parser = ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--sizes", default="10000,100000,1000000",
+        help="comma separated url counts for the is_banned and frontier stages")
+    parser.add_argument("--pages", type=int, default=2000,
+        help="synthetic pages for the tokenize and scraper stages")
+    parser.add_argument("--crawl-pages", type=int, default=10000,
+        help="size of the site for the end-to-end crawl, 0 to skip it")
+    parser.add_argument("--threads", type=int, default=8)
+    parser.add_argument("--output", default=None, help="JSON file (default: stdout)")
+    args = parser.parse_args()
+
+    results = {
+        "commit": git_commit(),
+        "python": platform.python_version(),
+        "started": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "sizes": dict(),
+    }
+    workdir = tempfile.mkdtemp(prefix="bench_crawl_")
+    cwd = os.getcwd()
+    os.chdir(workdir)
+    try:
+        for size in [int(size) for size in args.sizes.split(",") if size]:
+            print(f"{size} urls...", file=sys.stderr)
+            results["sizes"][str(size)] = dict(
+                bench_is_banned(size),
+                frontier=bench_frontier(size, make_config({"save_file": f"frontier{size}.db"})))
+        print(f"{args.pages} pages...", file=sys.stderr)
+        results["pages"] = dict(bench_pages(args.pages, make_config()), count=args.pages)
+        if args.crawl_pages:
+            print(f"crawl of {args.crawl_pages} pages...", file=sys.stderr)
+            crawl_dir = os.path.join(workdir, "crawl")
+            os.makedirs(crawl_dir)
+            os.chdir(crawl_dir)
+            results["crawl"] = bench_crawl(
+                args.crawl_pages, make_config({"threads_count": args.threads}))
+    finally:
+        os.chdir(cwd)
+        shutil.rmtree(workdir, ignore_errors=True)
+    results["peak_rss_kb"] = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    text = json.dumps(results, indent=2)
+    if args.output:
+        with open(args.output, "w") as outfile:
+            outfile.write(text + "\n")
+    else:
+        print(text)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,92 @@
+'''
+Compares tokenizewords.tokenize_string with the per-character loop it
+replaced, on page-sized inputs.
+
+    python benchmarks/bench_tokenize.py [page.html ...]
+
+Without arguments it uses synthetic pages of 5KB, 50KB and 500KB of text
+(words, numbers, punctuation and some non-ASCII). With html files it uses
+their visible text, the same text that scraper.is_valid_current tokenizes.
+'''
+import os
+import sys
+import random
+import timeit
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from tokenizewords import (
+    isAlphaNumeric, tokenize_string, tokenize_bytes, iter_tokens)
+
+WORDS = ["research", "faculty", "students", "ICS", "computer", "science",
+    "informatics", "2019", "CS121", "café", "naïve", "e-mail", "Ph.D.",
+    "machine", "learning", "UCI", "Irvine", "the", "and", "of"]
+PUNCTUATION = [" ", " ", " ", ", ", ". ", "\n", " - ", "/", "(", ")"]
+
+
+def tokenize_string_loop(line:str):
+    ''' The original tokenize_string, kept here as the baseline. '''
+    line = line + ' '
+    tokens = []
+    str_len = len(line)
+    start, end = (-1, -1)
+    for i in range(0, str_len):
+        char = line[i]
+        if isAlphaNumeric(char):
+            if start == -1:
+                start, end = (i, i + 1)
+            else:
+                end = i + 1
+        else:
+            if start < end:
+                tokens.append(line[start:end])
+                start, end = (-1, -1)
+    return tokens
+
+
+def synthetic_page(size, seed=121):
+    rand = random.Random(seed)
+    parts = []
+    length = 0
+    while length < size:
+        part = rand.choice(WORDS) + rand.choice(PUNCTUATION)
+        parts.append(part)
+        length += len(part)
+    return "".join(parts)
+
+
+def page_text(filepath):
+    from utils.page import ParsedPage
+    with open(filepath, "rb") as page:
+        return ParsedPage(page.read()).text
+
+
+def bench(name, text, number):
+    assert tokenize_string(text) == tokenize_string_loop(text)
+    assert tokenize_bytes(text.encode("utf-8")) == tokenize_string_loop(text)
+    assert list(iter_tokens(text)) == tokenize_string_loop(text)
+    cases = [
+        ("loop", lambda: tokenize_string_loop(text)),
+        ("regex", lambda: tokenize_string(text)),
+        ("bytes", lambda: tokenize_bytes(text.encode("utf-8"))),
+        ("generator", lambda: sum(1 for _ in iter_tokens(text))),
+    ]
+    baseline = None
+    for case, func in cases:
+        seconds = min(timeit.repeat(func, number=number, repeat=3)) / number
+        baseline = baseline or seconds
+        print(f"{name:>24} {case:>10} {seconds * 1000:10.3f} ms {baseline / seconds:8.1f}x")
+
+
+def main():
+    print(f"{'input':>24} {'engine':>10} {'per call':>13} {'speedup':>9}")
+    if len(sys.argv) > 1:
+        for filepath in sys.argv[1:]:
+            bench(os.path.basename(filepath), page_text(filepath), 20)
+    else:
+        for size, number in [(5000, 200), (50000, 20), (500000, 3)]:
+            bench(f"synthetic {size // 1000}KB", synthetic_page(size), number)
+
+
+if __name__ == "__main__":
+    main()
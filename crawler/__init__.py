@@ -1,4 +1,7 @@
 from utils import get_logger
+from utils.download import download_stats
+from utils import archive
+import scraper
 from crawler.frontier import Frontier
 from crawler.worker import Worker
 
@@ -6,6 +9,8 @@ class Crawler(object):
     def __init__(self, config, restart, frontier_factory=Frontier, worker_factory=Worker):
         self.config = config
         self.logger = get_logger("CRAWLER")
+        scraper.setup(config)
+        archive.setup(config)
         self.frontier = frontier_factory(config, restart)
         self.workers = list()
         self.worker_factory = worker_factory
@@ -24,3 +29,7 @@ class Crawler(object):
     def join(self):
         for worker in self.workers:
             worker.join()
+        self.frontier.close()
+        archive.shutdown()
+        scraper.shutdown()
+        self.logger.info(f"Download stats: {download_stats()}")
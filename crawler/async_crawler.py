@@ -0,0 +1,159 @@
+import time
+import asyncio
+from threading import Thread
+from concurrent.futures import ThreadPoolExecutor
+
+import aiohttp
+
+from utils import get_logger, metrics, archive
+from utils.download import (
+    to_response, failed_response, backoff_delay, count, count_connection, download_stats,
+    log_fetch, RETRY_STATUSES)
+from crawler.frontier import Frontier
+import scraper
+
+# Longest the event loop waits for a download to finish when every queued
+# host is busy
+IDLE_POLL = 0.5
+
+
+class AsyncCrawler(object):
+    '''
+    Crawler that runs all downloads on one asyncio event loop instead of one
+    thread per Worker. Up to config.async_requests downloads are in flight at
+    once through one pooled aiohttp session, while the frontier still applies
+    politeness per host. is_valid_current and scraper run in a thread pool so
+    parsing never blocks the loop.
+    '''
+    def __init__(self, config, restart, frontier_factory=Frontier):
+        self.config = config
+        self.logger = get_logger("CRAWLER")
+        scraper.setup(config)
+        archive.setup(config)
+        self.frontier = frontier_factory(config, restart)
+        self.thread = None
+        self.progress = None
+
+    def start_async(self):
+        self.thread = Thread(target=self.start, daemon=True)
+        self.thread.start()
+
+    def start(self):
+        asyncio.run(self.crawl())
+        self.frontier.close()
+        archive.shutdown()
+        scraper.shutdown()
+        self.logger.info(f"Download stats: {download_stats()}")
+
+    def join(self):
+        if self.thread:
+            self.thread.join()
+
+    async def crawl(self):
+        slots = asyncio.Semaphore(self.config.async_requests)
+        connector = aiohttp.TCPConnector(limit=self.config.async_requests)
+        timeout = aiohttp.ClientTimeout(
+            sock_connect=self.config.connect_timeout,
+            sock_read=self.config.read_timeout)
+        # Counts the connections for download_stats, which only sees the requests pools
+        trace = aiohttp.TraceConfig()
+        trace.on_connection_create_end.append(connection_created)
+        trace.on_connection_reuseconn.append(connection_reused)
+        tasks = set()
+        # Set whenever a url is completed, which may make its host ready again
+        self.progress = asyncio.Event()
+        with ThreadPoolExecutor(self.config.parse_threads) as executor:
+            async with aiohttp.ClientSession(
+                    connector=connector, timeout=timeout, trace_configs=[trace]) as session:
+                while True:
+                    await slots.acquire()
+                    self.progress.clear()
+                    tbd_url = self.frontier.get_tbd_url(block=False)
+                    if tbd_url is None:
+                        slots.release()
+                        if self.frontier.is_finished():
+                            break
+                        wait = self.frontier.time_to_ready()
+                        try:
+                            await asyncio.wait_for(
+                                self.progress.wait(),
+                                IDLE_POLL if wait is None else min(wait, IDLE_POLL))
+                        except asyncio.TimeoutError:
+                            pass
+                        continue
+                    task = asyncio.create_task(
+                        self.crawl_url(session, executor, tbd_url))
+                    tasks.add(task)
+                    task.add_done_callback(tasks.discard)
+                    task.add_done_callback(lambda _: slots.release())
+                await asyncio.gather(*tasks)
+        self.logger.info("Frontier is empty. Stopping Crawler.")
+
+    async def crawl_url(self, session, executor, tbd_url):
+        try:
+            resp = await self.download(session, tbd_url)
+            archive.record(tbd_url, resp)
+            loop = asyncio.get_running_loop()
+            will_scrape, scraped_urls = await loop.run_in_executor(
+                executor, process, tbd_url, resp)
+            if will_scrape[0]:
+                self.logger.info(
+                    f"Downloaded {tbd_url}, status <{resp.status}>, "
+                    f"using cache {self.config.cache_server}.")
+                for scraped_url in scraped_urls:
+                    self.frontier.add_url(scraped_url, tbd_url)
+            else:
+                self.logger.info(will_scrape[1])
+        except Exception:
+            self.logger.exception(f"Failed to process {tbd_url}.")
+        finally:
+            self.frontier.mark_url_complete(tbd_url)
+            self.progress.set()
+
+    async def download(self, session, url):
+        ''' Same as utils.download.download, on the event loop. '''
+        host, port = self.config.cache_server
+        started = time.perf_counter()
+        for attempt in range(self.config.retries + 1):
+            if attempt:
+                await asyncio.sleep(backoff_delay(attempt, self.config))
+            count("requests", attempt)
+            try:
+                started = time.perf_counter()
+                async with session.get(
+                        f"http://{host}:{port}/",
+                        params=[("q", f"{url}"), ("u", f"{self.config.user_agent}")]) as resp:
+                    content = await resp.read() if resp.ok else None
+                    metrics.observe("fetch_seconds", time.perf_counter() - started)
+                    if resp.status in RETRY_STATUSES:
+                        error = f"status {resp.status}"
+                        continue
+                    response = to_response(url, resp, resp.status, content, self.logger)
+                    log_fetch(url, response, len(content or b""), started, attempt + 1)
+                    return response
+            except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+                error = repr(e)
+        count("failures")
+        response = failed_response(
+            url, f"{error} after {self.config.retries + 1} attempts", self.logger)
+        log_fetch(url, response, 0, started, self.config.retries + 1)
+        return response
+
+
+async def connection_created(session, context, params):
+    count_connection(False)
+
+
+async def connection_reused(session, context, params):
+    count_connection(True)
+
+
+def process(url, resp):
+    '''
+    Runs the same scraper calls as Worker.run for one downloaded page.
+    Returns the is_valid_current verdict and the scraped urls.
+    '''
+    will_scrape = scraper.is_valid_current(url, resp)
+    if not will_scrape[0]:
+        return will_scrape, []
+    return will_scrape, scraper.scraper(url, resp)
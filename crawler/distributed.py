@@ -0,0 +1,327 @@
+import os
+import json
+import time
+import socket
+import bisect
+import socketserver
+from collections import Counter
+from hashlib import blake2b
+from threading import Thread, Event
+
+from utils import get_logger, write_json_atomic
+from utils.canonical import canonicalize
+from utils.explored import ExploredStore
+from utils.wordstats import WordStats
+from crawler.frontier import Frontier, get_host
+
+
+class HashRing(object):
+    '''
+    Consistent hashing of hosts onto node ids 0..nodes-1. Each node has
+    replicas points on the ring and a host belongs to the first point after
+    its hash, so adding a node only moves about 1/nodes of the hosts.
+    '''
+    def __init__(self, nodes, replicas=64):
+        points = sorted(
+            (ring_hash(f"node-{node}-{replica}"), node)
+            for node in range(nodes) for replica in range(replicas))
+        self.hashes = [point for point, _ in points]
+        self.nodes = [node for _, node in points]
+
+    def owner(self, host):
+        index = bisect.bisect(self.hashes, ring_hash(host)) % len(self.hashes)
+        return self.nodes[index]
+
+
+def ring_hash(text):
+    return int.from_bytes(blake2b(text.encode("utf-8"), digest_size=8).digest(), "big")
+
+
+def node_filename(filename, node_id):
+    ''' explored.json -> explored.node2.json, the file of node 2. '''
+    root, ext = os.path.splitext(filename)
+    return f"{root}.node{node_id}{ext}"
+
+
+def configure_node(config, node_id):
+    ''' Points every state file of config at the files of node node_id. '''
+    config.node_id = node_id
+    for name in ("save_file", "explored_file", "wordtotals_file",
+                 "simhash_file", "subdomains_file", "metrics_file", "wordstats_file"):
+        setattr(config, name, node_filename(getattr(config, name), node_id))
+    if config.metrics_port:
+        config.metrics_port += node_id
+    if config.archive_file:
+        config.archive_file = node_filename(config.archive_file, node_id)
+    if config.link_graph:
+        config.link_graph = node_filename(config.link_graph, node_id)
+    if config.fetch_log:
+        config.fetch_log = node_filename(config.fetch_log, node_id)
+
+
+class PartitionedFrontier(Frontier):
+    '''
+    Frontier of one node of a distributed crawl (see configure_node).
+
+    Hosts are split between config.peers nodes by a HashRing, so each host,
+    and its politeness delay, belongs to exactly one node. add_url keeps the
+    urls of this node's hosts and queues the others for their owner; a
+    sender thread forwards them in batches of config.forward_batch urls, at
+    least every config.forward_interval seconds, as JSON lines over TCP to
+    the owner's listener at config.peers[owner].
+
+    There is no coordinator. Along with the urls, every node sends the
+    others its status every config.forward_interval seconds: whether it is
+    idle, and how many urls it has sent to and received from each node. A
+    node is finished once it and every other node are idle, every url sent
+    between them was received, and none of that changed for
+    config.idle_timeout seconds. A node not heard from for
+    config.idle_timeout seconds is taken to have stopped; urls for it
+    cannot be delivered and are logged when this node closes.
+    '''
+    def __init__(self, config, restart):
+        self.node_id = config.node_id
+        self.peers = config.peers
+        self.ring = HashRing(len(self.peers))
+        self.outbox = {node: list() for node in range(len(self.peers)) if node != self.node_id}
+        self.connections = dict()
+        self.undelivered = 0
+        # urls sent to and received from each node
+        self.sent = [0] * len(self.peers)
+        self.received = [0] * len(self.peers)
+        # node -> (its last status, time.monotonic() it came)
+        self.peer_status = dict()
+        # The statuses of all nodes while they looked finished, and since when
+        self.quiet_view = None
+        self.quiet_since = 0.0
+        self.stopping = Event()
+        self.wake_sender = Event()
+        super().__init__(config, restart)
+        self.logger = get_logger(f"FRONTIER-{self.node_id}", "FRONTIER")
+        host, port = self.peers[self.node_id]
+        self.server = socketserver.ThreadingTCPServer(
+            (host, port), self._handler(), bind_and_activate=False)
+        self.server.daemon_threads = True
+        self.server.allow_reuse_address = True
+        self.server.server_bind()
+        self.server.server_activate()
+        Thread(target=self.server.serve_forever, daemon=True).start()
+        self.sender = Thread(target=self._send_loop, daemon=True)
+        self.sender.start()
+        self.logger.info(
+            f"Node {self.node_id} of {len(self.peers)} listening on {host}:{port}.")
+
+    def _handler(self):
+        frontier = self
+        class ForwardedUrls(socketserver.StreamRequestHandler):
+            def handle(self):
+                for line in self.rfile:
+                    message = json.loads(line)
+                    if "urls" in message:
+                        frontier.receive(message["urls"], message["node"])
+                    if "status" in message:
+                        frontier.receive_status(message["node"], message["status"])
+        return ForwardedUrls
+
+    def add_url(self, url, parent=None):
+        url = canonicalize(url)
+        if url is None:
+            return
+        owner = self.ring.owner(get_host(url))
+        with self.lock:
+            depth = self.in_progress[parent][1] + 1 if parent in self.in_progress else 0
+            if owner == self.node_id:
+                self._add(url, depth)
+                return
+            self.outbox[owner].append((url, depth))
+            if len(self.outbox[owner]) >= self.config.forward_batch:
+                self.wake_sender.set()
+
+    def receive(self, urls, node):
+        ''' Adds the (url, depth) pairs forwarded by node. '''
+        with self.lock:
+            for url, depth in urls:
+                self._add(url, depth)
+            self.received[node] += len(urls)
+            self.ready.notify_all()
+
+    def receive_status(self, node, status):
+        with self.lock:
+            self.peer_status[node] = (status, time.monotonic())
+
+    def _stopped(self, node, now):
+        ''' True if node has not been heard from for config.idle_timeout seconds. '''
+        seen = self.peer_status.get(node, (None, self.started))[1]
+        return now - seen >= self.config.idle_timeout
+
+    def _status(self):
+        ''' This node's status for the others. Call with the lock held. '''
+        now = time.monotonic()
+        idle = Frontier.is_finished(self) and not any(
+            urls for node, urls in self.outbox.items() if not self._stopped(node, now))
+        return {"idle": idle, "sent": list(self.sent), "received": list(self.received)}
+
+    def _send_loop(self):
+        while not self.stopping.is_set():
+            self.wake_sender.wait(self.config.forward_interval)
+            self.wake_sender.clear()
+            self.forward()
+            self.send_status()
+
+    def send_status(self):
+        ''' Sends this node's status to every other node that can be reached. '''
+        with self.lock:
+            status = self._status()
+        for node in self.outbox:
+            try:
+                self._send_line(node, {"node": self.node_id, "status": status})
+            except OSError:
+                self.connections.pop(node, None)
+
+    def forward(self):
+        ''' Sends every queued batch to its owner; keeps the ones that fail. '''
+        for node in self.outbox:
+            with self.lock:
+                urls, self.outbox[node] = self.outbox[node], list()
+            if not urls:
+                continue
+            try:
+                self._send(node, urls)
+                with self.lock:
+                    self.sent[node] += len(urls)
+            except OSError as error:
+                self.connections.pop(node, None)
+                self.logger.warning(f"Could not forward {len(urls)} urls to node {node}: {error}")
+                with self.lock:
+                    self.outbox[node][:0] = urls
+
+    def _send(self, node, urls):
+        for start in range(0, len(urls), self.config.forward_batch):
+            self._send_line(node, {"node": self.node_id,
+                                   "urls": urls[start:start + self.config.forward_batch]})
+
+    def _send_line(self, node, message):
+        ''' Sends message to node as one JSON line. Only the sender thread calls it. '''
+        connection = self.connections.get(node)
+        if connection is None:
+            host, port = self.peers[node]
+            connection = self.connections[node] = socket.create_connection(
+                (host, port), timeout=self.config.connect_timeout)
+        connection.sendall(json.dumps(message).encode("utf-8") + b"\n")
+
+    def _quiet_view(self):
+        '''
+        The statuses of this node and of every node still heard from, if
+        they are all idle with every url sent between them received; None
+        otherwise. Call with the lock held.
+        '''
+        status = self._status()
+        if not status["idle"]:
+            return None
+        statuses = {self.node_id: status}
+        now = time.monotonic()
+        for node in self.outbox:
+            if self._stopped(node, now): # or never started
+                continue
+            status = self.peer_status.get(node, (None, 0))[0]
+            if status is None or not status["idle"]:
+                return None
+            statuses[node] = status
+        for node, status in statuses.items():
+            for other, other_status in statuses.items():
+                if other != node and status["sent"][other] != other_status["received"][node]:
+                    return None
+        return statuses
+
+    def _done(self):
+        ''' True once _quiet_view has not changed for config.idle_timeout seconds. Call with the lock held. '''
+        view = self._quiet_view()
+        if view is None or view != self.quiet_view:
+            self.quiet_view = view
+            self.quiet_since = time.monotonic()
+            return False
+        return time.monotonic() - self.quiet_since >= self.config.idle_timeout
+
+    def is_finished(self):
+        with self.lock:
+            return super().is_finished() and self._done()
+
+    def get_tbd_url(self, block=True):
+        '''
+        Like Frontier.get_tbd_url, but once this node runs out of urls it
+        keeps waiting for forwarded ones until every node is done (see
+        _done).
+        '''
+        while True:
+            url = super().get_tbd_url(block)
+            if url is not None or not block:
+                return url
+            self.wake_sender.set()
+            with self.ready:
+                if self._done():
+                    return None
+                self.ready.wait(self.config.forward_interval)
+
+    def close(self):
+        self.stopping.set()
+        self.wake_sender.set()
+        self.sender.join()
+        self.forward()
+        self.undelivered = sum(len(urls) for urls in self.outbox.values())
+        if self.undelivered:
+            self.logger.warning(
+                f"{self.undelivered} urls could not be forwarded to their nodes.")
+        for connection in self.connections.values():
+            connection.close()
+        self.server.shutdown()
+        self.server.server_close()
+        super().close()
+
+
+def merge(config, nodes):
+    '''
+    Merges the explored, wordtotals (or wordstats), subdomains and simhash
+    files of nodes 0..nodes-1 into the files named in config, once every
+    node has stopped.
+    '''
+    logger = get_logger("MERGE")
+    approx = config.word_stats == "approx"
+    explored = dict()
+    word_totals = Counter()
+    word_stats = WordStats(config.wordstats_top, config.wordstats_width, config.wordstats_depth)
+    subdomains = Counter()
+    with open(config.simhash_file, "wb") as hashfile:
+        for node in range(nodes):
+            # A url counted by the node that owns it wins over the 0 of the
+            # node that only discovered it.
+            for url, value in ExploredStore(node_filename(config.explored_file, node)).items():
+                if not explored.get(url):
+                    explored[url] = value
+            counters = [(config.subdomains_file, subdomains)]
+            if approx:
+                word_stats.merge(WordStats.load(
+                    node_filename(config.wordstats_file, node), config.wordstats_top,
+                    config.wordstats_width, config.wordstats_depth))
+            else:
+                counters.append((config.wordtotals_file, word_totals))
+            for filename, counter in counters:
+                try:
+                    with open(node_filename(filename, node), "r") as setfile:
+                        counter.update(json.load(setfile))
+                except FileNotFoundError:
+                    logger.warning(f"No {node_filename(filename, node)}, skipping it.")
+            try:
+                with open(node_filename(config.simhash_file, node), "rb") as nodefile:
+                    hashfile.write(nodefile.read())
+            except FileNotFoundError:
+                pass
+    write_json_atomic(config.explored_file, explored)
+    if approx:
+        word_stats.save(config.wordstats_file)
+    else:
+        write_json_atomic(config.wordtotals_file, word_totals)
+    write_json_atomic(config.subdomains_file, subdomains)
+    logger.info(
+        f"Merged {nodes} nodes: {len(explored)} explored urls, "
+        f"{len(word_stats.top_k.counts) if approx else len(word_totals)} words, "
+        f"{len(subdomains)} subdomains.")
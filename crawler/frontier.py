@@ -1,73 +1,415 @@
 import os
-import shelve
+import re
+import time
+import heapq
+import bisect
+import itertools
 
-from threading import Thread, RLock
+from threading import Thread, RLock, Condition
 from queue import Queue, Empty
 
-from utils import get_logger, get_urlhash, normalize
+from utils import get_logger, get_urlkey, metrics
+from utils.canonical import canonicalize
+from utils.bloom import ScalableBloomFilter
+from crawler.store import SAVE_BACKENDS, ShelveStore
+from crawler.scoring import get_scorer
 from scraper import is_valid
-from scraper import can_be_frontier
+from scraper import filter_frontier
+from scraper import is_trap
+from scraper import discovered_urls
+
+# Urls read from the save file and screened per step when resuming
+RESUME_BATCH = 10000
+# scheme://netloc of a url, the way urlparse splits it
+HOST_PATTERN = re.compile(r"(?:[a-zA-Z][a-zA-Z0-9+.-]*:)?//([^/?#]*)")
 
 class Frontier(object):
+    '''
+    Thread safe frontier that enforces politeness per host.
+
+    Urls are queued per host. A host is handed to at most one worker at a
+    time, and becomes ready again config.time_delay seconds after that
+    worker calls mark_url_complete. Idle hosts with queued urls wait in a
+    heap ordered by the time they become ready, so get_tbd_url always serves
+    the host that has waited out its delay first.
+
+    Within a host, urls are served best first by the score of the configured
+    scorer (see crawler/scoring.py: depth from the seeds, pages the host has
+    had, trap-looking patterns). Each host queue keeps at most
+    config.host_queue urls; when it is full the worst one is dropped from
+    memory. Dropped urls stay pending in the save file, and are read back
+    from it once the queue of their host has run empty.
+
+    Every url ever added is also kept in a scalable Bloom filter (persisted
+    as SAVE.bloom), so add_url only asks the save file about urls the filter
+    has probably seen; definitely new urls are added without a lookup.
+
+    When resuming, the pending urls of the save file are loaded in batches
+    by a background thread, so workers start on the first batch while the
+    rest is still being read.
+    '''
     def __init__(self, config, restart):
+        self.started = time.monotonic()
+        self.first_url_time = None
         self.logger = get_logger("FRONTIER")
         self.config = config
-        self.to_be_downloaded = list()
-        
-        if not os.path.exists(self.config.save_file + '.bak') and not restart:
+        self.lock = RLock()
+        self.ready = Condition(self.lock)
+        self.scorer = get_scorer(config)
+        # host -> list of (-score, -order, url, depth) to be downloaded from
+        # that host, sorted so that the best url is last
+        self.to_be_downloaded = dict()
+        self.order = itertools.count()
+        # host -> pages downloaded from it
+        self.host_pages = dict()
+        # urls dropped from full host queues, and urls read back from the
+        # save file into empty ones
+        self.dropped = 0
+        self.refilled = 0
+        # hosts that dropped urls which may still be pending in the save file
+        self.overflow = set()
+        # queued urls skipped because their template was banned as a trap
+        self.trapped = 0
+        # heap of (ready time, host) for idle hosts that have urls queued
+        self.ready_hosts = list()
+        self.scheduled_hosts = set()
+        # host -> earliest time.monotonic() its next download may start
+        self.next_allowed = dict()
+        # url -> (host, depth), for urls handed out but not marked complete yet
+        self.in_progress = dict()
+        self.busy_hosts = set()
+        # True while the save file is still being loaded
+        self.loading = False
+        self.loader = None
+
+        store = SAVE_BACKENDS[self.config.save_backend]
+        # The shelve save file of a crawl started before SAVE was a database
+        legacy_file = os.path.splitext(self.config.save_file)[0] + ".shelve"
+        if (not restart and store is not ShelveStore and ShelveStore.exists(legacy_file)
+                and not store.exists(self.config.save_file)):
+            self._convert(legacy_file, store)
+        if not store.exists(self.config.save_file) and not restart:
             # Save file does not exist, but request to load save.
             self.logger.info(
                 f"Did not find save file {self.config.save_file}, "
                 f"starting from seed.")
-        elif os.path.exists(self.config.save_file + '.bak') and restart:
+        elif store.exists(self.config.save_file) and restart:
             # Save file does exists, but request to start from seed.
             self.logger.info(
                 f"Found save file {self.config.save_file}, deleting it.")
-            os.remove(self.config.save_file)
+            store.remove(self.config.save_file)
         # Load existing save file, or create one if it does not exist.
-        self.save = shelve.open(self.config.save_file)
+        self.save = store(self.config.save_file, self.config)
+        self.bloom_file = self.config.save_file + ".bloom"
+        if restart and os.path.exists(self.bloom_file):
+            os.remove(self.bloom_file)
+        self.seen = self._load_seen()
         if restart:
             for url in self.config.seed_urls:
                 self.add_url(url)
+        elif not len(self.save):
+            for url in self.config.seed_urls:
+                self.add_url(url)
         else:
             # Set the frontier state with contents of save file.
-            self._parse_save_file()
-            if not self.save:
-                for url in self.config.seed_urls:
-                    self.add_url(url)
+            # The pending urls are fixed here, before any worker adds more.
+            self.loading = True
+            self.loader = Thread(
+                target=self._parse_save_file, args=(self.save.pending(RESUME_BATCH),),
+                daemon=True)
+            self.loader.start()
+        metrics.register_gauge("frontier_queued", self.queued)
+        metrics.register_gauge("frontier_host_queue", self.host_queues, label="host")
+        metrics.register_gauge("frontier_in_progress", lambda: len(self.in_progress))
+        metrics.register_gauge("frontier_dropped", lambda: self.dropped)
+        metrics.register_gauge("frontier_refilled", lambda: self.refilled)
+        metrics.register_gauge("frontier_trapped", lambda: self.trapped)
+        self.logger.info(
+            f"Frontier started in {time.monotonic() - self.started:.3f}s.")
 
-    def _parse_save_file(self):
-        ''' This function can be overridden for alternate saving techniques. '''
+    def _convert(self, legacy_file, store):
+        '''
+        Copies the urls of the shelve save file legacy_file into a new save
+        file of store, so a crawl started with the shelve save file resumes
+        instead of starting from the seeds. legacy_file is left as it is.
+        '''
+        legacy = ShelveStore(legacy_file, self.config)
+        save = store(self.config.save_file, self.config)
+        try:
+            save.add_records(legacy.records())
+            count = len(save)
+        finally:
+            save.close()
+            legacy.close()
+        self.logger.info(
+            f"Converted {count} urls of save file {legacy_file} "
+            f"into {self.config.save_file}.")
+
+    def _load_seen(self):
+        '''
+        Loads the Bloom filter of the save file. It is only written when the
+        crawler stops, so after a crash (or with a save file from elsewhere)
+        the number of keys does not match and it is rebuilt from the urls.
+        '''
+        seen = ScalableBloomFilter.load(
+            self.bloom_file, self.config.bloom_capacity, self.config.bloom_error)
+        count = len(self.save)
+        if len(seen) != count:
+            self.logger.info(
+                f"Bloom filter {self.bloom_file} is out of date, "
+                f"rebuilding it from {count} urls.")
+            seen = ScalableBloomFilter(self.config.bloom_capacity, self.config.bloom_error)
+            for url in self.save.urls():
+                seen.add(get_urlkey(url))
+        return seen
+
+    def _parse_save_file(self, batches):
+        '''
+        This function can be overridden for alternate saving techniques.
+        Runs on the loader thread: pushes the batches of pending urls of the
+        save file, screened in bulk with filter_frontier (the batch version
+        of can_be_frontier). batches only holds the urls pending when the
+        frontier started, so urls the workers add meanwhile are not pushed
+        a second time.
+        '''
         total_count = len(self.save)
         tbd_count = 0
-        for url, completed in self.save.values():
-            if not completed and can_be_frontier(url): # Here's where I replaced the call to is_valid() with a call to can_be_frontier()
-                self.to_be_downloaded.append(url)
-                tbd_count += 1
+        try:
+            while True:
+                with self.lock:
+                    batch = next(batches, None)
+                if batch is None:
+                    break
+                keep = set(filter_frontier([url for url, _ in batch]))
+                with self.lock:
+                    for url, depth in batch:
+                        if url in keep:
+                            self._push(url, depth)
+                tbd_count += len(keep)
+            self._requeue_discovered()
+        finally:
+            with self.lock:
+                self.loading = False
+                for host in list(self.overflow):
+                    if host not in self.to_be_downloaded and host not in self.busy_hosts:
+                        self._refill(host)
+                self.ready.notify_all()
         self.logger.info(
             f"Found {tbd_count} urls to be downloaded from {total_count} "
-            f"total urls discovered.")
+            f"total urls discovered, in {time.monotonic() - self.started:.3f}s.")
 
-    def get_tbd_url(self):
-        try:
-            return self.to_be_downloaded.pop()
-        except IndexError:
-            return None
-
-    def add_url(self, url):
-        url = normalize(url)
-        urlhash = get_urlhash(url)
-        if urlhash not in self.save:
-            self.save[urlhash] = (url, False)
-            self.save.sync()
-            self.to_be_downloaded.append(url)
+    def _requeue_discovered(self):
+        '''
+        Adds the urls explored.json has as discovered that the save file does
+        not have: a crash, or an interrupted run, can lose the last frontier
+        writes after explored.json got them. is_valid turns these urls down as
+        explored, so they would never be crawled otherwise. Their depth is
+        not known and taken as 0.
+        '''
+        urls = discovered_urls()
+        before = len(self.save)
+        for url in urls:
+            self.add_url(url)
+        added = len(self.save) - before
+        if added:
+            self.logger.info(
+                f"Queued {added} urls of {len(urls)} discovered in explored.json "
+                f"that were missing from the save file.")
+
+    def _push(self, url, depth=0):
+        '''
+        Queues url under its host by score and schedules the host if it is
+        idle. Drops the worst url of the host if its queue is full.
+        '''
+        host = get_host(url)
+        with self.lock:
+            score = self.scorer.score(url, depth, self.host_pages.get(host, 0))
+            urls = self.to_be_downloaded.setdefault(host, list())
+            bisect.insort(urls, (-score, -next(self.order), url, depth))
+            if len(urls) > self.config.host_queue:
+                del urls[0]
+                self.dropped += 1
+                self.overflow.add(host)
+            self._schedule(host)
+
+    def _refill(self, host):
+        '''
+        Queues again up to config.host_queue pending urls of host from the
+        save file, once the queue of host has run empty. Only called when no
+        worker holds a url of host, and not while the save file is loading
+        (the loader would push the same urls). Urls filter_frontier turns
+        down are marked complete, so they are not read again.
+        '''
+        limit = self.config.host_queue
+        while host in self.overflow and host not in self.to_be_downloaded:
+            rows = self.save.pending_on_host(host, limit)
+            if len(rows) < limit:
+                self.overflow.discard(host)
+            keep = set(filter_frontier([url for url, _ in rows]))
+            for url, depth in rows:
+                if url in keep:
+                    self._push(url, depth)
+                else:
+                    self.save.mark_complete(url)
+            self.refilled += len(keep)
+
+    def _schedule(self, host):
+        if (host in self.scheduled_hosts or host in self.busy_hosts
+                or not self.to_be_downloaded.get(host)):
+            return
+        heapq.heappush(self.ready_hosts, (self.next_allowed.get(host, 0), host))
+        self.scheduled_hosts.add(host)
+        self.ready.notify()
+
+    def get_tbd_url(self, block=True):
+        '''
+        Returns the next url whose host is ready, waiting for one if needed.
+        Returns None only when nothing is queued, the save file is loaded and
+        no other worker holds a url that could still add more. With block=False it returns None right
+        away if no host is ready yet (see is_finished and time_to_ready).
+        '''
+        with self.ready:
+            while True:
+                url, wait = self._pop_ready()
+                if url is not None and self.first_url_time is None:
+                    self.first_url_time = time.monotonic() - self.started
+                    self.logger.info(
+                        f"First url handed out {self.first_url_time:.3f}s "
+                        f"after the frontier started.")
+                if url is not None or not block:
+                    return url
+                if wait is not None:
+                    self.ready.wait(wait)
+                elif self.in_progress or self.loading:
+                    self.ready.wait()
+                else:
+                    return None
+
+    def _pop_ready(self):
+        '''
+        Returns (url, None) for the first ready host, or (None, seconds until
+        the next host is ready), or (None, None) if no host is scheduled.
+        Queued urls whose template was banned as a trap since they were
+        queued are marked complete instead of handed out.
+        '''
+        while self.ready_hosts:
+            ready_time, host = self.ready_hosts[0]
+            wait = ready_time - time.monotonic()
+            if wait > 0:
+                return None, wait
+            heapq.heappop(self.ready_hosts)
+            self.scheduled_hosts.discard(host)
+            urls = self.to_be_downloaded[host]
+            url = None
+            while urls:
+                _, _, url, depth = urls.pop()
+                if not is_trap(url):
+                    break
+                self.save.mark_complete(url)
+                self.trapped += 1
+                url = None
+            if not urls:
+                del self.to_be_downloaded[host]
+            if url is not None:
+                self.in_progress[url] = (host, depth)
+                self.busy_hosts.add(host)
+                return url, None
+            if host in self.overflow and not self.loading:
+                self._refill(host)
+                self._schedule(host)
+        return None, None
+
+    def time_to_ready(self):
+        ''' Seconds until some host is ready, or None if no host has urls queued. '''
+        with self.lock:
+            if not self.ready_hosts:
+                return None
+            return max(self.ready_hosts[0][0] - time.monotonic(), 0)
+
+    def is_finished(self):
+        ''' True when nothing is queued or loading and no url is being downloaded. '''
+        with self.lock:
+            return not self.ready_hosts and not self.in_progress and not self.loading
+
+    def add_url(self, url, parent=None):
+        '''
+        Adds url if it was never added before. parent is the url of the page
+        it was found on (None for seeds); its depth is one more than parent's.
+        '''
+        url = canonicalize(url)
+        if url is None:
+            return
+        with self.lock:
+            depth = self.in_progress[parent][1] + 1 if parent in self.in_progress else 0
+            self._add(url, depth)
+
+    def _add(self, url, depth):
+        ''' add_url for a canonical url whose depth is known. '''
+        key = get_urlkey(url)
+        with self.lock:
+            if key in self.seen:
+                # Probably seen: only the save file knows for sure
+                if not self.save.add(url, depth):
+                    return
+            else:
+                self.save.add_new(url, depth)
+            self.seen.add(key)
+            self._push(url, depth)
     
     def mark_url_complete(self, url):
-        urlhash = get_urlhash(url)
-        if urlhash not in self.save:
-            # This should not happen.
-            self.logger.error(
-                f"Completed url {url}, but have not seen it before.")
-
-        self.save[urlhash] = (url, True)
-        self.save.sync()
+        with self.lock:
+            if not self.save.mark_complete(url):
+                self.seen.add(get_urlkey(url))
+                # This should not happen.
+                self.logger.error(
+                    f"Completed url {url}, but have not seen it before.")
+
+            host, _ = self.in_progress.pop(url, (None, None))
+            if host is not None:
+                self.busy_hosts.discard(host)
+                if (host in self.overflow and host not in self.to_be_downloaded
+                        and not self.loading):
+                    self._refill(host)
+                self.host_pages[host] = self.host_pages.get(host, 0) + 1
+                self.next_allowed[host] = time.monotonic() + self.config.time_delay
+                self._schedule(host)
+            # Wake up workers waiting on this url: either its host is ready
+            # later or the crawl is over.
+            self.ready.notify_all()
+
+    def flush(self):
+        ''' Commits every frontier change the save file still holds back. '''
+        with self.lock:
+            self.save.flush()
+
+    def queued(self):
+        ''' Number of urls waiting in the host queues. '''
+        with self.lock:
+            return sum(len(queue) for queue in self.to_be_downloaded.values())
+
+    def host_queues(self):
+        ''' host -> number of urls waiting in its queue. '''
+        with self.lock:
+            return {host: len(queue) for host, queue in self.to_be_downloaded.items() if queue}
+
+    def close(self):
+        ''' Writes out whatever the save file has not committed yet. '''
+        if self.loader is not None:
+            self.loader.join()
+        with self.lock:
+            self.save.close()
+            with metrics.timer(metrics.series("flush_seconds", file="bloom")):
+                self.seen.save(self.bloom_file)
+        if self.dropped:
+            self.logger.info(
+                f"Dropped {self.dropped} urls from full host queues and "
+                f"read {self.refilled} back from the save file.")
+        if self.trapped:
+            self.logger.info(
+                f"Skipped {self.trapped} queued urls whose template was banned as a trap.")
+
+
+def get_host(url):
+    ''' urlparse(url).netloc.lower(), without parsing the rest of the url. '''
+    match = HOST_PATTERN.match(url)
+    return match.group(1).lower() if match else ""
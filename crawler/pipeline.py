@@ -0,0 +1,146 @@
+import os
+import multiprocessing
+from threading import Thread, BoundedSemaphore
+from queue import Queue
+
+from utils import get_logger, archive
+from utils.download import download, download_stats
+from crawler.frontier import Frontier
+import scraper
+
+
+class FetchWorker(Thread):
+    '''
+    Downloads urls from the frontier and puts (url, status, content,
+    address) on the fetched queue (see scraper.page_address). Blocks when the queue is full, so downloads never run
+    more than queue_size pages ahead of parsing.
+    '''
+    def __init__(self, worker_id, config, frontier, fetched):
+        self.logger = get_logger(f"Worker-{worker_id}", "Worker")
+        self.config = config
+        self.frontier = frontier
+        self.fetched = fetched
+        super().__init__(daemon=True)
+
+    def run(self):
+        while True:
+            tbd_url = self.frontier.get_tbd_url()
+            if not tbd_url:
+                self.logger.info("Frontier is empty. Stopping Crawler.")
+                break
+            try:
+                resp = download(tbd_url, self.config, self.logger)
+                archive.record(tbd_url, resp)
+                content = resp.raw_response.content if resp.raw_response is not None else None
+                item = (tbd_url, resp.status, content, scraper.page_address(tbd_url, resp))
+            except Exception:
+                self.logger.exception(f"Failed to download {tbd_url}.")
+                self.frontier.mark_url_complete(tbd_url)
+                continue
+            self.fetched.put(item)
+        self.fetched.put(None)
+
+
+class PipelineCrawler(object):
+    '''
+    Crawler that splits each page into three stages:
+
+    - THREADCOUNT FetchWorker threads download pages into a bounded queue.
+    - A pool of PARSEPROCESSES processes runs scraper.analyze_content on
+      them (parsing, tokenizing, checksum, link filtering), with at most
+      PIPELINEQUEUE pages handed to the pool at once.
+    - One aggregator, the thread that calls join, applies the compact
+      results to the crawl state with scraper.record_page and scraper.is_valid,
+      and updates the frontier.
+    '''
+    def __init__(self, config, restart, frontier_factory=Frontier):
+        self.config = config
+        self.logger = get_logger("CRAWLER")
+        scraper.setup(config)
+        archive.setup(config)
+        self.frontier = frontier_factory(config, restart)
+        self.fetched = Queue(maxsize=config.pipeline_queue)
+        # A slot is taken for each page handed to the pool and given back once
+        # the aggregator has applied its result, so at most pipeline_queue
+        # pages are being parsed or waiting in results.
+        self.results = Queue()
+        self.slots = BoundedSemaphore(config.pipeline_queue)
+        self.workers = list()
+        self.pool = None
+        self.dispatcher = None
+
+    def start_async(self):
+        # The log listener, save file committer, loader and metrics threads
+        # already run, so the processes are not forked from this one (a child
+        # could inherit a lock one of them holds): forkserver starts them from
+        # a clean process, or spawn where there is no forkserver.
+        methods = multiprocessing.get_all_start_methods()
+        context = multiprocessing.get_context(
+            "forkserver" if "forkserver" in methods else "spawn")
+        self.pool = context.Pool(self.config.parse_processes or os.cpu_count())
+        self.workers = [
+            FetchWorker(worker_id, self.config, self.frontier, self.fetched)
+            for worker_id in range(self.config.threads_count)]
+        self.dispatcher = Thread(target=self.dispatch, daemon=True)
+        self.dispatcher.start()
+        for worker in self.workers:
+            worker.start()
+
+    def start(self):
+        self.start_async()
+        self.join()
+
+    def dispatch(self):
+        ''' Hands fetched pages to the process pool until every FetchWorker stopped. '''
+        stopped = 0
+        while stopped < len(self.workers):
+            item = self.fetched.get()
+            if item is None:
+                stopped += 1
+                continue
+            self.slots.acquire()
+            self.pool.apply_async(
+                scraper.analyze_content, item,
+                callback=self.collect,
+                error_callback=lambda error, url=item[0]: self.collect((url, None, error, [])))
+        self.pool.close()
+        self.pool.join()
+        self.results.put(None)
+
+    def collect(self, result):
+        self.results.put(result)
+
+    def join(self):
+        ''' Runs the aggregator until the crawl is over. '''
+        while True:
+            result = self.results.get()
+            if result is None:
+                break
+            tbd_url, status, summary, links = result
+            if status is None: # analyze_content raised summary
+                self.logger.error(f"Failed to process {tbd_url}: {summary!r}")
+                self.frontier.mark_url_complete(tbd_url)
+                self.slots.release()
+                continue
+            try:
+                will_scrape = scraper.record_page(tbd_url, status, summary)
+                if will_scrape[0]:
+                    self.logger.info(
+                        f"Downloaded {tbd_url}, status <{status}>, "
+                        f"using cache {self.config.cache_server}.")
+                    scraper.record_links(tbd_url, links)
+                    for link in links:
+                        if scraper.is_valid(link):
+                            self.frontier.add_url(link, tbd_url)
+                else:
+                    self.logger.info(will_scrape[1])
+            except Exception:
+                self.logger.exception(f"Failed to process {tbd_url}.")
+            self.frontier.mark_url_complete(tbd_url)
+            self.slots.release()
+        for worker in self.workers:
+            worker.join()
+        self.frontier.close()
+        archive.shutdown()
+        scraper.shutdown()
+        self.logger.info(f"Download stats: {download_stats()}")
@@ -0,0 +1,67 @@
+import time
+
+from utils import get_logger
+from utils.archive import ArchiveReader
+from utils.download import failed_response
+from crawler import Crawler
+from crawler.worker import Worker
+import scraper
+
+
+class ReplayWorker(Worker):
+    '''
+    Worker that takes pages from a page archive (see utils/archive.py)
+    instead of the cache server. Urls that are not in the archive get the
+    Response of a failed download.
+    '''
+    def __init__(self, worker_id, config, frontier, reader):
+        self.reader = reader
+        self.replayed = 0
+        super().__init__(worker_id, config, frontier)
+
+    def fetch(self, url):
+        page = self.reader.get(url)
+        if page is None:
+            return failed_response(url, "not in the archive")
+        self.replayed += 1
+        return page.response()
+
+
+def replay_archive(config, restart, filename, sequential=False):
+    '''
+    Runs the pages of the archive filename through scraper.is_valid_current
+    and scraper.scraper, rebuilding the crawl state without the cache server.
+
+    By default this is a crawl from config.seed_urls by ReplayWorker threads,
+    so the frontier filters and follows the links as before. With sequential,
+    every page of the archive is processed once in the order it was written
+    and the links are not followed.
+    '''
+    logger = get_logger("REPLAY")
+    reader = ArchiveReader(filename)
+    # Sorts the index before the workers share the reader.
+    logger.info(f"Replaying {len(reader)} pages of {filename}.")
+    config.time_delay = 0
+    config.archive_file = ""
+    config.cache_server = f"archive {filename}"
+    started = time.perf_counter()
+    pages = 0
+    if sequential:
+        scraper.setup(config)
+        try:
+            for page in reader:
+                resp = page.response()
+                if scraper.is_valid_current(page.url, resp)[0]:
+                    scraper.scraper(page.url, resp)
+                pages += 1
+        finally:
+            scraper.shutdown()
+    else:
+        crawler = Crawler(
+            config, restart, worker_factory=lambda worker_id, config, frontier:
+                ReplayWorker(worker_id, config, frontier, reader))
+        crawler.start()
+        pages = sum(worker.replayed for worker in crawler.workers)
+    elapsed = time.perf_counter() - started
+    reader.close()
+    logger.info(f"Replayed {pages} pages in {elapsed:.1f}s ({pages / max(elapsed, 1e-9):.0f} pages/s).")
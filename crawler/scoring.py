@@ -0,0 +1,103 @@
+import re
+import math
+import os
+from importlib import import_module
+
+from utils import get_logger, get_urlkey
+
+# Path and query words typical of calendars, wikis and other link generators
+TRAP_WORDS = re.compile(
+    r"calendar|/events?/|/page/\d|replytocom|share=|action=|do=|ical|"
+    r"/tags?/|/archive|sort=|order=|filter|session|/\d{4}/\d{1,2}/")
+
+
+class DefaultScorer(object):
+    '''
+    Scores a url for the frontier; lower scores are downloaded first.
+
+    score = depth (links from the nearest seed)
+          + TRAP_WEIGHT * trap score of the url pattern (see trap_score)
+          + pages already downloaded from the host / config.host_budget
+
+    so shallow, ordinary-looking urls on hosts that have not had their
+    share yet go first, and calendar or wiki pages wait until nothing better
+    is left on their host.
+
+    Any class with the same constructor and score method can be used
+    instead by naming it in the SCORER setting.
+    '''
+    TRAP_WEIGHT = 2.0
+
+    def __init__(self, config):
+        self.host_budget = max(config.host_budget, 1)
+
+    def score(self, url, depth, host_pages):
+        '''
+        url: canonical url. depth: number of links from a seed url.
+        host_pages: pages downloaded from its host so far.
+        '''
+        return depth + self.TRAP_WEIGHT * trap_score(url) + host_pages / self.host_budget
+
+
+class GraphScorer(DefaultScorer):
+    '''
+    DefaultScorer adjusted by the link graph of an earlier run (LINKGRAPH,
+    see utils/graphstats.py, which writes LINKGRAPH.scores.npz):
+
+    score = DefaultScorer score
+          - RANK_WEIGHT * log2(1 + PageRank relative to the average url)
+          + TRAP_REGION_WEIGHT if the url is in a likely trap region
+
+    Urls the graph does not know, or every url if there is no scores file
+    yet, get the DefaultScorer score. Needs numpy.
+    '''
+    RANK_WEIGHT = 1.0
+    TRAP_REGION_WEIGHT = 4.0
+
+    def __init__(self, config):
+        super().__init__(config)
+        from utils.graphstats import load_scores
+        filename = f"{config.link_graph}.scores.npz"
+        self.keys = None
+        if config.link_graph and os.path.exists(filename):
+            self.keys, self.rank, self.trap = load_scores(filename)
+        else:
+            get_logger("FRONTIER").warning(
+                f"No link graph scores in {filename}, using the default scores.")
+
+    def score(self, url, depth, host_pages):
+        score = super().score(url, depth, host_pages)
+        if self.keys is None or not len(self.keys):
+            return score
+        key = get_urlkey(url)
+        position = int(self.keys.searchsorted(key))
+        # numpy drops the trailing null bytes of the S16 items it returns
+        if position == len(self.keys) or self.keys[position] != key.rstrip(b"\0"):
+            return score
+        score -= self.RANK_WEIGHT * math.log2(1 + float(self.rank[position]))
+        if self.trap[position]:
+            score += self.TRAP_REGION_WEIGHT
+        return score
+
+
+def trap_score(url):
+    '''
+    How much url looks like it was generated by a crawler trap: repeated
+    path segments, very deep paths, many query parameters and trap words.
+    0 for an ordinary url.
+    '''
+    path, _, query = url.partition("?")
+    segments = [segment for segment in path.split("/")[3:] if segment]
+    score = 2 * (len(segments) - len(set(segments)))
+    score += max(len(segments) - 6, 0)
+    if query:
+        score += query.count("&") + 1
+    if TRAP_WORDS.search(url.lower()):
+        score += 1
+    return score
+
+
+def get_scorer(config):
+    ''' Creates the scorer named by config.scorer ("module.ClassName"). '''
+    module_name, _, class_name = config.scorer.rpartition(".")
+    return getattr(import_module(module_name), class_name)(config)
@@ -0,0 +1,327 @@
+import os
+import glob
+import shelve
+import sqlite3
+from urllib.parse import urlsplit
+from threading import Thread, RLock, Event
+
+from utils import get_urlhash, get_urlkey, metrics
+
+FLUSH_SERIES = metrics.series("flush_seconds", file="save")
+# Columns of the urls table of SqliteStore
+URLS_COLUMNS = ("key BLOB PRIMARY KEY, url TEXT NOT NULL, completed INTEGER NOT NULL, "
+                "depth INTEGER NOT NULL DEFAULT 0")
+
+
+class ShelveStore(object):
+    '''
+    The original save file: a shelve of urlhash -> (url, completed, depth),
+    synced after every write. Records of older save files have no depth.
+    '''
+    def __init__(self, filename, config):
+        self.save = shelve.open(filename)
+
+    @staticmethod
+    def exists(filename):
+        return os.path.exists(filename + '.bak')
+
+    @staticmethod
+    def remove(filename):
+        for path in glob.glob(filename + '*'):
+            os.remove(path)
+
+    def __len__(self):
+        return len(self.save)
+
+    def __contains__(self, url):
+        return get_urlhash(url) in self.save
+
+    def add(self, url, depth=0):
+        ''' Adds url as not completed. Returns False if it was already there. '''
+        urlhash = get_urlhash(url)
+        if urlhash in self.save:
+            return False
+        self.save[urlhash] = (url, False, depth)
+        self.flush()
+        return True
+
+    def add_new(self, url, depth=0):
+        ''' add for a url known not to be there yet: skips the lookup. '''
+        self.save[get_urlhash(url)] = (url, False, depth)
+        self.flush()
+
+    def mark_complete(self, url):
+        ''' Marks url as completed. Returns False if it was not there before. '''
+        urlhash = get_urlhash(url)
+        known = urlhash in self.save
+        self.save[urlhash] = (url, True)
+        self.flush()
+        return known
+
+    def urls(self):
+        ''' Yields every url, completed or not. '''
+        for urlhash in list(self.save.keys()):
+            yield self.save[urlhash][0]
+
+    def records(self):
+        ''' Yields (url, completed, depth) for every url. '''
+        for urlhash in list(self.save.keys()):
+            record = self.save[urlhash]
+            yield record[0], bool(record[1]), record[2] if len(record) > 2 else 0
+
+    def pending(self, batch_size=10000):
+        '''
+        Iterator over lists of at most batch_size (url, depth) pairs that
+        are not completed. Only the urls already there when pending is
+        called are read, not the ones added while it is iterated.
+        '''
+        return self._pending(list(self.save.keys()), batch_size)
+
+    def _pending(self, urlhashes, batch_size):
+        batch = list()
+        for urlhash in urlhashes:
+            record = self.save[urlhash]
+            if not record[1]:
+                batch.append((record[0], record[2] if len(record) > 2 else 0))
+                if len(batch) >= batch_size:
+                    yield batch
+                    batch = list()
+        if batch:
+            yield batch
+
+    def pending_on_host(self, host, limit):
+        ''' At most limit (url, depth) pairs not completed whose netloc is host. '''
+        found = list()
+        for urlhash in list(self.save.keys()):
+            record = self.save[urlhash]
+            if not record[1] and urlsplit(record[0]).netloc.lower() == host:
+                found.append((record[0], record[2] if len(record) > 2 else 0))
+                if len(found) >= limit:
+                    break
+        return found
+
+    def flush(self):
+        with metrics.timer(FLUSH_SERIES):
+            self.save.sync()
+
+    def close(self):
+        self.save.close()
+
+
+class SqliteStore(object):
+    '''
+    Save file in SQLite (WAL mode) with an index on completion state, so
+    resuming reads only the pending urls. Urls are keyed by their 16-byte
+    get_urlkey digest.
+
+    Writes are grouped: they are committed once batch_size of them are
+    waiting, and a background thread commits whatever is waiting every
+    window seconds. A crash loses at most window seconds of frontier
+    changes: urls completed in that time are downloaded again, and urls
+    added in that time are missing (the Frontier queues them again from
+    explored.json when it resumes).
+    Urls known to be new (add_new) are buffered and inserted together with
+    one executemany before anything else reads or writes the table.
+    '''
+    def __init__(self, filename, config):
+        self.batch_size = config.save_batch
+        self.window = config.save_window
+        self.lock = RLock()
+        self.conn = sqlite3.connect(filename, isolation_level=None, check_same_thread=False)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        self.conn.execute("CREATE TABLE IF NOT EXISTS urls (" + URLS_COLUMNS + ")")
+        columns = [row[1] for row in self.conn.execute("PRAGMA table_info(urls)")]
+        if "key" not in columns: # save file keyed by the hex get_urlhash
+            self._rekey()
+            columns = [row[1] for row in self.conn.execute("PRAGMA table_info(urls)")]
+        if "depth" not in columns: # save file from before urls had a depth
+            self.conn.execute("ALTER TABLE urls ADD COLUMN depth INTEGER NOT NULL DEFAULT 0")
+        self.conn.execute(
+            "CREATE INDEX IF NOT EXISTS pending_urls ON urls (completed) WHERE completed = 0")
+        self.writes = 0
+        self.new_rows = list()
+        self.closed = Event()
+        self.committer = Thread(target=self._commit_every_window, daemon=True)
+        self.committer.start()
+
+    def _rekey(self, batch_size=10000):
+        '''
+        Copies the urls of a save file keyed by get_urlhash (hash TEXT) into
+        a urls table keyed by get_urlkey, in one transaction.
+        '''
+        self.conn.execute("BEGIN")
+        self.conn.execute("DROP INDEX IF EXISTS pending_urls")
+        self.conn.execute("ALTER TABLE urls RENAME TO urls_by_hash")
+        self.conn.execute("CREATE TABLE urls (" + URLS_COLUMNS + ")")
+        last = 0
+        while True:
+            rows = self.conn.execute(
+                "SELECT rowid, url, completed FROM urls_by_hash WHERE rowid > ? "
+                "ORDER BY rowid LIMIT ?", (last, batch_size)).fetchall()
+            if not rows:
+                break
+            last = rows[-1][0]
+            self.conn.executemany(
+                "INSERT OR IGNORE INTO urls (key, url, completed) VALUES (?, ?, ?)",
+                [(get_urlkey(url), url, completed) for _, url, completed in rows])
+        self.conn.execute("DROP TABLE urls_by_hash")
+        self.conn.execute("COMMIT")
+
+    @staticmethod
+    def exists(filename):
+        return os.path.exists(filename)
+
+    @staticmethod
+    def remove(filename):
+        for path in (filename, filename + "-wal", filename + "-shm"):
+            if os.path.exists(path):
+                os.remove(path)
+
+    def __len__(self):
+        with self.lock:
+            self._insert_new()
+            return self.conn.execute("SELECT COUNT(*) FROM urls").fetchone()[0]
+
+    def __contains__(self, url):
+        with self.lock:
+            self._insert_new()
+            return self.conn.execute(
+                "SELECT 1 FROM urls WHERE key = ?", (get_urlkey(url),)).fetchone() is not None
+
+    def _begin(self):
+        if not self.conn.in_transaction:
+            self.conn.execute("BEGIN")
+
+    def _insert_new(self):
+        if self.new_rows:
+            self._begin()
+            self.conn.executemany(
+                "INSERT OR IGNORE INTO urls (key, url, completed, depth) VALUES (?, ?, 0, ?)",
+                self.new_rows)
+            self.new_rows = list()
+
+    def _write(self, sql, params):
+        with self.lock:
+            self._insert_new()
+            self._begin()
+            rowcount = self.conn.execute(sql, params).rowcount
+            self.writes += 1
+            if self.writes >= self.batch_size:
+                self.flush()
+            return rowcount
+
+    def add(self, url, depth=0):
+        ''' Adds url as not completed. Returns False if it was already there. '''
+        return self._write(
+            "INSERT OR IGNORE INTO urls (key, url, completed, depth) VALUES (?, ?, 0, ?)",
+            (get_urlkey(url), url, depth)) == 1
+
+    def add_new(self, url, depth=0):
+        ''' add for a url known not to be there yet: buffered, no lookup. '''
+        with self.lock:
+            self.new_rows.append((get_urlkey(url), url, depth))
+            self.writes += 1
+            if self.writes >= self.batch_size:
+                self.flush()
+
+    def mark_complete(self, url):
+        ''' Marks url as completed. Returns False if it was not there before. '''
+        urlkey = get_urlkey(url)
+        if self._write("UPDATE urls SET completed = 1 WHERE key = ?", (urlkey,)):
+            return True
+        self._write(
+            "INSERT INTO urls (key, url, completed) VALUES (?, ?, 1)", (urlkey, url))
+        return False
+
+    def add_records(self, records):
+        '''
+        Adds (url, completed, depth) records in one transaction, e.g. those of
+        another save file (see ShelveStore.records). Known urls are skipped.
+        '''
+        with self.lock:
+            self._insert_new()
+            self._begin()
+            self.conn.executemany(
+                "INSERT OR IGNORE INTO urls (key, url, completed, depth) VALUES (?, ?, ?, ?)",
+                ((get_urlkey(url), url, int(completed), depth)
+                 for url, completed, depth in records))
+            self.flush()
+
+    def urls(self, batch_size=10000):
+        ''' Yields every url, completed or not. '''
+        last = 0
+        while True:
+            with self.lock:
+                self._insert_new()
+                rows = self.conn.execute(
+                    "SELECT rowid, url FROM urls WHERE rowid > ? ORDER BY rowid LIMIT ?",
+                    (last, batch_size)).fetchall()
+            if not rows:
+                return
+            last = rows[-1][0]
+            for _, url in rows:
+                yield url
+
+    def pending(self, batch_size=10000):
+        '''
+        Iterator over lists of at most batch_size (url, depth) pairs that
+        are not completed, read from the pending index in rowid order, one
+        query per batch. Only the urls already there when pending is called
+        are read: rows added while it is iterated get higher rowids.
+        '''
+        with self.lock:
+            self._insert_new()
+            end = self.conn.execute("SELECT MAX(rowid) FROM urls").fetchone()[0] or 0
+        return self._pending(end, batch_size)
+
+    def _pending(self, end, batch_size):
+        last = 0
+        while True:
+            with self.lock:
+                self._insert_new()
+                rows = self.conn.execute(
+                    "SELECT rowid, url, depth FROM urls WHERE completed = 0 AND rowid > ? "
+                    "AND rowid <= ? ORDER BY rowid LIMIT ?", (last, end, batch_size)).fetchall()
+            if not rows:
+                return
+            last = rows[-1][0]
+            yield [(url, depth) for _, url, depth in rows]
+
+    def pending_on_host(self, host, limit):
+        '''
+        At most limit (url, depth) pairs not completed whose netloc is host.
+        Scans the pending index; urls are canonical, so they start with
+        http:// or https:// and the host, then a path, a query or nothing.
+        '''
+        escaped = host.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_")
+        patterns = [f"{scheme}://{escaped}{rest}"
+                    for scheme in ("http", "https") for rest in ("", "/%", "?%")]
+        with self.lock:
+            self._insert_new()
+            return self.conn.execute(
+                "SELECT url, depth FROM urls WHERE completed = 0 AND ("
+                + " OR ".join(["url LIKE ? ESCAPE '\\'"] * len(patterns))
+                + ") LIMIT ?", (*patterns, limit)).fetchall()
+
+    def flush(self):
+        ''' Commits every waiting write (group commit). '''
+        with self.lock, metrics.timer(FLUSH_SERIES):
+            self._insert_new()
+            if self.conn.in_transaction:
+                self.conn.execute("COMMIT")
+            self.writes = 0
+
+    def _commit_every_window(self):
+        while not self.closed.wait(self.window):
+            self.flush()
+
+    def close(self):
+        self.closed.set()
+        with self.lock:
+            self.flush()
+            self.conn.close()
+
+
+# Values of SAVEBACKEND in config.ini
+SAVE_BACKENDS = {"shelve": ShelveStore, "sqlite": SqliteStore}
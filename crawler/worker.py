@@ -2,9 +2,8 @@ from threading import Thread
 
 from inspect import getsource
 from utils.download import download
-from utils import get_logger
+from utils import get_logger, archive
 import scraper
-import time
 
 
 class Worker(Thread):
@@ -24,17 +23,28 @@ class Worker(Thread):
             if not tbd_url:
                 self.logger.info("Frontier is empty. Stopping Crawler.")
                 break
-            resp = download(tbd_url, self.config, self.logger)
-            will_scrape = scraper.is_valid_current(tbd_url, resp)
-            if will_scrape[0]:
-                self.logger.info(
-                    f"Downloaded {tbd_url}, status <{resp.status}>, "
-                    f"using cache {self.config.cache_server}.")
-                scraped_urls = scraper.scraper(tbd_url, resp)
-                for scraped_url in scraped_urls:
-                    self.frontier.add_url(scraped_url)
-            # Custom log message
-            else:
-                self.logger.info(will_scrape[1])
-            self.frontier.mark_url_complete(tbd_url)
-            time.sleep(self.config.time_delay)
+            try:
+                resp = self.fetch(tbd_url)
+                will_scrape = scraper.is_valid_current(tbd_url, resp)
+                if will_scrape[0]:
+                    self.logger.info(
+                        f"Downloaded {tbd_url}, status <{resp.status}>, "
+                        f"using cache {self.config.cache_server}.")
+                    scraped_urls = scraper.scraper(tbd_url, resp)
+                    for scraped_url in scraped_urls:
+                        self.frontier.add_url(scraped_url, tbd_url)
+                # Custom log message
+                else:
+                    self.logger.info(will_scrape[1])
+            except Exception:
+                self.logger.exception(f"Failed to process {tbd_url}.")
+            finally:
+                # The frontier keeps this url's host busy until it is marked
+                # complete, then holds it back for config.time_delay seconds.
+                self.frontier.mark_url_complete(tbd_url)
+
+    def fetch(self, url):
+        ''' The Response of url from the cache server, archived if ARCHIVE is set. '''
+        resp = download(url, self.config, self.logger)
+        archive.record(url, resp)
+        return resp
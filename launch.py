@@ -1,23 +1,80 @@
 from configparser import ConfigParser
 from argparse import ArgumentParser
 
-from utils.server_registration import get_cache_server
 from utils.config import Config
+from utils import metrics, logs
 from crawler import Crawler
 
 
-def main(config_file, restart):
+def main(config_file, restart, engine=None, node_id=None, merge=False, cache_server=None,
+         replay=None, sequential=False):
     cparser = ConfigParser()
     cparser.read(config_file)
     config = Config(cparser)
-    config.cache_server = get_cache_server(config, restart)
-    crawler = Crawler(config, restart)
-    crawler.start()
+    if engine:
+        config.engine = engine
+    if merge:
+        logs.setup(config)
+        from crawler.distributed import merge as merge_nodes
+        merge_nodes(config, len(config.peers))
+        return
+    kwargs = dict()
+    if node_id is not None:
+        from crawler.distributed import configure_node, PartitionedFrontier
+        configure_node(config, node_id)
+        kwargs["frontier_factory"] = PartitionedFrontier
+    # After configure_node, which gives each node its own FETCHLOG.
+    logs.setup(config)
+    if replay:
+        from crawler.replay import replay_archive
+        replay_archive(config, restart, replay, sequential)
+        return
+    if cache_server:
+        host, _, port = cache_server.rpartition(":")
+        config.local_cache_server = (host, int(port))
+    if config.local_cache_server:
+        # e.g. utils/cacheserver.py: no registration needed
+        config.cache_server = config.local_cache_server
+    else:
+        # Imported here so local runs do not need spacetime.
+        from utils.server_registration import get_cache_server
+        config.cache_server = get_cache_server(config, restart)
+    if config.engine == "async":
+        # Imported here so the threaded crawler does not need aiohttp.
+        from crawler.async_crawler import AsyncCrawler
+        crawler = AsyncCrawler(config, restart, **kwargs)
+    elif config.engine == "pipeline":
+        from crawler.pipeline import PipelineCrawler
+        crawler = PipelineCrawler(config, restart, **kwargs)
+    else:
+        crawler = Crawler(config, restart, **kwargs)
+    reporter = metrics.start(config)
+    try:
+        crawler.start()
+    except KeyboardInterrupt:
+        # Commits the frontier before scraper.shutdown writes explored.json at exit.
+        crawler.frontier.flush()
+        raise
+    finally:
+        reporter.stop()
+        logs.shutdown()
 
 
 if __name__ == "__main__":
     parser = ArgumentParser()
     parser.add_argument("--restart", action="store_true", default=False)
     parser.add_argument("--config_file", type=str, default="config.ini")
+    parser.add_argument("--engine", choices=["threads", "async", "pipeline"], default=None)
+    parser.add_argument("--node-id", type=int, default=None,
+        help="run as this node of the NODES in [DISTRIBUTED]")
+    parser.add_argument("--merge", action="store_true", default=False,
+        help="merge the files of all NODES after a distributed crawl")
+    parser.add_argument("--cache_server", type=str, default=None,
+        help="host:port of a local cache server, skipping registration")
+    parser.add_argument("--replay", type=str, default=None, metavar="ARCHIVE",
+        help="process the pages of a page archive instead of downloading them")
+    parser.add_argument("--sequential", action="store_true", default=False,
+        help="with --replay, process every archived page once instead of crawling")
     args = parser.parse_args()
-    main(args.config_file, args.restart)
+    main(args.config_file, args.restart, args.engine, args.node_id, args.merge,
+         args.cache_server, args.replay, args.sequential)
@@ -0,0 +1,148 @@
+'''
+Crawl report in one streaming pass over the crawl state, safe to run while
+the crawler is running.
+
+    python report.py [--config_file config.ini] [--top 50] [--domain ics.uci.edu] [--json]
+
+Reports the unique pages (explored urls not marked -1), the longest page,
+the top words (stopwords and numbers left out) and the pages scraped per
+subdomain of --domain, in alphabetical order.
+
+EXPLORED is read a chunk at a time with EXPLORED.log applied on top, and
+WORDTOTALS through a heap of --top words, so memory stays constant: the log
+holds at most EXPLOREDCOMPACT records, plus one counter per subdomain.
+With WORDSTATS = approx the top words come from WORDSTATSFILE instead.
+'''
+import os
+import sys
+import json
+import heapq
+from argparse import ArgumentParser
+from collections import Counter
+from configparser import ConfigParser
+from contextlib import redirect_stdout
+from urllib.parse import urlsplit
+
+from utils.config import Config
+from utils.jsonstream import iter_items
+from utils.wordstats import WordStats, STOPWORDS
+
+
+def read_log(filename):
+    ''' {url: last value} of an explored log, up to a torn last line. '''
+    changes = dict()
+    try:
+        with open(filename, "r") as logfile:
+            for line in logfile:
+                try:
+                    url, value = json.loads(line)
+                except ValueError:
+                    break
+                changes[url] = value
+    except FileNotFoundError:
+        pass
+    return changes
+
+
+def explored_items(filename):
+    '''
+    Yields the (url, value) pairs of explored.json as the crawler sees them:
+    the snapshot with its log applied. The snapshot is opened before the log
+    is read; if the crawler compacted in between, both are read again.
+    '''
+    while True:
+        try:
+            snapshot = open(filename, "r")
+        except FileNotFoundError:
+            snapshot = None
+        changes = read_log(filename + ".log")
+        if snapshot is None or os.fstat(snapshot.fileno()).st_ino == os.stat(filename).st_ino:
+            break
+        snapshot.close()
+    if snapshot is not None:
+        with snapshot:
+            for url, value in iter_items(snapshot):
+                yield url, changes.pop(url, value)
+    yield from changes.items()
+
+
+def top_words(filename, n):
+    ''' The n most frequent words of a wordtotals.json, as (word, count), without sorting it. '''
+    heap = list()
+    try:
+        with open(filename, "r") as setfile:
+            for word, count in iter_items(setfile):
+                if word in STOPWORDS or word.isnumeric():
+                    continue
+                if len(heap) < n:
+                    heapq.heappush(heap, (count, word))
+                elif count > heap[0][0]:
+                    heapq.heapreplace(heap, (count, word))
+    except FileNotFoundError:
+        pass
+    return [(word, count) for count, word in sorted(heap, reverse=True)]
+
+
+def in_domain(host, domain):
+    return not domain or host == domain or host.endswith("." + domain)
+
+
+def report(config, top=50, domain="ics.uci.edu"):
+    unique = 0
+    scraped = 0
+    longest = (None, 0)
+    subdomains = Counter()
+    for url, words in explored_items(config.explored_file):
+        if words == -1:
+            continue
+        unique += 1
+        if words > 0:
+            scraped += 1
+            if words > longest[1]:
+                longest = (url, words)
+            host = urlsplit(url).netloc.lower()
+            if in_domain(host, domain):
+                subdomains[host] += 1
+    if config.word_stats == "approx":
+        words = [(entry["word"], entry["count"]) for entry in
+                 WordStats.load(config.wordstats_file).report(top)["top"]]
+    else:
+        words = top_words(config.wordtotals_file, top)
+    return {
+        "unique_pages": unique,
+        "scraped_pages": scraped,
+        "longest_page": {"url": longest[0], "words": longest[1]},
+        "top_words": words,
+        "subdomains": sorted(subdomains.items()),
+    }
+
+
+def print_report(result, domain):
+    print(f"Unique pages: {result['unique_pages']} ({result['scraped_pages']} scraped)")
+    print(f"Longest page: {result['longest_page']['url']} "
+          f"({result['longest_page']['words']} words)")
+    print(f"\nTop {len(result['top_words'])} words:")
+    for rank, (word, count) in enumerate(result["top_words"], 1):
+        print(f"{rank:3}. {word}\t{count}")
+    print(f"\nSubdomains of {domain or 'every domain'}: {len(result['subdomains'])}")
+    for host, pages in result["subdomains"]:
+        print(f"{host}, {pages}")
+
+
+if __name__ == "__main__":
+    parser = ArgumentParser()
+    parser.add_argument("--config_file", type=str, default="config.ini")
+    parser.add_argument("--top", type=int, default=50)
+    parser.add_argument("--domain", type=str, default="ics.uci.edu",
+        help="list the subdomains of this domain (empty for all hosts)")
+    parser.add_argument("--json", action="store_true", default=False)
+    args = parser.parse_args()
+    cparser = ConfigParser()
+    cparser.read(args.config_file)
+    with redirect_stdout(sys.stderr): # Config prints the user agent
+        config = Config(cparser)
+    result = report(config, args.top, args.domain)
+    if args.json:
+        print(json.dumps(result, indent=2))
+    else:
+        print_report(result, args.domain)
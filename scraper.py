@@ -1,16 +1,160 @@
 import re
-from urllib.parse import urlparse
+from urllib.parse import urlparse, urljoin
 from lxml import etree
-from bs4 import BeautifulSoup
 import json
-from tokenizewords import tokenize_string
+import atexit
+from threading import RLock
+from collections import namedtuple
+from functools import lru_cache
 import wordcount
+from utils.explored import ExploredStore
+from utils.wordtotals import WordTotals, ApproxWordTotals
+from utils.simhash import SimHashIndex, simhash
+from utils.urlfilter import UrlFilter
+from utils.page import ParsedPage, get_page
+from utils.canonical import canonicalize
+from utils.traps import TrapDetector
+from utils.linkgraph import LinkGraph
+from utils import get_logger, metrics
+
+# Number of urls whose screen_url verdict is remembered
+URL_CACHE_SIZE = 1 << 18
+
+# Starting contents of explored.json, used when there is no saved state yet
+SEED_EXPLORED = ["https://www.ics.uci.edu","https://www.cs.uci.edu","https://www.informatics.uci.edu","https://www.stat.uci.edu"]
+
+# In-memory explored.json shared by is_valid, is_valid_current, count_words,
+# invalidate_in_explored and can_be_frontier. Created by setup().
+explored = None
+# In-memory wordtotals.json, checkpointed every so often. Created by setup().
+word_totals = None
+# SimHash fingerprints of every scraped page, for near-duplicate detection. Created by setup().
+fingerprints = None
+# Url templates that turned out to be traps, learned while crawling. Created by setup().
+traps = None
+# Links between pages, recorded if LINKGRAPH is set. Created by setup().
+link_graph = None
+# Pages scraped per subdomain, rewritten whole for every page
+subdomains_file = "subdomains.json"
+# Guards the json files that are still rewritten whole (subdomains)
+files_lock = RLock()
+
+# Metric series of the is_valid verdicts and the record_page outcomes
+VERDICT_BANNED = metrics.series("filter_verdicts", verdict="banned")
+VERDICT_EXPLORED = metrics.series("filter_verdicts", verdict="explored")
+VERDICT_TRAP = metrics.series("filter_verdicts", verdict="trap")
+VERDICT_NEW = metrics.series("filter_verdicts", verdict="new")
+PAGES_ERROR = metrics.series("pages", result="error")
+PAGES_SHORT = metrics.series("pages", result="short")
+PAGES_DUPLICATE = metrics.series("pages", result="duplicate")
+PAGES_SCRAPED = metrics.series("pages", result="scraped")
+
+# What is_valid_current needs to know about a page's text (see summarize_page)
+PageSummary = namedtuple("PageSummary", ["numwords", "fingerprint", "word_counts"])
+
+def setup(config=None):
+    '''
+    Creates the crawl state used by the functions below. Called by the Crawler
+    before anything else runs; config values override the defaults.
+    '''
+    global explored, word_totals, fingerprints, traps, subdomains_file, link_graph
+    shutdown()
+    explored = ExploredStore(
+        config.explored_file if config else "explored.json",
+        seeds=SEED_EXPLORED,
+        flush_interval=config.explored_flush if config else 5.0,
+        compact_every=config.explored_compact if config else 50000)
+    if config and config.word_stats == "approx":
+        word_totals = ApproxWordTotals(
+            config.wordstats_file,
+            checkpoint_pages=config.wordtotals_pages,
+            checkpoint_seconds=config.wordtotals_seconds,
+            k=config.wordstats_top, width=config.wordstats_width,
+            depth=config.wordstats_depth)
+    else:
+        word_totals = WordTotals(
+            config.wordtotals_file if config else "wordtotals.json",
+            checkpoint_pages=config.wordtotals_pages if config else 500,
+            checkpoint_seconds=config.wordtotals_seconds if config else 60.0)
+    fingerprints = SimHashIndex(
+        config.simhash_file if config else "simhash.bin",
+        max_distance=config.simhash_distance if config else 3,
+        flush_interval=config.explored_flush if config else 5.0)
+    subdomains_file = config.subdomains_file if config else "subdomains.json"
+    traps = TrapDetector(
+        max_templates=config.trap_templates if config else 10000,
+        min_pages=config.trap_min_pages if config else 20,
+        bad_ratio=config.trap_bad_ratio if config else 0.8,
+        max_links=config.trap_max_links if config else 1000,
+        max_values=config.trap_max_values if config else 50,
+        throttle=config.trap_throttle if config else 10,
+        max_depth=config.trap_max_depth if config else 12,
+        max_repeats=config.trap_max_repeats if config else 2,
+        logger=get_logger("TRAPS"))
+    metrics.register_gauge("duplicate_rate", duplicate_rate)
+    metrics.register_gauge("trap_templates_banned", lambda: len(traps.banned))
+    link_graph = LinkGraph(config.link_graph) if config and config.link_graph else None
+    if link_graph is not None:
+        metrics.register_gauge("link_graph_edges", link_graph.__len__)
+
+def duplicate_rate():
+    ''' Near duplicates out of the pages downloaded with status 200 and enough words. '''
+    duplicates = metrics.counter(PAGES_DUPLICATE)
+    total = duplicates + metrics.counter(PAGES_SCRAPED)
+    return round(duplicates / total, 4) if total else 0.0
+
+def get_explored():
+    if explored is None:
+        setup()
+    return explored
+
+def get_word_totals():
+    if word_totals is None:
+        setup()
+    return word_totals
+
+def get_fingerprints():
+    if fingerprints is None:
+        setup()
+    return fingerprints
+
+def get_traps():
+    if traps is None:
+        setup()
+    return traps
+
+def shutdown():
+    '''
+    Writes all crawl state to disk and lets go of it. Runs at exit as well,
+    so a stopped crawl keeps everything up to the last flush.
+    '''
+    global explored, word_totals, fingerprints, link_graph
+    if explored is not None:
+        explored.close()
+    if word_totals is not None:
+        word_totals.close()
+    if fingerprints is not None:
+        fingerprints.close()
+    if link_graph is not None:
+        link_graph.close()
+    explored = word_totals = fingerprints = link_graph = None
+
+atexit.register(shutdown)
 
 def scraper(url, resp):
     # return list of urls to add to the frontier
     links = extract_next_links(url, resp)
+    record_links(url, links)
     return [link for link in links if is_valid(link)]
 
+def record_links(url, links):
+    '''
+    Adds the links of page url that is_banned lets through to the link
+    graph, explored or not, if LINKGRAPH is set.
+    '''
+    if link_graph is not None:
+        link_graph.add_links(url, [link for link in links if can_be_link(link)])
+
 # Honor the politeness delay for each site
 # Crawl all pages with high textual information content
 # Detect and avoid infinite traps
@@ -21,7 +165,8 @@ def scraper(url, resp):
 def extract_next_links(url:str, resp):
     '''
     Takes a full URL and the web page response. Returns a full list of
-    all href links on that page.
+    all href links on that page, canonical and resolved against the address
+    the page was served from (see page_address).
     '''
     # this should run after is_valid_current(url,resp)
     # url: the URL that was used to get the page
@@ -31,9 +176,41 @@ def extract_next_links(url:str, resp):
     # resp.raw_response:
     #         resp.raw_response.url: the url, again
     #         resp.raw_response.content: the content of the page
-    soup = BeautifulSoup(resp.raw_response.content,'lxml')
-    links = [link.get('href') for link in soup.find_all('a')]
-    return links
+    # The page was already parsed by is_valid_current; links come from the same tree
+    page = get_page(resp)
+    return canonical_links(link_base(page_address(url, resp), page), page.links)
+
+def page_address(url, resp):
+    '''
+    The address the page of resp was really served from, as it was written:
+    its final url after redirects, not the canonical url it was queued as
+    (canonicalize drops the trailing slash that relative links depend on).
+    '''
+    raw = resp.raw_response
+    return getattr(raw, "url", None) or resp.url or url
+
+def link_base(address, page):
+    ''' The url the relative links of page, served from address, are resolved against. '''
+    base = page.base_href
+    if not base:
+        return address
+    try:
+        return urljoin(address, base.strip())
+    except ValueError:
+        return address
+
+def canonical_links(base, hrefs):
+    '''
+    Takes the url relative links of a page are resolved against (see
+    link_base) and the hrefs found on it. Returns their canonical absolute
+    urls (see utils.canonical), each once, in page order.
+    '''
+    links = dict()
+    for href in hrefs:
+        link = canonicalize(href, base)
+        if link is not None:
+            links[link] = None
+    return list(links)
 
 def is_valid(url):
     '''
@@ -42,36 +219,72 @@ def is_valid(url):
     URLs only (defragmented)
     '''
     try:
-        parsed = urlparse(url)
-
-        if is_banned(parsed):
+        screened = screen_url(url)
+        if screened is None:
+            metrics.inc(VERDICT_BANNED)
             return False
-        
-        defrag = defragment(parsed)
-        defrag2 = defragment2(parsed, defrag)
+        defrag, defrag2 = screened
         # Add the url to explored dict if not in it already. If it is, then return False.
-        try:
-            with open("explored.json", "r") as setfile:
-                urls = json.load(setfile)
-                if defrag in urls or defrag2 in urls:
-                    return False
-                urls[defrag] = 0
-            with open("explored.json", "w") as setfile:
-                json.dump(urls, setfile)
-        except FileNotFoundError: # triggered when explored.json is empty, so should only run the first time running
-            urls = {"https://www.ics.uci.edu":0,"https://www.cs.uci.edu":0,"https://www.informatics.uci.edu":0,"https://www.stat.uci.edu":0}
-            if defrag in urls or defrag2 in urls:
-                return False
-            with open("explored.json", "w") as setfile: # should only run the first time that a new URL is found
-                urls[defrag] = 0
-                json.dump(urls, setfile)
+        urls = get_explored()
+        if defrag2 in urls or defrag in urls:
+            metrics.inc(VERDICT_EXPLORED)
+            return False
+        # Url patterns learned to be traps
+        if not get_traps().allow(defrag):
+            metrics.inc(VERDICT_TRAP)
+            return False
+        if not urls.add(defrag, 0):
+            metrics.inc(VERDICT_EXPLORED)
+            return False
         # Passed all filters, link seems valid
+        metrics.inc(VERDICT_NEW)
         return True
     except TypeError:
-        print ("TypeError for ", parsed)
+        print ("TypeError for ", url)
         raise
-    except ValueError: # when urlparse(url) gives error msg'YOUR_IP' does not appear to be an IPv4 or IPv6 address
-        return False
+
+# Rules for is_banned, compiled once into url_filter below.
+# Only crawl these domains and their subdomains
+ALLOWED_DOMAINS = ["ics.uci.edu", "cs.uci.edu", "informatics.uci.edu", "stat.uci.edu"]
+# ...and pages under these host + path prefixes
+ALLOWED_PATHS = ["today.uci.edu/department/information_computer_sciences"]
+# filter out unwanted pages, based on netloc+path
+TRAP_PATTERNS = [
+    r"[0-9][0-9][0-9][0-9]-[0-9][0-9]-[0-9][0-9]",          # any specific date
+    r"ics\.uci\.edu/events/20[0-9][0-9]",                   # individual calendar days
+    r"ics\.uci\.edu/events/week/20[0-9][0-9]",              # individual calendar days
+    r"events/category/.*/20[0-9][0-9]",                     # individual calendar months
+    r"events/category/.*/day",                              # individual calendar days
+    r"isg\.ics\.uci\.edu/events/tag/talks?/day",             # individual calendar days
+    r"isg\.ics\.uci\.edu/events/tag/talks?/20[0-9][0-9]",    # individual calendar months
+    r"isg\.ics\.uci\.edu/events/tag/talks?/month",           # individual calendar months
+    r"isg\.ics\.uci\.edu/events/tag/talks?/list",            # individual calendar days
+    r"ics\.uci\.edu/events/month/20[0-9][0-9]",             # individual calendar months
+    r"intranet\.ics\.uci\.edu/doku\.php$",                  # requires login
+    r"intranet\.ics\.uci\.edu/doku\.php/personnel:start",   # requires login
+    r"wp-login\.php",                                       # requires login
+    r"sli\.ics\.uci\.edu",                                  # pages don't work
+]
+# filter out more unwanted pages, based on query
+QUERY_BANS = [
+    r"ical=1",                      # downloads an outlook file and serves blank page
+    r"date=",                       # don't want individual dates
+    r"[1-2][0-9][0-9][0-9]-[0-9][0-9]-[0-9][0-9]",
+    r"share=",                      # please don't take the bot to twitter or facebook
+]
+# filter out unwanted page formats
+BANNED_EXTENSIONS = [
+    "css", "js", "bmp", "gif", "jpeg", "jpg", "ico",
+    "png", "tiff", "tif", "mid", "mp2", "mp3", "mp4",
+    "wav", "avi", "mov", "mpeg", "ram", "m4v", "mkv", "ogg", "ogv", "pdf",
+    "ps", "eps", "tex", "ppt", "pptx", "doc", "docx", "xls", "xlsx", "names",
+    "data", "dat", "exe", "bz2", "tar", "msi", "bin", "7z", "psd", "dmg", "iso",
+    "epub", "dll", "cnf", "tgz", "sha1",
+    "thmx", "mso", "arff", "rtf", "jar", "csv",
+    "rm", "smil", "wmv", "swf", "wma", "zip", "rar", "gz",
+]
+url_filter = UrlFilter(
+    ALLOWED_DOMAINS, ALLOWED_PATHS, TRAP_PATTERNS, QUERY_BANS, BANNED_EXTENSIONS)
 
 def is_banned(parsed):
     '''
@@ -80,89 +293,23 @@ def is_banned(parsed):
     Returns True if it got caught by the filters.
     '''
     # url parses into scheme://netloc/path;params?query#fragment
-    if parsed.scheme not in set(["http", "https"]):
-        return True
-
-    # add more specifications here? re.match(substring, string)
-    if not re.match(
-        # filter out non uci/ics sites
-        # .* means any combination and number of characters
-        # no $ sign because we want to allow a path
-        r".*(ics.uci.edu|cs.uci.edu|informatics.uci.edu"
-        + r"|stat.uci.edu|today.uci.edu/department/information_computer_sciences)"
-        , (parsed.netloc + parsed.path).lower()):
-        return True
-
-    if re.match(
-        # filter out unwanted pages, based on netloc+path
-        r".*([0-9][0-9][0-9][0-9]-[0-9][0-9]-[0-9][0-9]"          # any specific date
-        + r"|ics\.uci\.edu/events/20[0-9][0-9]"                   # individual calendar days
-        + r"|ics\.uci\.edu/events/week/20[0-9][0-9]"              # individual calendar days
-        + r"|events/category/.*/20[0-9][0-9]"                     # individual calendar months
-        + r"|events/category/.*/day"                              # individual calendar days
-        + r"|isg\.ics\.uci\.edu/events/tag/talk/day"              # individual calendar days
-        + r"|isg\.ics\.uci\.edu/events/tag/talks/day"             # individual calendar days
-        + r"|isg\.ics\.uci\.edu/events/tag/talk/20[0-9][0-9]"     # individual calendar months
-        + r"|isg\.ics\.uci\.edu/events/tag/talks/20[0-9][0-9]"    # individual calendar days
-        + r"|isg\.ics\.uci\.edu/events/tag/talk/month"            # individual calendar months
-        + r"|isg\.ics\.uci\.edu/events/tag/talks/month"           # individual calendar months
-        + r"|isg\.ics\.uci\.edu/events/tag/talk/list"             # individual calendar days
-        + r"|isg\.ics\.uci\.edu/events/tag/talks/list"            # individual calendar days
-        + r"|ics\.uci\.edu/events/20[0-9][0-9]"                   # individual calandar days
-        + r"|ics\.uci\.edu/events/month/20[0-9][0-9]"             # individual calendar months
-        + r"|wics\.ics\.uci\.edu/events/20[0-9][0-9]"             # individual calendar days
-        + r"|wics\.ics\.uci\.edu/events/month/20[0-9][0-9]"       # individual calendar months
-        + r"|intranet\.ics\.uci\.edu/doku\.php$"                  # requires login
-        + r"|intranet\.ics\.uci\.edu/doku\.php/personnel:start"   # requires login
-        + r"|wp-login\.php"                                       # requires login
-        + r"|sli\.ics\.uci\.edu"                                  # pages don't work
-        + r")"
-        , (parsed.netloc + parsed.path).lower()):
-        return True
+    # add more specifications to the lists above
+    return url_filter.is_banned(parsed.scheme, parsed.netloc, parsed.path, parsed.query)
 
-    if re.match(
-        # filter out more unwanted pages, based on query
-        r".*(ical=1"                      # downloads an outlook file and serves blank page
-        + r"|date="                       # don't want individual dates
-        + r"|[1-2][0-9][0-9][0-9]-[0-9][0-9]-[0-9][0-9]"
-        + r"|share="                      # please don't take the bot to twitter or facebook
-        + r")"
-        , (parsed.query).lower()):
-        return True
-
-    if re.match(
-        # filter out unwanted page formats
-        # .* means any combination and number of characters
-        # \. means a dot
-        # $ means end of string; so "jpeg" matches "me.jpeg" but not "me.jpeg2"
-        r".*\.(css|js|bmp|gif|jpe?g|ico"
-        + r"|png|tiff?|mid|mp2|mp3|mp4"
-        + r"|wav|avi|mov|mpeg|ram|m4v|mkv|ogg|ogv|pdf"
-        + r"|ps|eps|tex|ppt|pptx|doc|docx|xls|xlsx|names"
-        + r"|data|dat|exe|bz2|tar|msi|bin|7z|psd|dmg|iso"
-        + r"|epub|dll|cnf|tgz|sha1"
-        + r"|thmx|mso|arff|rtf|jar|csv"
-        + r"|rm|smil|wmv|swf|wma|zip|rar|gz)$", (parsed.path).lower()):
-        return True
-    return False
-
-def defragment(parsed):
+@lru_cache(maxsize=URL_CACHE_SIZE)
+def screen_url(url):
     '''
-    Takes in a urlparsed url and returns the defragmented URL string.
-    Removes the trailing slash (/) because sometimes two URLs that are
-    the same except for a slash get double counted
+    Canonicalizes url once and runs it through is_banned. Returns None if it
+    is banned, otherwise its (defrag, defrag2): the canonical url and the same
+    with the other scheme. Memoized, since the same links show up on many pages.
     '''
-    if type(parsed.scheme) is str:
-        defrag = (parsed.scheme + '://' + parsed.netloc + parsed.path if (parsed.query == '')
-                    else parsed.scheme + '://' + parsed.netloc + parsed.path + '?' + parsed.query)
-        # Remove trailing /
-        defrag = (defrag[0: -1] if (defrag[-1] == '/') else defrag)
-    else: # for when the url is in bytes instead of string
-        defrag = (parsed.scheme + b'://' + parsed.netloc + parsed.path if (parsed.query == b'')
-                  else parsed.scheme + b'://' + parsed.netloc + parsed.path + b'?' + parsed.query)
-        # Remove trailing /
-        defrag = (defrag[0, -1] if (defrag[-1] == '/') else defrag)
-    return defrag
+    defrag = canonicalize(url)
+    if defrag is None: # when urlparse(url) gives error msg'YOUR_IP' does not appear to be an IPv4 or IPv6 address
+        return None
+    parsed = urlparse(defrag)
+    if is_banned(parsed):
+        return None
+    return (defrag, defragment2(parsed, defrag))
 
 def defragment2(parsed, defrag):
     '''
@@ -185,103 +332,126 @@ def is_valid_current(url, resp):
     Also processes current and adds it to subdomains, and counts words for explored.json
     and wordtotals.py.
     '''
+    summary = summarize_page(get_page(resp)) if resp.status == 200 else None
+    return record_page(url, resp.status, summary)
+
+def summarize_page(page):
+    '''
+    Takes a ParsedPage and returns the PageSummary that record_page needs:
+    the number of words, the SimHash fingerprint and the word counts.
+    Only does CPU work, so it can run in another process.
+    '''
+    tokens = page.tokens # long list of words
+    numwords = len(tokens)
+    if numwords < 100:
+        return PageSummary(numwords, None, None)
+
+    # fingerprint of the text for textual similarity
+    fingerprint = simhash(tokens)
+    word_counts = {}
+    update_token_map(word_counts, tokens)
+    return PageSummary(numwords, fingerprint, word_counts)
+
+def analyze_content(url, status, content, address=None):
+    '''
+    CPU half of is_valid_current and scraper for the pipeline engine, run in
+    a worker process. Takes the downloaded url, status and page content and
+    the address it was served from (see page_address), and returns (url,
+    status, PageSummary, links not caught by is_banned). record_page and
+    is_valid then do the rest in the crawler process.
+    '''
+    if status != 200:
+        return (url, status, None, [])
+    page = ParsedPage(content)
+    summary = summarize_page(page)
+    if summary.numwords < 100:
+        return (url, status, summary, [])
+    base = link_base(address or url, page)
+    return (url, status, summary,
+        [link for link in canonical_links(base, page.links) if can_be_link(link)])
+
+def can_be_link(url):
+    ''' is_valid without the explored.json check. '''
     try:
-        parsed = urlparse(url)
-    except ValueError: # when urlparse(url) gives error msg'YOUR_IP' does not appear to be an IPv4 or IPv6 address
+        return screen_url(url) is not None
+    except TypeError:
         return False
 
-    defrag = defragment(parsed) # Won't need defrag2, since only defragmented1 is ever added to explored.json
+def record_page(url, status, summary):
+    '''
+    Stateful half of is_valid_current. Takes the url, its status and its
+    PageSummary (None unless status is 200) and returns (True, 'pass') if we
+    want to scrape it for links, or (False, reason) if not. Updates
+    explored.json, the SimHash index, subdomains.json and wordtotals.json.
+    '''
+    # Won't need defrag2, since only defragmented1 is ever added to explored.json
+    defrag = canonicalize(url)
+    if defrag is None: # when urlparse(url) gives error msg'YOUR_IP' does not appear to be an IPv4 or IPv6 address
+        return (False, f"Did not scrape {url} because it could not be parsed")
+    parsed = urlparse(defrag)
 
     # Status != 200
-    if (resp.status != 200):
+    if (status != 200):
         invalidate_in_explored(defrag)
-        msg = f"Did not scrape {url} because status = {resp.status}"
+        get_traps().record(defrag, False)
+        metrics.inc(PAGES_ERROR)
+        msg = f"Did not scrape {url} because status = {status}"
         return (False, msg)
-    soup = BeautifulSoup(resp.raw_response.content,'lxml')
-    tokens = tokenize_string(soup.get_text(" ", strip=True)) # long list of words
     
     # Has < 100 words
-    numwords = len(tokens)
+    numwords = summary.numwords
     if numwords < 100:
         invalidate_in_explored(defrag)
+        get_traps().record(defrag, False)
+        metrics.inc(PAGES_SHORT)
         msg = f"Did not scrape {url} because number of words {numwords} < 100"
         return (False, msg)
 
     # look for textual similarity
-    # look at tokens[10-31]; if their checksum is same, return false
-    checksum = 0
-    for i in range(10, 31):
-        word = tokens[i]
-        for c in word:
-            checksum += ord(c)
-    try:
-        with open("sumhash.json", "r") as setfile:
-            sums = json.load(setfile)
-        if checksum in sums:
-            invalidate_in_explored(defrag)
-            msg = f"Did not scrape {url} because checksum {checksum} already exists"
-            return (False, msg)
-        sums[checksum] = 0
-        with open("sumhash.json", "w") as setfile:
-            json.dump(sums, setfile)
-    except FileNotFoundError: # triggered when sumhash.json is empty, so should only run the first time running
-        sums = {checksum:0}
-        with open("sumhash.json", "w") as setfile:
-            json.dump(sums, setfile)
-
-    # Seems valid: add to subdomains
-    subdom = parsed.netloc
-    try:
-        with open("subdomains.json", "r") as setfile:
-            subs = json.load(setfile)
-        subs[subdom] = subs[subdom] + 1 if (subdom in subs) else 1
-        with open("subdomains.json", "w") as setfile:
-            json.dump(subs, setfile)
-    except FileNotFoundError: # triggered when subdomains.json is empty, so should only run the first time running
-        subs = {"www.ics.uci.edu":0,"www.cs.uci.edu":0,"www.informatics.uci.edu":0,"www.stat.uci.edu":0}
-        subs[subdom] = subs[subdom] + 1 if (subdom in subs) else 1
-        with open("subdomains.json", "w") as setfile: # should only run the first time that a new URL is found
-            json.dump(subs, setfile)
+    # if the fingerprint is within a few bits of a scraped page's, return false
+    if not get_fingerprints().add_if_new(summary.fingerprint):
+        invalidate_in_explored(defrag)
+        get_traps().record(defrag, False)
+        metrics.inc(PAGES_DUPLICATE)
+        msg = f"Did not scrape {url} because it is a near duplicate of a scraped page"
+        return (False, msg)
+
+    # json files below are read and rewritten whole, one thread at a time
+    with files_lock:
+        # Seems valid: add to subdomains
+        subdom = parsed.netloc
+        try:
+            with open(subdomains_file, "r") as setfile:
+                subs = json.load(setfile)
+            subs[subdom] = subs[subdom] + 1 if (subdom in subs) else 1
+            with open(subdomains_file, "w") as setfile:
+                json.dump(subs, setfile)
+        except FileNotFoundError: # triggered when subdomains.json is empty, so should only run the first time running
+            subs = {"www.ics.uci.edu":0,"www.cs.uci.edu":0,"www.informatics.uci.edu":0,"www.stat.uci.edu":0}
+            subs[subdom] = subs[subdom] + 1 if (subdom in subs) else 1
+            with open(subdomains_file, "w") as setfile: # should only run the first time that a new URL is found
+                json.dump(subs, setfile)
 
     # Count the number of words in the URL for explored.json and the word frequencies for wordtotals.json
-    count_words(defrag, numwords, tokens)
+    get_traps().record(defrag, True)
+    metrics.inc(PAGES_SCRAPED)
+    count_words(defrag, numwords, summary.word_counts)
     return (True, 'pass')
 
-def count_words(defrag, numwords, token_list):
+def count_words(defrag, numwords, word_counts):
     '''
-    Takes defragmented URL, number of words, and token list.
+    Takes defragmented URL, number of words, and the page's word counts
+    (a token dict built by update_token_map).
     Adds file's number of words to the explored.json dict's values
-    and word frequencies to wordtotals.json.
+    and word frequencies to wordtotals.json (in memory, checkpointed
+    to disk every so often).
     
     '''
     # updating explored.json values with numwords
-    try:
-        # explored.json might not exist, but defrag will be in it if it does
-        with open("explored.json", "r") as setfile:
-            urls = json.load(setfile)
-        urls[defrag] = numwords
-        with open("explored.json", "w") as setfile:
-            json.dump(urls, setfile)
-    except FileNotFoundError: # will only trigger the first time a seed url is processed and nothing is removed
-        # urls = {"https://www.ics.uci.edu":0,"https://www.cs.uci.edu":0,"https://www.informatics.uci.edu":0,"https://www.stat.uci.edu":0}
-        urls = {}
-        urls[defrag] = numwords
-        with open("explored.json", "w") as setfile: # should only run the first time that a new URL is found
-            json.dump(urls, setfile)
+    get_explored()[defrag] = numwords
 
     # updating wordtotals.json with word frequencies
-    try:
-        # wordtotals.json might not exist, but defrag will be in it if it does
-        with open("wordtotals.json", "r") as setfile:
-            token_map = json.load(setfile)
-        update_token_map(token_map, token_list)
-        with open("wordtotals.json", "w") as setfile:
-            json.dump(token_map, setfile)
-    except FileNotFoundError: # will only trigger the first time a seed url is processed and nothing is removed
-        token_map = {}
-        update_token_map(token_map, token_list)
-        with open("wordtotals.json", "w") as setfile: # should only run the first time that a new URL is found
-            json.dump(token_map, setfile)
+    get_word_totals().add(word_counts)
 
 def update_token_map(token_map, token_list):
     '''
@@ -300,23 +470,23 @@ def update_token_map(token_map, token_list):
 
 def invalidate_in_explored(defrag):
     '''
-    Set the given defragmented URL value in file explored.json to -1.
-    If no file exists, create one with the seed URLs and set that
-    to -1. -1 means invalid and will not be counted at the very end
+    Set the given defragmented URL value in explored.json to -1.
+    -1 means invalid and will not be counted at the very end
     of scraped unique URLs.
     '''
-    try:
-        with open("explored.json", "r") as setfile:
-            urls = json.load(setfile)
-        urls[defrag] = -1
-        with open("explored.json", "w") as setfile:
-            json.dump(urls, setfile)
-    except FileNotFoundError: # will only trigger the first time a seed url is processed and removed
-        # urls = {"https://www.ics.uci.edu":0,"https://www.cs.uci.edu":0,"https://www.informatics.uci.edu":0,"https://www.stat.uci.edu":0}
-        urls = {}
-        urls[defrag] = -1
-        with open("explored.json", "w") as setfile: # should only run the first time that a new URL is found
-            json.dump(urls, setfile)
+    get_explored()[defrag] = -1
+
+def is_trap(url):
+    '''
+    For use in Frontier.py when a url is handed out: True if its template was
+    banned as a trap after the url was queued. Its value in explored.json is
+    then set to -1, as for the other pages that are not scraped.
+    '''
+    if not get_traps().is_banned(url):
+        return False
+    metrics.inc(VERDICT_TRAP)
+    invalidate_in_explored(url)
+    return True
 
 def can_be_frontier(url):
     '''
@@ -326,24 +496,45 @@ def can_be_frontier(url):
     Generally, this will run when explored.json has things in it.
     '''
     try:
-        parsed = urlparse(url)
-        if (is_banned(parsed)):
+        screened = screen_url(url)
+        if screened is None:
             return False
-        defrag = defragment(parsed)
-        defrag2 = defragment2(parsed, defrag)
-        try:
-            with open("explored.json", "r") as setfile:
-                urls = json.load(setfile)
-            # If a URL was added to explored.py (discovered) but not processed, then
-            # its dict value should still be 0. Therefore val == 0 means it was on the
-            # frontier
-            if defrag in urls:
-                return (False if urls[defrag] != 0 else True)
-            if defrag2 in urls:
-                return (False if urls[defrag2] != 0 else True)
-        except FileNotFoundError: # generally explored.json will always exist so this shouldn't activate but let's be safe
-            return True
+        defrag, defrag2 = screened
+        urls = get_explored()
+        # If a URL was added to explored.py (discovered) but not processed, then
+        # its dict value should still be 0. Therefore val == 0 means it was on the
+        # frontier
+        if defrag in urls:
+            return (False if urls[defrag] != 0 else True)
+        if defrag2 in urls:
+            return (False if urls[defrag2] != 0 else True)
         return True
     except TypeError:
-        print ("TypeError for ", parsed)
+        print ("TypeError for ", url)
         raise
+
+def discovered_urls():
+    '''
+    For use in Frontier.py when resuming: the urls explored.json has as
+    discovered but not processed (value 0).
+    '''
+    return [url for url, value in get_explored().items() if value == 0]
+
+def filter_frontier(urls):
+    '''
+    can_be_frontier for a whole batch of urls from the save file, used when
+    resuming. Returns the ones that can stay in the frontier.
+    '''
+    urls_explored = get_explored()
+    kept = []
+    for url in urls:
+        screened = screen_url(url)
+        if screened is None:
+            continue
+        value = urls_explored.get(screened[0])
+        if value is None:
+            value = urls_explored.get(screened[1])
+        # Not explored yet (None) or discovered but not processed (0)
+        if not value:
+            kept.append(url)
+    return kept
@@ -1,4 +1,13 @@
+import re
 import sys
+import string
+
+# A token is a run of ASCII letters and digits, same as isAlphaNumeric
+TOKEN_PATTERN = re.compile(r"[A-Za-z0-9]+")
+TOKEN_BYTES_PATTERN = re.compile(rb"[A-Za-z0-9]+")
+TOKEN_CHARS = string.ascii_letters + string.digits
+# Characters read from a file at a time by tokenize
+CHUNK_SIZE = 1 << 20
 
 
 def isAlphaNumeric(char:str):
@@ -26,26 +35,59 @@ def tokenize_string(line:str):
     Linear time-- O(n), where n is the number of characters in the line.
 
     Reasoning:
-    There is one for-loop that iterates through each character
-    in the line. All operations inside the for-loop take O(1) time.
-    """
-    line = line + ' ' # final whitespace to ensure the last token is not missed
-    tokens = []
-    str_len = len(line)
-    start, end = (-1, -1)
-    for i in range(0, str_len): # iterate over each char
-        char = line[i]
-        if isAlphaNumeric(char): # alphanumeric as in ONLY letters and numbers, nothing else
-            if start == -1:
-                start, end = (i, i + 1)
-            else:
-                end = i + 1
-        else:
-            if start < end:
-                # if there is a token, add it to list and reset start and end
-                tokens.append(line[start:end])
-                start, end = (-1, -1)
-    return tokens
+    The compiled regex scans each character in the line once, the same
+    work as calling isAlphaNumeric on each character, but in C instead
+    of a Python loop.
+    """
+    return TOKEN_PATTERN.findall(line)
+
+
+def tokenize_bytes(data:bytes):
+    """
+    Same as tokenize_string, for ASCII-compatible bytes (e.g. a page's raw
+    content). Only the tokens are decoded, never the whole input.
+
+    Time complexity:
+    Linear time-- O(n), where n is the number of bytes.
+    """
+    return [token.decode("ascii") for token in TOKEN_BYTES_PATTERN.findall(data)]
+
+
+def iter_tokens(line:str):
+    """
+    Generator version of tokenize_string, for inputs too large to hold
+    all of their tokens in a list.
+
+    Time complexity:
+    Linear time-- O(n), where n is the number of characters in the line.
+    """
+    for match in TOKEN_PATTERN.finditer(line):
+        yield match.group()
+
+
+def iter_file_tokens(filepath:str):
+    """
+    Generator of the lowercased tokens of a file, read CHUNK_SIZE characters
+    at a time. Raises OSError if the file cannot be opened.
+
+    Time complexity:
+    Linear time-- O(n), where n is the number of characters in the file.
+    A token cut by the end of a chunk is carried over to the next one, so
+    each character is still scanned only once or twice.
+    """
+    with open(filepath, 'r') as file:
+        leftover = ''
+        while True:
+            chunk = file.read(CHUNK_SIZE)
+            if not chunk:
+                break
+            chunk = leftover + chunk.lower()
+            # the token the chunk ends with may go on in the next chunk
+            cut = len(chunk.rstrip(TOKEN_CHARS))
+            yield from TOKEN_PATTERN.findall(chunk, 0, cut)
+            leftover = chunk[cut:]
+        if leftover:
+            yield leftover
 
 
 def tokenize(filepath:str):
@@ -58,8 +100,8 @@ def tokenize(filepath:str):
 
     Reasoning:
     Essentially, this function iterates through every character in the file,
-    so its time complexity is O of (number of lines) * (number of characters in a
-    line), or simply O(number of characters in file).
+    in chunks of CHUNK_SIZE characters, so its time complexity is
+    O(number of characters in file).
 
     For n = number of tokens: Let us define a constant M
     that represents the average number of characters in a token. Now,
@@ -71,12 +113,8 @@ def tokenize(filepath:str):
     if len(filepath) == 0:
         print("Error in function tokenize: No file path provided")
         return [-1]
-    tokens = []
     try:
-        with open(filepath, 'r') as file: # what to do if input path is invalid...
-            for line in file:
-                tokens += tokenize_string(line.lower())
-        return tokens
+        return list(iter_file_tokens(filepath))
     except OSError:
         print("Error in function tokenize: File cannot be opened")
         return [-1]
@@ -1,25 +1,10 @@
 import os
-import logging
-from hashlib import sha256
+import json
+from hashlib import sha256, blake2b
 from urllib.parse import urlparse
 
-def get_logger(name, filename=None):
-    logger = logging.getLogger(name)
-    logger.setLevel(logging.INFO)
-    if not os.path.exists("Logs"):
-        os.makedirs("Logs")
-    fh = logging.FileHandler(f"Logs/{filename if filename else name}.log")
-    fh.setLevel(logging.DEBUG)
-    ch = logging.StreamHandler()
-    ch.setLevel(logging.INFO)
-    formatter = logging.Formatter(
-       "%(asctime)s - %(name)s - %(levelname)s - %(message)s")
-    fh.setFormatter(formatter)
-    ch.setFormatter(formatter)
-    # add the handlers to the logger
-    logger.addHandler(fh)
-    logger.addHandler(ch)
-    return logger
+# Loggers write through one background thread; see utils/logs.py
+from utils.logs import get_logger
 
 
 def get_urlhash(url):
@@ -29,7 +14,24 @@ def get_urlhash(url):
         f"{parsed.netloc}/{parsed.path}/{parsed.params}/"
         f"{parsed.query}/{parsed.fragment}".encode("utf-8")).hexdigest()
 
+def get_urlkey(url):
+    '''
+    Compact binary version of get_urlhash: a 16-byte digest of everything
+    other than the scheme, without parsing the url.
+    '''
+    return blake2b(url.split("://", 1)[-1].encode("utf-8"), digest_size=16).digest()
+
 def normalize(url):
     if url.endswith("/"):
         return url.rstrip("/")
     return url
+
+def write_json_atomic(filename, obj):
+    '''
+    Dumps obj to filename through a temporary file and a rename, so a
+    crash in the middle of the write never leaves a half-written file.
+    '''
+    tmpname = f"{filename}.tmp"
+    with open(tmpname, "w") as setfile:
+        json.dump(obj, setfile)
+    os.replace(tmpname, filename)
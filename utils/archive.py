@@ -0,0 +1,347 @@
+'''
+Compressed, append-only archive of downloaded pages, so they can be
+processed again (new tokenizer, duplicate detection, filters) without
+another crawl through the cache server.
+
+ARCHIVE holds one record per page: a RECORD header and a block with the
+page's metadata as a JSON line followed by its content, compressed with
+gzip or zstd (the zstandard package). ARCHIVE.idx holds an INDEX_ENTRY
+(16-byte get_urlkey of the url, offset, length) per record, written only
+once the record is on disk. ArchiveReader reads both through mmap.
+'''
+import os
+import json
+import zlib
+import struct
+from mmap import mmap, ACCESS_READ
+from queue import Queue
+from threading import Thread
+
+import requests
+
+from utils import get_logger, get_urlkey, metrics
+from utils.response import Response
+
+RECORD = struct.Struct("<4sB3xII")     # magic, codec, compressed size, content size
+RECORD_MAGIC = b"PGA1"
+INDEX_ENTRY = struct.Struct("<16sQI")  # url key, record offset, record size
+SORTED_HEADER = struct.Struct("<4sQ")  # magic, number of ARCHIVE.idx entries sorted
+SORTED_MAGIC = b"PGS1"
+
+CODECS = {"gzip": 1, "zstd": 2}
+FLUSH_SERIES = metrics.series("flush_seconds", file="archive")
+
+
+def get_codec(name, level=6):
+    ''' (compress, decompress) functions of a codec in CODECS. '''
+    if name == "gzip":
+        return (lambda data: zlib.compress(data, level, wbits=31),
+                lambda data: zlib.decompress(data, wbits=31))
+    if name == "zstd":
+        try:
+            import zstandard
+        except ImportError:
+            raise RuntimeError("ARCHIVECODEC = zstd needs the zstandard package.")
+        compressor = zstandard.ZstdCompressor(level=level)
+        decompressor = zstandard.ZstdDecompressor()
+        return compressor.compress, decompressor.decompress
+    raise ValueError(f"Unknown archive codec {name!r}, use one of {', '.join(CODECS)}.")
+
+
+class ArchiveWriter(object):
+    '''
+    Appends pages to filename on a background thread. add only queues the
+    page (waiting if queue_size pages are already queued), and the thread
+    compresses, writes and flushes data then index whenever the queue runs
+    empty. After a crash, records without an index entry are cut off when
+    the archive is opened again. If a write fails (e.g. the disk is full),
+    the error is logged and archiving stops: the thread drops whatever is
+    queued and add returns right away.
+    '''
+    def __init__(self, filename, codec="gzip", level=6, queue_size=256):
+        self.filename = filename
+        self.index_filename = filename + ".idx"
+        self.codec = CODECS[codec]
+        self.compress = get_codec(codec, level)[0]
+        self.logger = get_logger("ARCHIVE")
+        self._recover()
+        self.data = open(filename, "ab")
+        self.index = open(self.index_filename, "ab")
+        self.offset = self.data.tell()
+        self.pending = list()
+        self.failed = False
+        self.queue = Queue(queue_size)
+        self.thread = Thread(target=self._run, daemon=True)
+        self.thread.start()
+        metrics.register_gauge("archive_queue", self.queue.qsize)
+
+    def _recover(self):
+        '''
+        Cuts both files back to the last record that has an index entry, or
+        rebuilds the index from the records if it is missing.
+        '''
+        if not os.path.exists(self.filename):
+            return
+        size = os.path.getsize(self.filename)
+        if not os.path.exists(self.index_filename) and size:
+            self.logger.warning(f"No index for {self.filename}, rebuilding it.")
+            reader = ArchiveReader(self.filename)
+            with open(self.index_filename, "wb") as index:
+                for offset, length, page in reader.records():
+                    index.write(INDEX_ENTRY.pack(get_urlkey(page.url), offset, length))
+            reader.close()
+        entries = 0
+        if os.path.exists(self.index_filename):
+            entries = os.path.getsize(self.index_filename) // INDEX_ENTRY.size
+        end = 0
+        with open(self.index_filename, "a+b") as index:
+            while entries:
+                index.seek((entries - 1) * INDEX_ENTRY.size)
+                _, offset, length = INDEX_ENTRY.unpack(index.read(INDEX_ENTRY.size))
+                if offset + length <= size:
+                    end = offset + length
+                    break
+                entries -= 1
+            index.truncate(entries * INDEX_ENTRY.size)
+        if end < size:
+            self.logger.warning(
+                f"Cutting {size - end} bytes of unindexed records off {self.filename}.")
+            with open(self.filename, "r+b") as data:
+                data.truncate(end)
+
+    def add(self, url, resp):
+        ''' Queues the Response of url. Downloads that got no answer are skipped. '''
+        if self.failed or (resp.raw_response is None and not resp.status):
+            return
+        raw = resp.raw_response
+        if raw is None:
+            self.queue.put((url, resp.status, resp.error, None, None, b"", None))
+        else:
+            self.queue.put((url, resp.status, resp.error, dict(raw.headers),
+                            raw.encoding, raw.content, raw.url))
+
+    def _run(self):
+        while True:
+            item = self.queue.get()
+            if self.failed:
+                if item is None:
+                    return
+                continue
+            try:
+                if item is None:
+                    self.flush()
+                    return
+                self._write(*item)
+                if self.queue.empty():
+                    self.flush()
+            except Exception:
+                self.failed = True
+                self.logger.exception(
+                    f"Could not write to {self.filename}, no more pages are archived.")
+                if item is None:
+                    return
+
+    def _write(self, url, status, error, headers, encoding, content, address):
+        meta = json.dumps({"url": url, "status": status, "error": error,
+                           "headers": headers, "encoding": encoding,
+                           "address": address}).encode("utf-8")
+        block = self.compress(meta + b"\n" + (content or b""))
+        self.data.write(RECORD.pack(RECORD_MAGIC, self.codec, len(block), len(content or b"")))
+        self.data.write(block)
+        length = RECORD.size + len(block)
+        self.pending.append(INDEX_ENTRY.pack(get_urlkey(url), self.offset, length))
+        self.offset += length
+        metrics.inc("archive_records")
+        metrics.inc("archive_bytes", length)
+
+    def flush(self):
+        ''' Writes the records, then their index entries. Only the writer thread calls it. '''
+        if not self.pending:
+            return
+        with metrics.timer(FLUSH_SERIES):
+            self.data.flush()
+            self.index.write(b"".join(self.pending))
+            self.index.flush()
+            self.pending = list()
+
+    def close(self):
+        ''' Writes everything still queued and closes the files. '''
+        self.queue.put(None)
+        self.thread.join()
+        metrics.unregister_gauge("archive_queue")
+        for fileobj in (self.data, self.index):
+            try:
+                if not self.failed:
+                    os.fsync(fileobj.fileno())
+                fileobj.close()
+            except OSError:
+                pass
+
+
+class ArchivedPage(object):
+    __slots__ = ("url", "status", "error", "headers", "encoding", "content", "address")
+
+    def __init__(self, meta, content):
+        self.url = meta["url"]
+        self.status = meta["status"]
+        self.error = meta["error"]
+        self.headers = meta["headers"]
+        self.encoding = meta["encoding"]
+        # Final url after redirects; archives written before it was kept have none
+        self.address = meta.get("address") or self.url
+        self.content = content
+
+    def response(self):
+        ''' The Response the crawler got for this page, as utils.download returned it. '''
+        resp = Response({"url": self.url, "status": self.status, "error": self.error})
+        if self.headers is None: # the cache server sent no page
+            return resp
+        raw = requests.Response()
+        raw.url = self.address
+        raw.status_code = self.status
+        raw.headers.update(self.headers)
+        raw.encoding = self.encoding
+        raw._content = self.content
+        raw._content_consumed = True
+        resp.raw_response = raw
+        return resp
+
+
+class ArchiveReader(object):
+    '''
+    Reads an archive through mmap: in write order by iterating over it, or
+    by url with get. get binary searches ARCHIVE.idx.sorted, a copy of the
+    index sorted by url key that is rebuilt when ARCHIVE.idx has grown
+    (the latest record of a url wins).
+    '''
+    def __init__(self, filename):
+        self.filename = filename
+        self.index_filename = filename + ".idx"
+        self.sorted_filename = filename + ".idx.sorted"
+        self.data = self._map(filename)
+        self.index = None
+        self.entries = 0
+        decompressors = dict()
+        for name, codec in CODECS.items():
+            try:
+                decompressors[codec] = get_codec(name)[1]
+            except RuntimeError: # zstandard is not installed
+                pass
+        self.decompressors = decompressors
+
+    @staticmethod
+    def _map(filename):
+        with open(filename, "rb") as fileobj:
+            if os.fstat(fileobj.fileno()).st_size == 0:
+                return b""
+            return mmap(fileobj.fileno(), 0, access=ACCESS_READ)
+
+    def _read(self, offset):
+        ''' (ArchivedPage, record size) of the record at offset, or None if it is not complete. '''
+        data = self.data
+        if offset + RECORD.size > len(data):
+            return None
+        magic, codec, size, _ = RECORD.unpack_from(data, offset)
+        start = offset + RECORD.size
+        if magic != RECORD_MAGIC or start + size > len(data):
+            return None
+        if codec not in self.decompressors:
+            raise RuntimeError("The archive is compressed with zstd; install the zstandard package.")
+        block = self.decompressors[codec](data[start:start + size])
+        meta, _, content = block.partition(b"\n")
+        return ArchivedPage(json.loads(meta), content), RECORD.size + size
+
+    def records(self):
+        ''' Yields (offset, size, ArchivedPage) of every complete record, in write order. '''
+        offset = 0
+        while True:
+            record = self._read(offset)
+            if record is None:
+                return
+            yield offset, record[1], record[0]
+            offset += record[1]
+
+    def __iter__(self):
+        for _, _, page in self.records():
+            yield page
+
+    def _sorted_index(self):
+        if self.index is not None:
+            return self.index
+        entries = os.path.getsize(self.index_filename) // INDEX_ENTRY.size
+        try:
+            with open(self.sorted_filename, "rb") as sortedfile:
+                magic, sorted_entries = SORTED_HEADER.unpack(sortedfile.read(SORTED_HEADER.size))
+        except (FileNotFoundError, struct.error):
+            magic, sorted_entries = None, -1
+        if magic != SORTED_MAGIC or sorted_entries != entries:
+            with open(self.index_filename, "rb") as indexfile:
+                raw = indexfile.read(entries * INDEX_ENTRY.size)
+            latest = dict()
+            for start in range(0, len(raw), INDEX_ENTRY.size):
+                latest[raw[start:start + 16]] = raw[start:start + INDEX_ENTRY.size]
+            tmpname = f"{self.sorted_filename}.tmp"
+            with open(tmpname, "wb") as sortedfile:
+                sortedfile.write(SORTED_HEADER.pack(SORTED_MAGIC, entries))
+                sortedfile.write(b"".join(latest[key] for key in sorted(latest)))
+            os.replace(tmpname, self.sorted_filename)
+        self.index = self._map(self.sorted_filename)
+        self.entries = (len(self.index) - SORTED_HEADER.size) // INDEX_ENTRY.size
+        return self.index
+
+    def get(self, url):
+        ''' The ArchivedPage of url, or None if it is not in the archive. '''
+        index = self._sorted_index()
+        key = get_urlkey(url)
+        low, high = 0, self.entries
+        while low < high:
+            middle = (low + high) // 2
+            entry_key, offset, _ = INDEX_ENTRY.unpack_from(
+                index, SORTED_HEADER.size + middle * INDEX_ENTRY.size)
+            if entry_key < key:
+                low = middle + 1
+            elif entry_key > key:
+                high = middle
+            else:
+                record = self._read(offset)
+                return record[0] if record is not None else None
+        return None
+
+    def __contains__(self, url):
+        return self.get(url) is not None
+
+    def __len__(self):
+        self._sorted_index()
+        return self.entries
+
+    def close(self):
+        for mapped in (self.data, self.index):
+            if isinstance(mapped, mmap):
+                mapped.close()
+
+
+# The archive the workers write to, or None. Created by setup().
+writer = None
+
+
+def setup(config):
+    ''' Opens config.archive_file for writing, if it is set. '''
+    global writer
+    shutdown()
+    if config.archive_file:
+        writer = ArchiveWriter(
+            config.archive_file, config.archive_codec, config.archive_level,
+            config.archive_queue)
+
+
+def record(url, resp):
+    ''' Archives the Response of url, if archiving is on. '''
+    if writer is not None:
+        writer.add(url, resp)
+
+
+def shutdown():
+    global writer
+    if writer is not None:
+        writer.close()
+        writer = None
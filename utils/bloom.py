@@ -0,0 +1,121 @@
+import os
+import math
+import struct
+
+HEADER = struct.Struct("<4sdQI")
+FILTER_HEADER = struct.Struct("<QdQIQ")
+MAGIC = b"BLM1"
+
+
+class BloomFilter(object):
+    '''
+    Fixed size Bloom filter over binary keys of at least 16 bytes (see
+    utils.get_urlkey). The bit positions are h1 + i * h2 mod num_bits, with
+    h1 and h2 the first two 8-byte words of the key, so no extra hashing is
+    done. Holds capacity keys with a false positive rate of about error_rate.
+    '''
+    def __init__(self, capacity, error_rate, bits=None, count=0):
+        self.capacity = capacity
+        self.error_rate = error_rate
+        self.num_bits = max(64, math.ceil(-capacity * math.log(error_rate) / math.log(2) ** 2))
+        self.num_hashes = max(1, round(self.num_bits / capacity * math.log(2)))
+        self.bits = bits if bits is not None else bytearray((self.num_bits + 7) // 8)
+        self.count = count
+
+    def _positions(self, key):
+        h1 = int.from_bytes(key[:8], "little")
+        h2 = int.from_bytes(key[8:16], "little") | 1
+        num_bits = self.num_bits
+        return [(h1 + i * h2) % num_bits for i in range(self.num_hashes)]
+
+    def __contains__(self, key):
+        bits = self.bits
+        for position in self._positions(key):
+            if not bits[position >> 3] & (1 << (position & 7)):
+                return False
+        return True
+
+    def add(self, key):
+        bits = self.bits
+        for position in self._positions(key):
+            bits[position >> 3] |= 1 << (position & 7)
+        self.count += 1
+
+    def is_full(self):
+        return self.count >= self.capacity
+
+
+class ScalableBloomFilter(object):
+    '''
+    Bloom filter that grows with the number of keys: when the last filter
+    is full a new one with GROWTH times its capacity and half its error
+    rate is added, so the total false positive rate stays below about
+    2 * error_rate however many keys there are.
+
+    "key not in filter" means the key was definitely never added; "key in
+    filter" means it probably was.
+    '''
+    GROWTH = 2
+    TIGHTENING = 0.5
+
+    def __init__(self, capacity=1000000, error_rate=0.001):
+        self.capacity = capacity
+        self.error_rate = error_rate
+        self.filters = [BloomFilter(capacity, error_rate * (1 - self.TIGHTENING))]
+
+    def __len__(self):
+        return sum(bloom.count for bloom in self.filters)
+
+    def __contains__(self, key):
+        for bloom in self.filters:
+            if key in bloom:
+                return True
+        return False
+
+    def add(self, key):
+        last = self.filters[-1]
+        if last.is_full():
+            last = BloomFilter(
+                last.capacity * self.GROWTH, last.error_rate * self.TIGHTENING)
+            self.filters.append(last)
+        last.add(key)
+
+    def save(self, filename):
+        ''' Writes the filter to filename through a temporary file and a rename. '''
+        tmpname = f"{filename}.tmp"
+        with open(tmpname, "wb") as bloomfile:
+            bloomfile.write(HEADER.pack(
+                MAGIC, self.error_rate, self.capacity, len(self.filters)))
+            for bloom in self.filters:
+                bloomfile.write(FILTER_HEADER.pack(
+                    bloom.capacity, bloom.error_rate, bloom.num_bits,
+                    bloom.num_hashes, bloom.count))
+                bloomfile.write(bloom.bits)
+        os.replace(tmpname, filename)
+
+    @classmethod
+    def load(cls, filename, capacity=1000000, error_rate=0.001):
+        '''
+        Reads a filter written by save. Returns a new empty filter if the
+        file does not exist or is not a filter file.
+        '''
+        try:
+            with open(filename, "rb") as bloomfile:
+                magic, file_error_rate, file_capacity, count = HEADER.unpack(
+                    bloomfile.read(HEADER.size))
+                if magic != MAGIC:
+                    return cls(capacity, error_rate)
+                loaded = cls(file_capacity, file_error_rate)
+                loaded.filters = list()
+                for _ in range(count):
+                    (bloom_capacity, bloom_error_rate, num_bits, num_hashes,
+                        bloom_count) = FILTER_HEADER.unpack(bloomfile.read(FILTER_HEADER.size))
+                    bits = bytearray(bloomfile.read((num_bits + 7) // 8))
+                    bloom = BloomFilter(bloom_capacity, bloom_error_rate, bits, bloom_count)
+                    if (bloom.num_bits != num_bits or bloom.num_hashes != num_hashes
+                            or len(bits) != (num_bits + 7) // 8):
+                        return cls(capacity, error_rate)
+                    loaded.filters.append(bloom)
+                return loaded if loaded.filters else cls(capacity, error_rate)
+        except (FileNotFoundError, struct.error):
+            return cls(capacity, error_rate)
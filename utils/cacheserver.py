@@ -0,0 +1,286 @@
+'''
+Local stand-in for the course cache server, for crawling and benchmarking
+without network access.
+
+    python -m utils.cacheserver --port 9000 --pages 10000 --latency 0.05
+    python launch.py --cache_server 127.0.0.1:9000
+
+It answers GET /?q=<url>&u=<user agent> with the same CBOR body as the
+real server ({"url", "status", "response": pickled requests.Response}),
+which is what utils.download and utils.response.Response read.
+
+The pages come from a SyntheticWeb, a made-up UCI-like site that is the
+same for the same seed, or from a file recorded from a real cache server
+(--record / --replay).
+'''
+import re
+import time
+import pickle
+import random
+from argparse import ArgumentParser
+from hashlib import blake2b
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from threading import Thread, Lock
+from urllib.parse import urlsplit, parse_qs
+
+import cbor
+import requests
+
+HOSTS = [
+    "www.ics.uci.edu", "www.cs.uci.edu", "www.informatics.uci.edu",
+    "www.stat.uci.edu", "vision.ics.uci.edu", "sdcl.ics.uci.edu",
+    "hpi.ics.uci.edu", "cml.ics.uci.edu", "wics.ics.uci.edu", "ngs.ics.uci.edu"]
+SYLLABLES = ["ka", "lo", "mi", "ne", "ra", "su", "ti", "vo", "ze", "da",
+             "in", "for", "ma", "tics", "com", "pu", "ter", "sci", "ence", "re"]
+PAGE_PATH = re.compile(r"^/page/(\d+)(/print)?$")
+DAY_PATH = re.compile(r"^/calendar/day/(-?\d+)$")
+WIKI_PATH = re.compile(r"^/doku\.php/topic(\d+)$")
+
+
+class SyntheticWeb(object):
+    '''
+    Deterministic UCI-like web graph of about `pages` pages over HOSTS.
+    Every url is turned into a page from a random generator seeded with the
+    url, so nothing is stored and two servers with the same seed serve the
+    same site.
+
+    https://<host>             hub page linking to pages of that host
+    https://<host>/page/<n>    ordinary page with 8 links across hosts;
+                               every 13th page has too few words, every
+                               large_every-th page has large_words words,
+                               every 97th link is dead (404)
+    .../page/<n>/print         exact duplicate of page n
+    .../page/<n>?share=<m>     exact duplicate of page n
+    .../events/<yyyy-mm-dd>    calendar caught by the date rules of is_banned
+    .../calendar/day/<k>       endless calendar with thin pages, linking to
+                               the days before and after: a trap only the
+                               trap detector can find
+    wiki.ics.uci.edu/doku.php/topic<k>?rev=<r>
+                               wiki revisions, near duplicates of each other
+    '''
+    def __init__(self, pages=10000, seed=121, words=5000, large_every=500, large_words=200000):
+        self.pages = pages
+        self.seed = seed
+        self.large_every = large_every
+        self.large_words = large_words
+        rand = random.Random(seed)
+        self.vocabulary = sorted(set(
+            "".join(rand.choice(SYLLABLES) for _ in range(rand.randint(1, 4)))
+            for _ in range(words)))
+        # Zipf-like word frequencies
+        self.cum_weights = list()
+        total = 0.0
+        for rank in range(len(self.vocabulary)):
+            total += 1.0 / (rank + 1)
+            self.cum_weights.append(total)
+
+    def _random(self, key):
+        digest = blake2b(f"{self.seed}:{key}".encode("utf-8"), digest_size=8).digest()
+        return random.Random(int.from_bytes(digest, "big"))
+
+    def _text(self, rand, count):
+        return " ".join(rand.choices(self.vocabulary, cum_weights=self.cum_weights, k=count))
+
+    def _page_url(self, n):
+        return f"https://{HOSTS[n % len(HOSTS)]}/page/{n}"
+
+    def _html(self, title, text, links):
+        anchors = "\n".join(f'<li><a href="{link}">{link}</a></li>' for link in links)
+        return (f"<html><head><title>{title}</title></head><body><h1>{title}</h1>"
+                f"<p>{text}</p><ul>{anchors}</ul></body></html>").encode("utf-8")
+
+    def page(self, n):
+        ''' (status, html) of ordinary page n. '''
+        if not 0 <= n < self.pages:
+            return 404, None
+        rand = self._random(n)
+        if n % self.large_every == 0:
+            count = self.large_words
+        elif n % 13 == 0:
+            count = rand.randint(10, 80)
+        else:
+            count = rand.randint(150, 1500)
+        links = [self._page_url(rand.randrange(self.pages)) for _ in range(8)]
+        if rand.random() < 0.1:
+            links.append(self._page_url(self.pages + rand.randrange(self.pages)))
+        links.append(f"/page/{n}/print")
+        links.append(f"/page/{n}?share={rand.randrange(1000)}")
+        if rand.random() < 0.05:
+            links.append(f"https://www.ics.uci.edu/events/2019-{rand.randint(1, 12):02}-{rand.randint(1, 28):02}")
+        if rand.random() < 0.05:
+            links.append(f"https://www.ics.uci.edu/calendar/day/{rand.randrange(365)}")
+        if rand.random() < 0.05:
+            links.append(f"https://wiki.ics.uci.edu/doku.php/topic{rand.randrange(50)}?rev=1")
+        return 200, self._html(f"Page {n}", self._text(rand, count), links)
+
+    def fetch(self, url):
+        ''' (status, html or None) for url, like the real site would answer. '''
+        parts = urlsplit(url)
+        host, path = parts.netloc.lower(), parts.path.rstrip("/")
+        query = parse_qs(parts.query)
+        if host in HOSTS and not path:
+            rand = self._random(host)
+            index = HOSTS.index(host)
+            links = [self._page_url(index + len(HOSTS) * rand.randrange(
+                max(self.pages // len(HOSTS), 1))) for _ in range(20)]
+            return 200, self._html(host, self._text(rand, 300), links)
+        match = PAGE_PATH.match(path)
+        if match and host in HOSTS:
+            n = int(match.group(1))
+            if HOSTS[n % len(HOSTS)] != host or (n % 97 == 0 and not match.group(2)):
+                return 404, None
+            return self.page(n)
+        match = DAY_PATH.match(path)
+        if match and host == "www.ics.uci.edu":
+            day = int(match.group(1))
+            rand = self._random(f"day{day}")
+            links = [f"/calendar/day/{day - 1}", f"/calendar/day/{day + 1}",
+                     self._page_url(rand.randrange(self.pages))]
+            return 200, self._html(f"Day {day}", self._text(rand, 40), links)
+        if path.startswith("/events/") and host == "www.ics.uci.edu":
+            return 200, self._html(path, self._text(self._random(path), 120), [])
+        match = WIKI_PATH.match(path)
+        if match and host == "wiki.ics.uci.edu":
+            topic = int(match.group(1))
+            revision = int(query.get("rev", ["1"])[0])
+            rand = self._random(f"topic{topic}")
+            text = self._text(rand, 400) + " " + self._text(self._random(f"rev{revision}"), 3)
+            links = [f"/doku.php/topic{topic}?rev={revision + 1}",
+                     f"/doku.php/topic{topic}?rev={revision}&do=diff",
+                     f"/doku.php/topic{(topic + 1) % 50}?rev=1"]
+            return 200, self._html(f"Topic {topic}", text, links)
+        return 404, None
+
+
+class RecordedWeb(object):
+    '''
+    Pages recorded from a real cache server: a file of CBOR records
+    {"q": url, "body": CBOR body the server sent}, as written by recording
+    mode. Urls that were not recorded get status 404.
+    '''
+    def __init__(self, filename):
+        self.bodies = dict()
+        with open(filename, "rb") as recordfile:
+            while True:
+                try:
+                    record = cbor.load(recordfile)
+                except Exception: # end of file, or a torn last record
+                    break
+                self.bodies[record["q"]] = record["body"]
+
+    def body(self, url):
+        return self.bodies.get(url)
+
+
+def response_body(url, status, content):
+    ''' CBOR body of the cache server for url. '''
+    response = requests.Response()
+    response.url = url
+    response.status_code = status
+    response.headers["Content-Type"] = "text/html; charset=utf-8"
+    response.encoding = "utf-8"
+    response._content = content if content is not None else b""
+    response._content_consumed = True
+    return cbor.dumps({"url": url, "status": status, "response": pickle.dumps(response)})
+
+
+class CacheServer(object):
+    '''
+    The HTTP server. Serves web (a SyntheticWeb), or the recorded bodies of
+    recorded (a RecordedWeb), or forwards to upstream (host, port) and
+    appends every answer to record_file. Each request waits latency seconds
+    plus up to jitter seconds more.
+    '''
+    def __init__(self, port, web=None, recorded=None, upstream=None,
+                 record_file=None, latency=0.0, jitter=0.0, host="127.0.0.1"):
+        self.web = web
+        self.recorded = recorded
+        self.upstream = upstream
+        self.record_file = record_file
+        self.record_lock = Lock()
+        self.latency = latency
+        self.jitter = jitter
+        self.requests = 0
+        self.httpd = ThreadingHTTPServer((host, port), self._handler())
+        self.httpd.daemon_threads = True
+        self.address = self.httpd.server_address
+
+    def _handler(self):
+        server = self
+        class CacheHandler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+            def log_message(self, *args):
+                pass
+            def do_GET(self):
+                query = parse_qs(urlsplit(self.path).query)
+                url = query.get("q", [""])[0]
+                body = server.answer(url, query.get("u", [""])[0])
+                self.send_response(200)
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+        return CacheHandler
+
+    def answer(self, url, user_agent):
+        self.requests += 1
+        if self.latency or self.jitter:
+            time.sleep(self.latency + random.uniform(0, self.jitter))
+        if self.upstream:
+            body = requests.get(
+                f"http://{self.upstream[0]}:{self.upstream[1]}/",
+                params=[("q", url), ("u", user_agent)]).content
+            with self.record_lock, open(self.record_file, "ab") as recordfile:
+                cbor.dump({"q": url, "body": body}, recordfile)
+            return body
+        if self.recorded:
+            body = self.recorded.body(url)
+            return body if body is not None else response_body(url, 404, None)
+        status, content = self.web.fetch(url)
+        return response_body(url, status, content)
+
+    def start(self):
+        ''' Serves on a daemon thread and returns self. '''
+        Thread(target=self.httpd.serve_forever, daemon=True).start()
+        return self
+
+    def serve_forever(self):
+        self.httpd.serve_forever()
+
+    def stop(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+
+def main():
+    parser = ArgumentParser(description="Local stand-in for the cache server.")
+    parser.add_argument("--port", type=int, default=9000)
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--pages", type=int, default=10000, help="size of the synthetic site")
+    parser.add_argument("--seed", type=int, default=121)
+    parser.add_argument("--latency", type=float, default=0.0, help="seconds per request")
+    parser.add_argument("--jitter", type=float, default=0.0, help="up to this many more seconds")
+    parser.add_argument("--replay", help="serve the pages recorded in this file")
+    parser.add_argument("--record", help="append the answers of --upstream to this file")
+    parser.add_argument("--upstream", help="host:port of the cache server to record")
+    args = parser.parse_args()
+    if args.record and not args.upstream:
+        parser.error("--record needs --upstream")
+    if args.upstream and not args.record:
+        parser.error("--upstream is only used with --record")
+    kwargs = dict(latency=args.latency, jitter=args.jitter, host=args.host)
+    if args.record:
+        upstream_host, _, upstream_port = args.upstream.rpartition(":")
+        if not upstream_host or not upstream_port.isdigit():
+            parser.error(f"--upstream must be host:port, not {args.upstream}")
+        server = CacheServer(args.port, upstream=(upstream_host, int(upstream_port)),
+                             record_file=args.record, **kwargs)
+    elif args.replay:
+        server = CacheServer(args.port, recorded=RecordedWeb(args.replay), **kwargs)
+    else:
+        server = CacheServer(args.port, web=SyntheticWeb(args.pages, args.seed), **kwargs)
+    print(f"Cache server on {server.address[0]}:{server.address[1]}")
+    server.serve_forever()
+
+
+if __name__ == "__main__":
+    main()
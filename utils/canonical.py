@@ -0,0 +1,71 @@
+import re
+from functools import lru_cache
+from urllib.parse import urljoin, urlsplit, urlunsplit, quote
+
+# Number of (url, base) pairs whose canonical form is remembered
+CANONICAL_CACHE_SIZE = 1 << 18
+
+DEFAULT_PORTS = {"http": "80", "https": "443"}
+UNRESERVED = frozenset(
+    "ABCDEFGHIJKLMNOPQRSTUVWXYZabcdefghijklmnopqrstuvwxyz0123456789-._~")
+PERCENT_PATTERN = re.compile(r"%([0-9a-fA-F]{2})")
+# Characters left as they are when quoting a path or query; '%' is kept so
+# existing escapes are not escaped again
+PATH_SAFE = "/%:@!$&'()*+,;=-._~"
+QUERY_SAFE = PATH_SAFE + "?"
+
+
+def _normalize_escape(match):
+    char = chr(int(match.group(1), 16))
+    return char if char in UNRESERVED else "%" + match.group(1).upper()
+
+
+def normalize_percent(text, safe):
+    '''
+    Escapes the characters of text that must be escaped (spaces, non-ASCII),
+    decodes escaped unreserved characters and uppercases the other escapes,
+    so every spelling of the same path gives the same string.
+    '''
+    return PERCENT_PATTERN.sub(_normalize_escape, quote(text, safe=safe))
+
+
+@lru_cache(maxsize=CANONICAL_CACHE_SIZE)
+def canonicalize(url, base=None):
+    '''
+    Returns the canonical form of url, resolved against base (the url of the
+    page it was found on) if it is relative, or None if it cannot be parsed
+    or is not a string.
+
+    Lowercases the scheme and host, drops default ports, the fragment and the
+    trailing slash, normalizes percent-encoding, and sorts the query
+    parameters and drops repeated ones. Every url the crawler stores, counts
+    or fetches goes through here first.
+    '''
+    if not isinstance(url, str):
+        return None
+    try:
+        if base:
+            url = urljoin(base, url.strip())
+        scheme, netloc, path, query, _ = urlsplit(url.strip())
+    except ValueError: # e.g. a broken IPv6 host
+        return None
+    scheme = scheme.lower()
+    userinfo, at, hostport = netloc.rpartition("@")
+    if hostport.startswith("["): # IPv6 literal
+        host, bracket, port = hostport.partition("]")
+        host += bracket
+        colon, port = port[:1], port[1:]
+    else:
+        host, colon, port = hostport.partition(":")
+    host = host.lower().rstrip(".")
+    if not colon or port == DEFAULT_PORTS.get(scheme) or port == "":
+        hostport = host
+    else:
+        hostport = f"{host}:{port}"
+    netloc = f"{userinfo}@{hostport}" if at else hostport
+    path = normalize_percent(path, PATH_SAFE).rstrip("/")
+    if query:
+        params = sorted(set(
+            normalize_percent(param, QUERY_SAFE) for param in query.split("&") if param))
+        query = "&".join(params)
+    return urlunsplit((scheme, netloc, path, query, ""))
@@ -8,12 +8,78 @@ class Config(object):
         assert self.user_agent != "DEFAULT AGENT", "Set useragent in config.ini"
         assert re.match(r"^[a-zA-Z0-9_ ,]+$", self.user_agent), "User agent should not have any special characters outside '_', ',' and 'space'"
         self.threads_count = int(config["LOCAL PROPERTIES"]["THREADCOUNT"])
+        self.engine = config.get("LOCAL PROPERTIES", "ENGINE", fallback="threads").strip().lower()
+        self.async_requests = config.getint("LOCAL PROPERTIES", "ASYNCREQUESTS", fallback=200)
+        self.parse_threads = config.getint("LOCAL PROPERTIES", "PARSETHREADS", fallback=4)
+        self.parse_processes = config.getint("LOCAL PROPERTIES", "PARSEPROCESSES", fallback=0)
+        self.pipeline_queue = config.getint("LOCAL PROPERTIES", "PIPELINEQUEUE", fallback=64)
         self.save_file = config["LOCAL PROPERTIES"]["SAVE"]
+        self.save_backend = config.get("LOCAL PROPERTIES", "SAVEBACKEND", fallback="shelve").strip().lower()
+        self.save_batch = config.getint("LOCAL PROPERTIES", "SAVEBATCH", fallback=1000)
+        self.save_window = config.getfloat("LOCAL PROPERTIES", "SAVEWINDOW", fallback=1.0)
+        self.bloom_capacity = config.getint("LOCAL PROPERTIES", "BLOOMCAPACITY", fallback=1000000)
+        self.bloom_error = config.getfloat("LOCAL PROPERTIES", "BLOOMERROR", fallback=0.001)
+        self.scorer = config.get("LOCAL PROPERTIES", "SCORER", fallback="crawler.scoring.DefaultScorer").strip()
+        self.host_queue = config.getint("LOCAL PROPERTIES", "HOSTQUEUE", fallback=10000)
+        self.host_budget = config.getint("LOCAL PROPERTIES", "HOSTBUDGET", fallback=1000)
+        self.subdomains_file = config.get("LOCAL PROPERTIES", "SUBDOMAINS", fallback="subdomains.json")
+        self.trap_templates = config.getint("LOCAL PROPERTIES", "TRAPTEMPLATES", fallback=10000)
+        self.trap_min_pages = config.getint("LOCAL PROPERTIES", "TRAPMINPAGES", fallback=20)
+        self.trap_bad_ratio = config.getfloat("LOCAL PROPERTIES", "TRAPBADRATIO", fallback=0.8)
+        self.trap_max_links = config.getint("LOCAL PROPERTIES", "TRAPMAXLINKS", fallback=1000)
+        self.trap_max_values = config.getint("LOCAL PROPERTIES", "TRAPMAXVALUES", fallback=50)
+        self.trap_throttle = config.getint("LOCAL PROPERTIES", "TRAPTHROTTLE", fallback=10)
+        self.trap_max_depth = config.getint("LOCAL PROPERTIES", "TRAPMAXDEPTH", fallback=12)
+        self.trap_max_repeats = config.getint("LOCAL PROPERTIES", "TRAPMAXREPEATS", fallback=2)
+        self.explored_file = config.get("LOCAL PROPERTIES", "EXPLORED", fallback="explored.json")
+        self.explored_flush = config.getfloat("LOCAL PROPERTIES", "EXPLOREDFLUSH", fallback=5.0)
+        self.explored_compact = config.getint("LOCAL PROPERTIES", "EXPLOREDCOMPACT", fallback=50000)
+        self.wordtotals_file = config.get("LOCAL PROPERTIES", "WORDTOTALS", fallback="wordtotals.json")
+        self.wordtotals_pages = config.getint("LOCAL PROPERTIES", "WORDTOTALSPAGES", fallback=500)
+        self.wordtotals_seconds = config.getfloat("LOCAL PROPERTIES", "WORDTOTALSSECONDS", fallback=60.0)
+        self.word_stats = config.get("LOCAL PROPERTIES", "WORDSTATS", fallback="exact").strip().lower()
+        self.wordstats_file = config.get("LOCAL PROPERTIES", "WORDSTATSFILE", fallback="wordstats.bin")
+        self.wordstats_top = config.getint("LOCAL PROPERTIES", "WORDSTATSTOPK", fallback=1000)
+        self.wordstats_width = config.getint("LOCAL PROPERTIES", "WORDSTATSWIDTH", fallback=65536)
+        self.wordstats_depth = config.getint("LOCAL PROPERTIES", "WORDSTATSDEPTH", fallback=4)
+        self.simhash_file = config.get("LOCAL PROPERTIES", "SIMHASH", fallback="simhash.bin")
+        self.simhash_distance = config.getint("LOCAL PROPERTIES", "SIMHASHDISTANCE", fallback=3)
+        self.metrics_file = config.get("LOCAL PROPERTIES", "METRICSFILE", fallback="metrics.json").strip()
+        self.metrics_interval = config.getfloat("LOCAL PROPERTIES", "METRICSINTERVAL", fallback=10.0)
+        self.metrics_port = config.getint("LOCAL PROPERTIES", "METRICSPORT", fallback=0)
+        self.archive_file = config.get("LOCAL PROPERTIES", "ARCHIVE", fallback="").strip()
+        self.archive_codec = config.get("LOCAL PROPERTIES", "ARCHIVECODEC", fallback="gzip").strip().lower()
+        self.archive_level = config.getint("LOCAL PROPERTIES", "ARCHIVELEVEL", fallback=6)
+        self.archive_queue = config.getint("LOCAL PROPERTIES", "ARCHIVEQUEUE", fallback=256)
+        self.link_graph = config.get("LOCAL PROPERTIES", "LINKGRAPH", fallback="").strip()
+        self.log_batch = config.getint("LOCAL PROPERTIES", "LOGBATCH", fallback=1000)
+        self.log_flush = config.getfloat("LOCAL PROPERTIES", "LOGFLUSH", fallback=1.0)
+        self.log_console_rate = config.getfloat("LOCAL PROPERTIES", "LOGCONSOLERATE", fallback=20.0)
+        self.fetch_log = config.get("LOCAL PROPERTIES", "FETCHLOG", fallback="").strip()
 
         self.host = config["CONNECTION"]["HOST"]
         self.port = int(config["CONNECTION"]["PORT"])
+        self.pool_size = config.getint("CONNECTION", "POOLSIZE", fallback=10)
+        self.connect_timeout = config.getfloat("CONNECTION", "CONNECTTIMEOUT", fallback=5.0)
+        self.read_timeout = config.getfloat("CONNECTION", "READTIMEOUT", fallback=30.0)
+        self.retries = config.getint("CONNECTION", "RETRIES", fallback=3)
+        self.backoff = config.getfloat("CONNECTION", "BACKOFF", fallback=0.5)
+        self.backoff_max = config.getfloat("CONNECTION", "BACKOFFMAX", fallback=10.0)
+        local_cache_server = config.get("CONNECTION", "CACHESERVER", fallback="").strip()
+        self.local_cache_server = (
+            (local_cache_server.rpartition(":")[0], int(local_cache_server.rpartition(":")[2]))
+            if local_cache_server else None)
 
         self.seed_urls = config["CRAWLER"]["SEEDURL"].split(",")
         self.time_delay = float(config["CRAWLER"]["POLITENESS"])
 
+        # Distributed mode: the listener of node i is peers[i]
+        self.node_id = None
+        self.peers = [
+            (peer.strip().rpartition(":")[0], int(peer.strip().rpartition(":")[2]))
+            for peer in config.get("DISTRIBUTED", "NODES", fallback="").split(",") if peer.strip()]
+        self.forward_batch = config.getint("DISTRIBUTED", "FORWARDBATCH", fallback=500)
+        self.forward_interval = config.getfloat("DISTRIBUTED", "FORWARDINTERVAL", fallback=1.0)
+        self.idle_timeout = config.getfloat("DISTRIBUTED", "IDLETIMEOUT", fallback=30.0)
+
         self.cache_server = None
\ No newline at end of file
@@ -1,21 +1,130 @@
 import requests
 import cbor
 import time
+import random
+
+from threading import Lock
+from requests.adapters import HTTPAdapter
 
 from utils.response import Response
+from utils import metrics, logs
+
+# Status of the Response returned when the cache server could not be reached
+FAILED_STATUS = 0
+# HTTP statuses from the cache server itself that are worth another try
+RETRY_STATUSES = {429, 500, 502, 503, 504}
+
+# One keep-alive connection pool to the cache server, shared by all workers
+session = None
+session_lock = Lock()
+stats = {"requests": 0, "retries": 0, "failures": 0}
+# Connections opened and reused by clients other than session (the async engine)
+connection_stats = {"connections": 0, "reused": 0}
+
+def get_session(config):
+    global session
+    with session_lock:
+        if session is None:
+            session = requests.Session()
+            session.mount("http://", HTTPAdapter(
+                pool_connections=1, pool_maxsize=config.pool_size, max_retries=0))
+        return session
 
 def download(url, config, logger=None):
     host, port = config.cache_server
-    resp = requests.get(
-        f"http://{host}:{port}/",
-        params=[("q", f"{url}"), ("u", f"{config.user_agent}")])
+    client = get_session(config)
+    started = time.perf_counter()
+    for attempt in range(config.retries + 1):
+        if attempt:
+            time.sleep(backoff_delay(attempt, config))
+        count("requests", attempt)
+        try:
+            with metrics.timer("fetch_seconds"):
+                resp = client.get(
+                    f"http://{host}:{port}/",
+                    params=[("q", f"{url}"), ("u", f"{config.user_agent}")],
+                    timeout=(config.connect_timeout, config.read_timeout))
+        except (requests.ConnectionError, requests.Timeout) as e:
+            error = repr(e)
+            continue
+        if resp.status_code in RETRY_STATUSES:
+            error = f"status {resp.status_code}"
+            continue
+        response = to_response(
+            url, resp, resp.status_code, resp.content if resp else None, logger)
+        log_fetch(url, response, len(resp.content or b""), started, attempt + 1)
+        return response
+    count("failures")
+    response = failed_response(url, f"{error} after {config.retries + 1} attempts", logger)
+    log_fetch(url, response, 0, started, config.retries + 1)
+    return response
+
+def backoff_delay(attempt, config):
+    '''
+    Seconds to wait before retry number attempt (1, 2, ...): exponential
+    backoff capped at config.backoff_max, with full jitter so workers that
+    failed together do not retry together.
+    '''
+    return random.uniform(0, min(config.backoff_max, config.backoff * 2 ** (attempt - 1)))
+
+def count(name, attempt=0):
+    ''' Adds one to stats[name]; requests after the first attempt also count as retries. '''
+    with session_lock:
+        stats[name] += 1
+        if attempt:
+            stats["retries"] += 1
+    metrics.inc(f"fetch_{name}")
+    if attempt:
+        metrics.inc("fetch_retries")
+
+def count_connection(reused):
+    ''' Counts a connection to the cache server opened, or reused, outside session. '''
+    with session_lock:
+        connection_stats["reused" if reused else "connections"] += 1
+
+def log_fetch(url, resp, size, started, attempts):
+    ''' Writes the download of url to the fetch log, if FETCHLOG is set. '''
+    logs.fetch_event({
+        "time": round(time.time(), 3), "url": url, "status": resp.status, "bytes": size,
+        "seconds": round(time.perf_counter() - started, 6), "attempts": attempts,
+        "error": resp.error})
+
+def download_stats():
+    '''
+    Request, retry and failure counts, plus how many connections to the cache
+    server were opened and how many requests reused an open one.
+    '''
+    with session_lock:
+        result = dict(stats, **connection_stats)
+        if session is not None:
+            pools = session.get_adapter("http://").poolmanager.pools
+            for key in pools.keys():
+                pool = pools[key]
+                result["connections"] += pool.num_connections
+                result["reused"] += max(pool.num_requests - pool.num_connections, 0)
+    return result
+
+def to_response(url, resp, status_code, content, logger=None):
+    '''
+    Turns the body the cache server sent for url into a Response. content
+    is None for unsuccessful HTTP responses; resp only goes in the error message.
+    '''
     try:
-        if resp and resp.content:
-            return Response(cbor.loads(resp.content))
+        if content:
+            return Response(cbor.loads(content))
     except (EOFError, ValueError) as e:
         pass
     logger.error(f"Spacetime Response error {resp} with url {url}.")
     return Response({
         "error": f"Spacetime Response error {resp} with url {url}.",
-        "status": resp.status_code,
+        "status": status_code,
+        "url": url})
+
+def failed_response(url, error, logger=None):
+    ''' Response for a download that never got an answer from the cache server. '''
+    if logger:
+        logger.error(f"Download of {url} failed: {error}")
+    return Response({
+        "error": f"Download of {url} failed: {error}",
+        "status": FAILED_STATUS,
         "url": url})
@@ -0,0 +1,130 @@
+import os
+import json
+import time
+from threading import RLock
+
+from utils import write_json_atomic, metrics
+
+FLUSH_SERIES = metrics.series("flush_seconds", file="explored_log")
+COMPACT_SERIES = metrics.series("flush_seconds", file="explored")
+
+
+class ExploredStore(object):
+    '''
+    In-memory version of explored.json: a dict of defragmented URL -> number
+    of words (0 = discovered, -1 = invalid).
+
+    Every change is kept in memory and appended to "<filename>.log" in batches
+    of at most flush_interval seconds. Once the log has compact_every records
+    it is folded back into the snapshot file (same format as the old
+    explored.json) and truncated. A crash loses at most one flush interval.
+    '''
+    def __init__(self, filename, seeds=None, flush_interval=5.0, compact_every=50000):
+        self.filename = filename
+        self.log_filename = filename + ".log"
+        self.flush_interval = flush_interval
+        self.compact_every = compact_every
+        self._lock = RLock()
+        self._urls = dict()
+        self._pending = list()
+        self._log_records = 0
+        self._last_flush = time.monotonic()
+        self._load(seeds)
+
+    def _load(self, seeds):
+        found = False
+        try:
+            with open(self.filename, "r") as setfile:
+                self._urls = json.load(setfile)
+            found = True
+        except FileNotFoundError:
+            pass
+        try:
+            with open(self.log_filename, "r") as logfile:
+                for line in logfile:
+                    try:
+                        url, value = json.loads(line)
+                    except ValueError: # torn last line from a crash mid-write
+                        break
+                    self._urls[url] = value
+                    self._log_records += 1
+            found = True
+        except FileNotFoundError:
+            pass
+        if not found and seeds:
+            # First run: start with the seed urls, like explored.json used to
+            for url in seeds:
+                self._record(url, 0)
+
+    def __contains__(self, url):
+        return url in self._urls
+
+    def __len__(self):
+        return len(self._urls)
+
+    def __getitem__(self, url):
+        return self._urls[url]
+
+    def get(self, url, default=None):
+        return self._urls.get(url, default)
+
+    def items(self):
+        with self._lock:
+            return list(self._urls.items())
+
+    def add(self, url, value=0):
+        '''
+        Adds url with the given value if it is not already stored.
+        Returns True if it was added, False if it was already there.
+        '''
+        with self._lock:
+            if url in self._urls:
+                return False
+            self._record(url, value)
+        self.maybe_flush()
+        return True
+
+    def __setitem__(self, url, value):
+        with self._lock:
+            self._record(url, value)
+        self.maybe_flush()
+
+    def _record(self, url, value):
+        self._urls[url] = value
+        self._pending.append((url, value))
+
+    def maybe_flush(self):
+        ''' Flushes pending changes if the flush interval has passed. '''
+        if self._pending and time.monotonic() - self._last_flush >= self.flush_interval:
+            self.flush()
+
+    def flush(self):
+        ''' Appends all pending changes to the log, compacting it if it got too long. '''
+        with self._lock:
+            self._last_flush = time.monotonic()
+            if not self._pending:
+                return
+            with metrics.timer(FLUSH_SERIES), open(self.log_filename, "a") as logfile:
+                logfile.write("".join(json.dumps(change) + "\n" for change in self._pending))
+            self._log_records += len(self._pending)
+            self._pending = list()
+            if self._log_records >= self.compact_every:
+                self.compact()
+
+    def compact(self):
+        ''' Writes the whole dict to the snapshot file and truncates the log. '''
+        with self._lock, metrics.timer(COMPACT_SERIES):
+            self._pending = list()
+            write_json_atomic(self.filename, self._urls)
+            # Replaying the log over the new snapshot is harmless, so a crash
+            # between these two steps loses nothing.
+            if os.path.exists(self.log_filename):
+                os.remove(self.log_filename)
+            self._log_records = 0
+
+    def close(self):
+        ''' Flushes everything and leaves a compacted snapshot on disk. '''
+        with self._lock:
+            self.flush()
+            if self._log_records or not os.path.exists(self.filename):
+                self.compact()
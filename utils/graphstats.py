@@ -0,0 +1,407 @@
+'''
+Link graph analytics with numpy, over the files of utils/linkgraph.py.
+
+    python -m utils.graphstats [--config_file config.ini] [--graph LINKGRAPH ...] [--top 20] [--json]
+
+builds LINKGRAPH.csr, prints PageRank, in-degree, host to host links and
+possible trap regions, and writes LINKGRAPH.scores.npz for GraphScorer
+(see crawler/scoring.py). Several --graph files (the nodes of a
+distributed crawl) are merged by url.
+
+The CSR file is a CSR_HEADER (magic, nodes, edges, bytes of urls), the
+indptr (uint64, nodes + 1) and indices (uint32, edges) arrays and the urls,
+one per line. The links from node i are indices[indptr[i]:indptr[i + 1]],
+sorted and without repeats.
+'''
+import os
+import sys
+import json
+import time
+import struct
+from argparse import ArgumentParser
+from configparser import ConfigParser
+from contextlib import redirect_stdout
+
+import numpy as np
+
+from utils import get_urlkey
+
+CSR_HEADER = struct.Struct("<4sQQQ")
+CSR_MAGIC = b"CSR1"
+# Rounds of removing nodes without links in or out before Tarjan's algorithm
+TRIM_ROUNDS = 10
+
+
+class CSRGraph(object):
+    ''' A link graph in compressed sparse row form, with its urls. '''
+    def __init__(self, urls, indptr, indices):
+        self.urls = urls
+        self.indptr = indptr
+        self.indices = indices
+
+    @property
+    def nodes(self):
+        return len(self.indptr) - 1
+
+    @property
+    def edges(self):
+        return len(self.indices)
+
+    @classmethod
+    def from_edges(cls, urls, sources, targets):
+        ''' Sorts the (source, target) id pairs and drops repeated links. '''
+        nodes = len(urls)
+        pairs = sorted_unique((sources.astype(np.uint64) << np.uint64(32)) | targets.astype(np.uint64))[0]
+        sources = (pairs >> np.uint64(32)).astype(np.int64)
+        indptr = np.zeros(nodes + 1, dtype=np.uint64)
+        np.cumsum(np.bincount(sources, minlength=nodes), out=indptr[1:])
+        return cls(urls, indptr, (pairs & np.uint64(0xFFFFFFFF)).astype(np.uint32))
+
+    def sources(self):
+        ''' The source id of every link, in the order of indices. '''
+        return np.repeat(np.arange(self.nodes, dtype=np.uint32), np.diff(self.indptr).astype(np.int64))
+
+    def save(self, filename):
+        urls = "".join(f"{url}\n" for url in self.urls).encode("utf-8")
+        tmpname = f"{filename}.tmp"
+        with open(tmpname, "wb") as csrfile:
+            csrfile.write(CSR_HEADER.pack(CSR_MAGIC, self.nodes, self.edges, len(urls)))
+            csrfile.write(self.indptr.astype("<u8").tobytes())
+            csrfile.write(self.indices.astype("<u4").tobytes())
+            csrfile.write(urls)
+        os.replace(tmpname, filename)
+
+    @classmethod
+    def load(cls, filename):
+        ''' Maps the arrays of a CSR file without reading them. '''
+        with open(filename, "rb") as csrfile:
+            magic, nodes, edges, url_bytes = CSR_HEADER.unpack(csrfile.read(CSR_HEADER.size))
+        if magic != CSR_MAGIC:
+            raise ValueError(f"{filename} is not a CSR file.")
+        offset = CSR_HEADER.size
+        indptr = np.memmap(filename, dtype="<u8", mode="r", offset=offset, shape=(nodes + 1,))
+        offset += 8 * (nodes + 1)
+        indices = (np.memmap(filename, dtype="<u4", mode="r", offset=offset, shape=(edges,))
+                   if edges else np.zeros(0, dtype=np.uint32))
+        with open(filename, "rb") as csrfile:
+            csrfile.seek(offset + 4 * edges)
+            urls = csrfile.read(url_bytes).decode("utf-8").split("\n")[:nodes]
+        return cls(urls, indptr, indices)
+
+
+def sorted_unique(values):
+    ''' (sorted distinct values, how often each occurs): np.unique, but by sorting only. '''
+    values = np.sort(values)
+    if not len(values):
+        return values, np.zeros(0, dtype=np.int64)
+    starts = np.flatnonzero(np.concatenate(([True], values[1:] != values[:-1])))
+    return values[starts], np.diff(np.append(starts, len(values)))
+
+
+def read_edges(filename):
+    ''' (urls, sources, targets) of the LinkGraph filename. '''
+    with open(filename + ".urls", "r", encoding="utf-8") as urlfile:
+        urls = urlfile.read().split("\n")[:-1]
+    pairs = np.fromfile(filename + ".edges", dtype="<u4")
+    pairs = pairs[:len(pairs) - len(pairs) % 2].reshape(-1, 2)
+    # Links written after their urls were cut off by a crash are left out
+    keep = (pairs < len(urls)).all(axis=1)
+    return urls, pairs[keep, 0], pairs[keep, 1]
+
+
+def load_graph(filenames):
+    ''' CSRGraph of one or more LinkGraph files, merged by url. '''
+    if len(filenames) == 1:
+        return CSRGraph.from_edges(*read_edges(filenames[0]))
+    ids = dict()
+    urls = list()
+    sources, targets = list(), list()
+    for filename in filenames:
+        file_urls, file_sources, file_targets = read_edges(filename)
+        mapping = np.empty(len(file_urls), dtype=np.uint32)
+        for position, url in enumerate(file_urls):
+            url_id = ids.get(url)
+            if url_id is None:
+                url_id = ids[url] = len(urls)
+                urls.append(url)
+            mapping[position] = url_id
+        sources.append(mapping[file_sources])
+        targets.append(mapping[file_targets])
+    return CSRGraph.from_edges(urls, np.concatenate(sources), np.concatenate(targets))
+
+
+def in_degree(graph):
+    return np.bincount(graph.indices, minlength=graph.nodes)
+
+
+def pagerank(graph, damping=0.85, iterations=100, tolerance=1e-9):
+    '''
+    PageRank of every node, summing to 1. The rank of pages without links
+    (including every url not downloaded yet) is spread over all pages.
+    '''
+    nodes = graph.nodes
+    if not nodes:
+        return np.zeros(0)
+    sources = graph.sources()
+    targets = graph.indices
+    out_degree = np.diff(graph.indptr).astype(np.float64)
+    dangling = out_degree == 0
+    inverse = np.divide(1.0, out_degree, out=np.zeros(nodes), where=~dangling)
+    rank = np.full(nodes, 1.0 / nodes)
+    for _ in range(iterations):
+        spread = (1.0 - damping + damping * rank[dangling].sum()) / nodes
+        new_rank = np.bincount(targets, weights=(rank * inverse)[sources], minlength=nodes)
+        new_rank = damping * new_rank + spread
+        change = np.abs(new_rank - rank).sum()
+        rank = new_rank
+        if change < tolerance:
+            break
+    return rank
+
+
+def hosts(graph):
+    ''' (host names, host id of every node), for canonical urls. '''
+    ids = dict()
+    host_ids = np.fromiter(
+        (ids.setdefault(url.partition("://")[2].partition("/")[0], len(ids)) for url in graph.urls),
+        dtype=np.int64, count=graph.nodes)
+    return list(ids), host_ids
+
+
+def host_edges(graph, host_ids=None):
+    '''
+    (source host id, target host id, links) of every pair of hosts with
+    links between them, most links first.
+    '''
+    if host_ids is None:
+        host_ids = hosts(graph)[1]
+    count = int(host_ids.max()) + 1 if len(host_ids) else 0
+    pairs, links = sorted_unique(
+        host_ids[graph.sources()].astype(np.int64) * count + host_ids[graph.indices])
+    order = np.argsort(-links, kind="stable")
+    return pairs[order] // max(count, 1), pairs[order] % max(count, 1), links[order]
+
+
+def strongly_connected(graph):
+    '''
+    Component id of every node. Nodes with no links in or no links out
+    (most urls not downloaded yet) are their own component; they are
+    trimmed with numpy first, and Tarjan's algorithm runs on what is left.
+    '''
+    nodes = graph.nodes
+    sources = graph.sources()
+    targets = graph.indices
+    alive = np.ones(nodes, dtype=bool)
+    for _ in range(TRIM_ROUNDS):
+        live = alive[sources] & alive[targets]
+        trimmed = alive & (np.bincount(sources[live], minlength=nodes) > 0) & (
+            np.bincount(targets[live], minlength=nodes) > 0)
+        if (trimmed == alive).all():
+            break
+        alive = trimmed
+    labels = np.arange(nodes, dtype=np.int64)
+    core = np.flatnonzero(alive)
+    if len(core):
+        components = _tarjan(graph.indptr.tolist(), targets.tolist(), alive.tolist(), core.tolist())
+        labels[core] = nodes + np.asarray(components)[core]
+    # Renumber from 0
+    used = np.zeros(2 * nodes, dtype=bool)
+    used[labels] = True
+    return (np.cumsum(used) - 1)[labels]
+
+
+def _tarjan(indptr, indices, alive, roots):
+    ''' Iterative Tarjan over the alive nodes; the component of every node (-1 if not alive). '''
+    index = [-1] * len(alive)
+    low = [0] * len(alive)
+    on_stack = [False] * len(alive)
+    stack = list()
+    component = [-1] * len(alive)
+    counter = 0
+    components = 0
+    for root in roots:
+        if index[root] != -1:
+            continue
+        index[root] = low[root] = counter
+        counter += 1
+        stack.append(root)
+        on_stack[root] = True
+        work = [(root, indptr[root])]
+        while work:
+            node, position = work[-1]
+            end = indptr[node + 1]
+            while position < end:
+                target = indices[position]
+                position += 1
+                if not alive[target]:
+                    continue
+                if index[target] == -1:
+                    work[-1] = (node, position)
+                    index[target] = low[target] = counter
+                    counter += 1
+                    stack.append(target)
+                    on_stack[target] = True
+                    work.append((target, indptr[target]))
+                    break
+                if on_stack[target] and index[target] < low[node]:
+                    low[node] = index[target]
+            else:
+                work.pop()
+                if low[node] == index[node]:
+                    while True:
+                        member = stack.pop()
+                        on_stack[member] = False
+                        component[member] = components
+                        if member == node:
+                            break
+                    components += 1
+                if work:
+                    parent = work[-1][0]
+                    if low[node] < low[parent]:
+                        low[parent] = low[node]
+    return component
+
+
+def trap_regions(graph, labels, min_size=50, closed=0.5, max_entry=0.1):
+    '''
+    Strongly connected components that look like crawler traps: at least
+    min_size pages, at least closed of their links staying inside, and at
+    most max_entry links in from outside per page, like a calendar that
+    links to itself. Returns (component ids, sizes), largest first.
+    '''
+    sources = graph.sources()
+    source_labels = labels[sources]
+    target_labels = labels[graph.indices]
+    inside = source_labels == target_labels
+    count = int(labels.max()) + 1 if len(labels) else 0
+    sizes = np.bincount(labels, minlength=count)
+    links_out = np.bincount(source_labels, minlength=count)
+    links_inside = np.bincount(source_labels[inside], minlength=count)
+    links_in = np.bincount(target_labels[~inside], minlength=count)
+    traps = np.flatnonzero(
+        (sizes >= min_size)
+        & (links_inside >= closed * np.maximum(links_out, 1))
+        & (links_in <= max_entry * sizes))
+    order = np.argsort(-sizes[traps], kind="stable")
+    return traps[order], sizes[traps][order]
+
+
+def save_scores(filename, graph, rank, trap_nodes):
+    '''
+    Writes what GraphScorer needs, sorted by get_urlkey: the keys, the
+    PageRank of each url times the number of urls (1 is average) and
+    whether it is in a trap region.
+    '''
+    keys = np.array([get_urlkey(url) for url in graph.urls], dtype="S16")
+    order = np.argsort(keys, kind="stable")
+    tmpname = f"{filename}.tmp.npz"
+    np.savez(tmpname, keys=keys[order],
+             rank=(rank * graph.nodes).astype(np.float32)[order], trap=trap_nodes[order])
+    os.replace(tmpname, filename)
+
+
+def load_scores(filename):
+    ''' (keys, rank, trap) written by save_scores. '''
+    with np.load(filename) as scores:
+        return scores["keys"], scores["rank"], scores["trap"]
+
+
+def analyze(filenames, csr_file, scores_file, top=20):
+    timings = dict()
+    started = time.perf_counter()
+    graph = load_graph(filenames)
+    graph.save(csr_file)
+    timings["csr"] = time.perf_counter() - started
+    started = time.perf_counter()
+    rank = pagerank(graph)
+    timings["pagerank"] = time.perf_counter() - started
+    started = time.perf_counter()
+    degree = in_degree(graph)
+    timings["in_degree"] = time.perf_counter() - started
+    started = time.perf_counter()
+    host_names, host_ids = hosts(graph)
+    host_sources, host_targets, host_links = host_edges(graph, host_ids)
+    timings["host_edges"] = time.perf_counter() - started
+    started = time.perf_counter()
+    labels = strongly_connected(graph)
+    traps, trap_sizes = trap_regions(graph, labels)
+    timings["scc"] = time.perf_counter() - started
+    trap_nodes = np.zeros(int(labels.max()) + 1 if len(labels) else 0, dtype=bool)
+    trap_nodes[traps] = True
+    trap_nodes = trap_nodes[labels]
+    save_scores(scores_file, graph, rank, trap_nodes)
+    best = np.argsort(-rank, kind="stable")[:top]
+    linked = np.argsort(-degree, kind="stable")[:top]
+    cross = host_sources != host_targets
+    return {
+        "nodes": graph.nodes,
+        "edges": graph.edges,
+        "seconds": {name: round(seconds, 3) for name, seconds in timings.items()},
+        "pagerank": [(graph.urls[node], float(rank[node])) for node in best],
+        "in_degree": [(graph.urls[node], int(degree[node])) for node in linked],
+        "host_edges": [
+            (str(host_names[source]), str(host_names[target]), int(links))
+            for source, target, links in zip(
+                host_sources[cross][:top], host_targets[cross][:top], host_links[cross][:top])],
+        "components": int(labels.max()) + 1 if len(labels) else 0,
+        "trap_regions": [
+            {"size": int(size),
+             "hosts": sorted(set(str(host_names[host_ids[node]])
+                                 for node in np.flatnonzero(labels == trap)[:1000])),
+             "example": graph.urls[int(np.flatnonzero(labels == trap)[0])]}
+            for trap, size in zip(traps[:top], trap_sizes[:top])],
+        "trap_urls": int(trap_nodes.sum()),
+    }
+
+
+def print_analysis(result):
+    print(f"{result['nodes']} urls, {result['edges']} links, "
+          f"{result['components']} strongly connected components.")
+    print("Seconds: " + ", ".join(f"{name} {seconds}" for name, seconds in result["seconds"].items()))
+    print("\nPageRank:")
+    for url, rank in result["pagerank"]:
+        print(f"  {rank:.6f}  {url}")
+    print("\nIn-degree:")
+    for url, degree in result["in_degree"]:
+        print(f"  {degree:8}  {url}")
+    print("\nLinks between hosts:")
+    for source, target, links in result["host_edges"]:
+        print(f"  {links:8}  {source} -> {target}")
+    print(f"\nPossible trap regions ({result['trap_urls']} urls):")
+    for region in result["trap_regions"]:
+        print(f"  {region['size']:8}  {', '.join(region['hosts'])}  e.g. {region['example']}")
+
+
+def main():
+    parser = ArgumentParser(description="Statistics of the link graph of a crawl.")
+    parser.add_argument("--config_file", type=str, default="config.ini")
+    parser.add_argument("--graph", nargs="+", default=None,
+        help="LinkGraph files to merge (default: LINKGRAPH of the config file)")
+    parser.add_argument("--csr", type=str, default=None, help="default: GRAPH.csr")
+    parser.add_argument("--scores", type=str, default=None, help="default: GRAPH.scores.npz")
+    parser.add_argument("--top", type=int, default=20)
+    parser.add_argument("--json", action="store_true", default=False)
+    args = parser.parse_args()
+    filenames = args.graph
+    if not filenames:
+        from utils.config import Config
+        cparser = ConfigParser()
+        cparser.read(args.config_file)
+        with redirect_stdout(sys.stderr): # Config prints the user agent
+            filenames = [Config(cparser).link_graph]
+        if not filenames[0]:
+            parser.error(f"LINKGRAPH is not set in {args.config_file}")
+    for filename in filenames:
+        if not os.path.exists(filename + ".urls"):
+            parser.error(f"{filename}.urls does not exist")
+    result = analyze(
+        filenames, args.csr or f"{filenames[0]}.csr",
+        args.scores or f"{filenames[0]}.scores.npz", args.top)
+    if args.json:
+        print(json.dumps(result, indent=2))
+    else:
+        print_analysis(result)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,79 @@
+import re
+import json
+
+DECODER = json.JSONDecoder()
+WHITESPACE = " \t\n\r"
+# What ends a number, true, false or null
+SCALAR_END = re.compile(r"[,}\]:\s]")
+
+
+def iter_items(fileobj, chunk_size=1 << 16):
+    '''
+    Yields the (key, value) pairs of a JSON object of scalar values, like
+    explored.json or wordtotals.json, reading fileobj chunk_size characters
+    at a time instead of loading the whole object. Raises ValueError if the
+    file is not such an object or ends early.
+    '''
+    buffer = ""
+    position = 0
+    eof = False
+
+    def fill():
+        nonlocal buffer, position, eof
+        chunk = fileobj.read(chunk_size)
+        if not chunk:
+            eof = True
+        buffer = buffer[position:] + chunk
+        position = 0
+
+    def skip(characters):
+        ''' Skips whitespace and at most one of characters; returns it or "". '''
+        nonlocal position
+        found = ""
+        while True:
+            while position < len(buffer) and buffer[position] in WHITESPACE:
+                position += 1
+            if position < len(buffer):
+                if not found and buffer[position] in characters:
+                    found = buffer[position]
+                    position += 1
+                    continue
+                return found
+            if eof:
+                return found
+            fill()
+
+    def decode():
+        ''' Decodes the next value, reading more until all of it is in the buffer. '''
+        nonlocal position
+        while True:
+            # A number or literal may go on in the next chunk until something ends it
+            if (not eof and position < len(buffer) and buffer[position] != '"'
+                    and not SCALAR_END.search(buffer, position)):
+                fill()
+                continue
+            try:
+                value, end = DECODER.raw_decode(buffer, position)
+            except json.JSONDecodeError:
+                if eof:
+                    raise ValueError(f"Truncated or invalid JSON at character {position}.")
+                fill()
+                continue
+            position = end
+            return value
+
+    if skip("{") != "{":
+        raise ValueError("Not a JSON object.")
+    if skip("}") == "}":
+        return
+    while True:
+        key = decode()
+        if skip(":") != ":":
+            raise ValueError(f"Expected ':' after {key!r}.")
+        skip("")
+        yield key, decode()
+        separator = skip(",}")
+        if separator == "}":
+            return
+        if separator != ",":
+            raise ValueError(f"Expected ',' or '}}' after the value of {key!r}.")
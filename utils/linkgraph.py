@@ -0,0 +1,108 @@
+'''
+Records the links between the pages of a crawl, which the frontier would
+otherwise forget once it has queued them.
+
+LINKGRAPH.urls holds one url per line; the url on line i has id i.
+LINKGRAPH.edges holds one (source id, target id) pair of little-endian
+uint32 per link. Both are append-only, and urls are written before the
+edges that use them. utils/graphstats.py turns them into a CSR file and
+computes PageRank and the other statistics.
+'''
+import os
+import sys
+from array import array
+from threading import Lock
+
+from utils import get_urlkey
+
+# Links buffered before they are appended to the files
+EDGE_BATCH = 65536
+
+
+class LinkGraph(object):
+    '''
+    Interns urls to integer ids (keyed by get_urlkey, so the urls themselves
+    are not kept in memory) and buffers the links as two arrays of ids.
+    Appends to the files of an earlier run, like explored.json.
+    '''
+    def __init__(self, filename):
+        self.urls_filename = filename + ".urls"
+        self.edges_filename = filename + ".edges"
+        self.lock = Lock()
+        self.ids = dict()
+        self._recover()
+        self.urls_file = open(self.urls_filename, "a", encoding="utf-8", newline="\n")
+        self.edges_file = open(self.edges_filename, "ab")
+        self.new_urls = list()
+        self.sources = array("I")
+        self.targets = array("I")
+        self.edges = os.path.getsize(self.edges_filename) // 8
+
+    def _recover(self):
+        ''' Reads the url ids back and cuts off a torn last url or edge. '''
+        if not os.path.exists(self.urls_filename):
+            return
+        ids = self.ids
+        with open(self.urls_filename, "r+b") as urls:
+            end = 0
+            for line in urls:
+                if not line.endswith(b"\n"):
+                    break
+                ids[get_urlkey(line[:-1].decode("utf-8"))] = len(ids)
+                end += len(line)
+            urls.truncate(end)
+        if os.path.exists(self.edges_filename):
+            size = os.path.getsize(self.edges_filename)
+            with open(self.edges_filename, "r+b") as edges:
+                edges.truncate(size - size % 8)
+
+    def intern(self, url):
+        ''' The id of url, given a new one the first time url is seen. '''
+        key = get_urlkey(url)
+        url_id = self.ids.get(key)
+        if url_id is None:
+            url_id = self.ids[key] = len(self.ids)
+            self.new_urls.append(url)
+        return url_id
+
+    def add_links(self, source, targets):
+        ''' Records the links from the canonical url source to the canonical urls targets. '''
+        with self.lock:
+            source_id = self.intern(source)
+            for target in targets:
+                self.sources.append(source_id)
+                self.targets.append(self.intern(target))
+            if len(self.sources) >= EDGE_BATCH:
+                self._flush()
+
+    def __len__(self):
+        ''' Number of links recorded. '''
+        return self.edges + len(self.sources)
+
+    def flush(self):
+        with self.lock:
+            self._flush()
+
+    def _flush(self):
+        if self.new_urls:
+            self.urls_file.write("".join(f"{url}\n" for url in self.new_urls))
+            self.urls_file.flush()
+            self.new_urls = list()
+        if self.sources:
+            pairs = array("I", bytes(8 * len(self.sources)))
+            pairs[0::2] = self.sources
+            pairs[1::2] = self.targets
+            if sys.byteorder == "big":
+                pairs.byteswap()
+            self.edges_file.write(pairs.tobytes())
+            self.edges_file.flush()
+            self.edges += len(self.sources)
+            self.sources = array("I")
+            self.targets = array("I")
+
+    def close(self):
+        if self.urls_file.closed:
+            return
+        self.flush()
+        self.urls_file.close()
+        self.edges_file.close()
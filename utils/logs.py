@@ -0,0 +1,243 @@
+'''
+Logging that never makes the crawler wait on a disk or a terminal.
+
+Every logger from get_logger has one LogQueueHandler, installed the first
+time the logger is asked for. It only puts the record on an in-memory
+queue (dropping it if QUEUE_SIZE records are already waiting), and a single
+LogListener thread formats the records and writes them out:
+
+- to Logs/<filename>.log, in batches of up to LOGBATCH records, at least
+  every LOGFLUSH seconds;
+- to the console, at most LOGCONSOLERATE info lines a second (warnings and
+  errors always), with a note of how many lines it left out;
+- fetch events (see fetch_event) to FETCHLOG as JSON lines, if it is set.
+'''
+import os
+import sys
+import json
+import time
+import atexit
+import logging
+from logging.handlers import QueueHandler
+from queue import Queue, Empty, Full
+from threading import Thread, Lock
+
+LOG_DIR = "Logs"
+# Records waiting for the listener; more are dropped
+QUEUE_SIZE = 100000
+FORMAT = "%(asctime)s - %(name)s - %(levelname)s - %(message)s"
+
+
+class LogQueueHandler(QueueHandler):
+    '''
+    Hands records to the listener of this process without waiting. The
+    message and traceback are rendered here, as their arguments may change
+    before the listener gets to them; the rest of the formatting is left
+    to the listener.
+    '''
+    def __init__(self, filename):
+        super().__init__(None)
+        self.filename = filename
+
+    def prepare(self, record):
+        record.msg = record.getMessage()
+        record.args = None
+        if record.exc_info:
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+            record.exc_info = None
+        record.log_file = self.filename
+        return record
+
+    def enqueue(self, record):
+        get_listener().put(record)
+
+
+class LogListener(Thread):
+    ''' The thread that writes out the records and fetch events of every logger. '''
+    def __init__(self):
+        super().__init__(name="LogListener", daemon=True)
+        self.pid = os.getpid()
+        self.queue = Queue(QUEUE_SIZE)
+        self.formatter = logging.Formatter(FORMAT)
+        self.batch = 1000
+        self.flush_interval = 1.0
+        self.console_rate = 20.0
+        self.fetch_log = None
+        # filename -> open file, and the lines not written to it yet
+        self.files = dict()
+        self.buffers = dict()
+        self.buffered = 0
+        self.last_flush = time.monotonic()
+        # Console rate limit: a bucket of up to console_rate lines
+        self.tokens = self.console_rate
+        self.last_refill = time.monotonic()
+        self.hidden = 0
+        self.dropped = 0
+        self.reported_dropped = 0
+        self.last_notice = 0.0
+
+    def configure(self, config):
+        self.batch = max(config.log_batch, 1)
+        self.flush_interval = config.log_flush
+        self.console_rate = config.log_console_rate
+        self.fetch_log = config.fetch_log or None
+
+    def put(self, item):
+        try:
+            self.queue.put_nowait(item)
+        except Full:
+            self.dropped += 1
+
+    def stop(self):
+        ''' Writes out everything queued so far and closes the files. '''
+        self.queue.put(None)
+        self.join()
+
+    def run(self):
+        running = True
+        while running:
+            items = list()
+            try:
+                items.append(self.queue.get(timeout=self.flush_interval))
+                while len(items) < self.batch:
+                    items.append(self.queue.get_nowait())
+            except Empty:
+                pass
+            console = list()
+            for item in items:
+                if item is None:
+                    running = False
+                elif isinstance(item, dict):
+                    if self.fetch_log:
+                        self._buffer(self.fetch_log, json.dumps(item))
+                else:
+                    line = self.formatter.format(item)
+                    self._buffer(item.log_file, line)
+                    if item.levelno >= logging.INFO and self._show(item):
+                        console.append(line)
+            self._notice(console, force=not running)
+            if console:
+                try:
+                    sys.stderr.write("\n".join(console) + "\n")
+                    sys.stderr.flush()
+                except (OSError, ValueError):
+                    pass
+            if (not running or self.buffered >= self.batch
+                    or time.monotonic() - self.last_flush >= self.flush_interval):
+                self.flush()
+        for logfile in self.files.values():
+            logfile.close()
+        self.files = dict()
+
+    def _buffer(self, filename, line):
+        self.buffers.setdefault(filename, list()).append(line)
+        self.buffered += 1
+
+    def _show(self, record):
+        ''' Whether record goes to the console, under the rate limit. '''
+        if record.levelno >= logging.WARNING or self.console_rate <= 0:
+            return True
+        now = time.monotonic()
+        self.tokens = min(self.tokens + (now - self.last_refill) * self.console_rate,
+                          self.console_rate)
+        self.last_refill = now
+        if self.tokens >= 1:
+            self.tokens -= 1
+            return True
+        self.hidden += 1
+        return False
+
+    def _notice(self, console, force=False):
+        ''' At most once a second (and when stopping), says how many lines were left out or dropped. '''
+        dropped = self.dropped - self.reported_dropped
+        now = time.monotonic()
+        if not (self.hidden or dropped) or (now - self.last_notice < 1.0 and not force):
+            return
+        parts = list()
+        if self.hidden:
+            parts.append(f"{self.hidden} log lines not shown on the console (see {LOG_DIR}/)")
+        if dropped:
+            parts.append(f"{dropped} log records dropped, the log queue was full")
+        console.append(f"... {'; '.join(parts)}.")
+        self.hidden = 0
+        self.reported_dropped += dropped
+        self.last_notice = now
+
+    def flush(self):
+        for filename, lines in self.buffers.items():
+            if not lines:
+                continue
+            try:
+                logfile = self.files.get(filename)
+                if logfile is None:
+                    logfile = self.files[filename] = open(filename, "a", encoding="utf-8")
+                logfile.write("\n".join(lines) + "\n")
+                logfile.flush()
+            except OSError:
+                pass
+        self.buffers = dict()
+        self.buffered = 0
+        self.last_flush = time.monotonic()
+
+
+# The LogListener of this process, started by the first get_logger
+listener = None
+listener_lock = Lock()
+# The config given to setup, applied to every new listener
+settings = None
+
+
+def get_listener():
+    ''' The running LogListener of this process; a forked process starts its own. '''
+    global listener
+    current = listener
+    if current is not None and current.pid == os.getpid():
+        return current
+    with listener_lock:
+        if listener is None or listener.pid != os.getpid():
+            listener = LogListener()
+            if settings is not None:
+                listener.configure(settings)
+            listener.start()
+        return listener
+
+
+def get_logger(name, filename=None):
+    '''
+    The logger name, writing to Logs/<filename or name>.log and the console
+    through the listener. Its handler is installed only once.
+    '''
+    logger = logging.getLogger(name)
+    if not any(isinstance(handler, LogQueueHandler) for handler in logger.handlers):
+        if not os.path.exists(LOG_DIR):
+            os.makedirs(LOG_DIR, exist_ok=True)
+        logger.setLevel(logging.INFO)
+        logger.propagate = False
+        logger.addHandler(LogQueueHandler(os.path.join(LOG_DIR, f"{filename if filename else name}.log")))
+    return logger
+
+
+def setup(config):
+    ''' Applies the LOG* and FETCHLOG settings of config. '''
+    global settings
+    settings = config
+    get_listener().configure(config)
+
+
+def fetch_event(event):
+    ''' Queues event, a dict describing one download, for FETCHLOG if it is set. '''
+    current = listener
+    if current is not None and current.fetch_log:
+        current.put(event)
+
+
+def shutdown():
+    ''' Writes out everything logged so far. The next get_logger record starts a new listener. '''
+    global listener
+    with listener_lock:
+        current, listener = listener, None
+    if current is not None and current.pid == os.getpid():
+        current.stop()
+
+
+atexit.register(shutdown)
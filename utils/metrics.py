@@ -0,0 +1,270 @@
+'''
+Counters, gauges and histograms for the hot paths of the crawler, readable
+while it runs.
+
+    from utils import metrics
+    metrics.inc("fetch_retries")
+    metrics.inc(metrics.series("pages", result="duplicate"))
+    with metrics.timer("parse_seconds"):
+        ...
+
+Counters and histograms are accumulated per thread without locks and are
+only added up when a snapshot is taken. Gauges are set directly or computed
+by a function at snapshot time (register_gauge). With METRICSPORT set,
+launch.py serves the snapshot at http://127.0.0.1:<port>/metrics (Prometheus
+text format) and /metrics.json, and it is written to METRICSFILE every
+METRICSINTERVAL seconds either way.
+'''
+import time
+import json
+from bisect import bisect_left
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from threading import Thread, Lock, Event, local
+
+from utils import get_logger, write_json_atomic
+
+# Upper bounds in seconds of the histogram buckets: 1us to about 2 minutes,
+# doubling. Values above the last one go in an overflow bucket.
+BUCKETS = tuple(1e-6 * 2 ** i for i in range(28))
+
+
+def series(name, **labels):
+    ''' Name of one labeled series, e.g. pages{result="duplicate"}. '''
+    if not labels:
+        return name
+    return name + "{" + ",".join(f'{key}="{value}"' for key, value in sorted(labels.items())) + "}"
+
+
+class Timer(object):
+    __slots__ = ("metrics", "name", "start")
+
+    def __init__(self, metrics, name):
+        self.metrics = metrics
+        self.name = name
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.metrics.observe(self.name, time.perf_counter() - self.start)
+
+
+class Metrics(object):
+    '''
+    The registry. Each thread has its own shard ({counter: value},
+    {histogram: bucket counts + [sum]}) that only it writes to; snapshot
+    copies and adds up the shards of every thread that ever recorded
+    something. Counters and histograms only grow, so nothing has to be reset
+    and a snapshot never waits for a writer.
+    '''
+    def __init__(self):
+        self.started = time.time()
+        self._local = local()
+        self._lock = Lock()
+        self._shards = list()
+        self._gauges = dict()
+        self._gauge_functions = dict()
+
+    def _shard(self):
+        shard = getattr(self._local, "shard", None)
+        if shard is None:
+            shard = self._local.shard = (dict(), dict())
+            with self._lock:
+                self._shards.append(shard)
+        return shard
+
+    def inc(self, name, value=1):
+        counters = self._shard()[0]
+        counters[name] = counters.get(name, 0) + value
+
+    def observe(self, name, value):
+        ''' Adds value (in seconds, for the default buckets) to histogram name. '''
+        histograms = self._shard()[1]
+        histogram = histograms.get(name)
+        if histogram is None:
+            histogram = histograms[name] = [0] * (len(BUCKETS) + 2)
+        histogram[bisect_left(BUCKETS, value)] += 1
+        histogram[-1] += value
+
+    def timer(self, name):
+        ''' Context manager that observes its duration in histogram name. '''
+        return Timer(self, name)
+
+    def gauge(self, name, value):
+        self._gauges[name] = value
+
+    def register_gauge(self, name, function, label=None):
+        '''
+        Gauge computed by function() at snapshot time. With label, function
+        returns {label value: value} and each item is its own series.
+        '''
+        self._gauge_functions[name] = (function, label)
+
+    def unregister_gauge(self, name):
+        self._gauge_functions.pop(name, None)
+
+    def counter(self, name):
+        ''' Current total of counter name over all threads. '''
+        with self._lock:
+            shards = list(self._shards)
+        return sum(counters.get(name, 0) for counters, _ in shards)
+
+    def snapshot(self):
+        ''' Every metric added up over all threads, as a JSON-friendly dict. '''
+        with self._lock:
+            shards = list(self._shards)
+        counters = dict()
+        histograms = dict()
+        for shard_counters, shard_histograms in shards:
+            for name, value in list(shard_counters.items()):
+                counters[name] = counters.get(name, 0) + value
+            for name, histogram in list(shard_histograms.items()):
+                histogram = list(histogram)
+                total = histograms.get(name)
+                if total is None:
+                    histograms[name] = histogram
+                else:
+                    for index, value in enumerate(histogram):
+                        total[index] += value
+        gauges = dict(self._gauges)
+        for name, (function, label) in list(self._gauge_functions.items()):
+            try:
+                value = function()
+            except Exception: # a gauge must never break the snapshot
+                continue
+            if label is None:
+                gauges[name] = value
+            else:
+                for key, item in value.items():
+                    gauges[series(name, **{label: key})] = item
+        return {
+            "time": time.time(),
+            "uptime_seconds": round(time.time() - self.started, 3),
+            "counters": dict(sorted(counters.items())),
+            "gauges": dict(sorted(gauges.items())),
+            "histograms": {
+                name: summarize(histograms[name]) for name in sorted(histograms)},
+        }
+
+
+def summarize(histogram):
+    ''' count, sum, mean and p50/p90/p99 (bucket upper bounds) of a histogram. '''
+    buckets = histogram[:-1]
+    count = sum(buckets)
+    result = {"count": count, "sum": round(histogram[-1], 6),
+              "mean": round(histogram[-1] / count, 6) if count else 0.0}
+    for name, fraction in (("p50", 0.5), ("p90", 0.9), ("p99", 0.99)):
+        if not count:
+            result[name] = 0.0
+            continue
+        rank = fraction * count
+        seen = 0
+        for index, value in enumerate(buckets):
+            seen += value
+            if seen >= rank and value:
+                break
+        result[name] = BUCKETS[index] if index < len(BUCKETS) else float("inf")
+    result["buckets"] = {
+        (str(BUCKETS[index]) if index < len(BUCKETS) else "+Inf"): value
+        for index, value in enumerate(buckets) if value}
+    return result
+
+
+def prometheus_text(snapshot):
+    ''' snapshot in the Prometheus text exposition format. '''
+    lines = list()
+    for name, value in snapshot["counters"].items():
+        lines.append(f"crawler_{name} {value}")
+    for name, value in snapshot["gauges"].items():
+        lines.append(f"crawler_{name} {value}")
+    for name, histogram in snapshot["histograms"].items():
+        base, _, labels = name.partition("{")
+        labels = labels.rstrip("}")
+        prefix = labels + "," if labels else ""
+        cumulative = 0
+        for bound in BUCKETS:
+            cumulative += histogram["buckets"].get(str(bound), 0)
+            lines.append(f'crawler_{base}_bucket{{{prefix}le="{bound:g}"}} {cumulative}')
+        lines.append(f'crawler_{base}_bucket{{{prefix}le="+Inf"}} {histogram["count"]}')
+        suffix = "{" + labels + "}" if labels else ""
+        lines.append(f"crawler_{base}_sum{suffix} {histogram['sum']}")
+        lines.append(f"crawler_{base}_count{suffix} {histogram['count']}")
+    return "\n".join(lines) + "\n"
+
+
+class MetricsReporter(object):
+    '''
+    Writes the snapshot of metrics to filename every interval seconds and,
+    if port is not 0, serves it over HTTP on 127.0.0.1:port.
+    '''
+    def __init__(self, metrics, filename=None, interval=10.0, port=0):
+        self.metrics = metrics
+        self.filename = filename
+        self.interval = interval
+        self.logger = get_logger("METRICS")
+        self.stopped = Event()
+        self.httpd = None
+        if port:
+            self.httpd = ThreadingHTTPServer(("127.0.0.1", port), self._handler())
+            self.httpd.daemon_threads = True
+            Thread(target=self.httpd.serve_forever, daemon=True).start()
+            self.logger.info(f"Metrics on http://127.0.0.1:{port}/metrics")
+        self.writer = Thread(target=self._write_every_interval, daemon=True)
+        self.writer.start()
+
+    def _handler(self):
+        reporter = self
+        class MetricsHandler(BaseHTTPRequestHandler):
+            def log_message(self, *args):
+                pass
+            def do_GET(self):
+                snapshot = reporter.metrics.snapshot()
+                if self.path.startswith("/metrics.json"):
+                    body, content_type = json.dumps(snapshot).encode("utf-8"), "application/json"
+                elif self.path.startswith("/metrics"):
+                    body, content_type = prometheus_text(snapshot).encode("utf-8"), "text/plain"
+                else:
+                    self.send_error(404)
+                    return
+                self.send_response(200)
+                self.send_header("Content-Type", content_type)
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+        return MetricsHandler
+
+    def _write_every_interval(self):
+        while not self.stopped.wait(self.interval):
+            self.write()
+
+    def write(self):
+        if self.filename:
+            write_json_atomic(self.filename, self.metrics.snapshot())
+
+    def stop(self):
+        ''' Stops serving and writes the final snapshot. '''
+        self.stopped.set()
+        self.writer.join()
+        if self.httpd is not None:
+            self.httpd.shutdown()
+            self.httpd.server_close()
+        self.write()
+
+
+# The registry used by the whole crawler
+registry = Metrics()
+inc = registry.inc
+observe = registry.observe
+timer = registry.timer
+gauge = registry.gauge
+register_gauge = registry.register_gauge
+unregister_gauge = registry.unregister_gauge
+counter = registry.counter
+snapshot = registry.snapshot
+
+
+def start(config):
+    ''' Starts reporting registry as configured (METRICS* in config.ini). '''
+    return MetricsReporter(
+        registry, config.metrics_file, config.metrics_interval, config.metrics_port)
@@ -0,0 +1,99 @@
+from lxml import etree, html
+from bs4 import BeautifulSoup
+from tokenizewords import tokenize_string
+from utils import metrics
+
+# Same strings as BeautifulSoup's get_text: no script/style/template contents or comments
+TEXT_XPATH = etree.XPath(
+    "//text()[not(ancestor::script) and not(ancestor::style) and not(ancestor::template)]",
+    smart_strings=False)
+HREF_XPATH = etree.XPath("//a/@href", smart_strings=False)
+BASE_XPATH = etree.XPath("//base/@href", smart_strings=False)
+
+
+class ParsedPage(object):
+    '''
+    The content of one downloaded page, parsed at most once.
+
+    The lxml tree is built on first use and text, tokens and links are
+    computed from it lazily, so is_valid_current and extract_next_links
+    share one parse. Pages lxml cannot parse fall back to BeautifulSoup.
+    '''
+    def __init__(self, content):
+        self.content = content
+        self._tree = None
+        self._parsed = False
+        self._soup = None
+        self._text = None
+        self._tokens = None
+        self._links = None
+        self._base = False
+
+    @property
+    def tree(self):
+        ''' lxml tree of the page, or None if lxml could not parse it. '''
+        if not self._parsed:
+            self._parsed = True
+            try:
+                with metrics.timer("parse_seconds"):
+                    self._tree = html.fromstring(self.content)
+            except (etree.ParserError, ValueError, TypeError): # empty or not html
+                self._tree = None
+        return self._tree
+
+    @property
+    def soup(self):
+        if self._soup is None:
+            self._soup = BeautifulSoup(self.content or b"", 'lxml')
+        return self._soup
+
+    @property
+    def text(self):
+        ''' All visible text of the page, strings separated by spaces. '''
+        if self._text is None:
+            if self.tree is not None:
+                strings = (string.strip() for string in TEXT_XPATH(self.tree))
+                self._text = " ".join(string for string in strings if string)
+            else:
+                self._text = self.soup.get_text(" ", strip=True)
+        return self._text
+
+    @property
+    def tokens(self):
+        if self._tokens is None:
+            text = self.text
+            with metrics.timer("tokenize_seconds"):
+                self._tokens = tokenize_string(text)
+        return self._tokens
+
+    @property
+    def links(self):
+        ''' Every href of an <a> tag, as written in the page. '''
+        if self._links is None:
+            if self.tree is not None:
+                self._links = HREF_XPATH(self.tree)
+            else:
+                self._links = [link['href'] for link in self.soup.find_all('a', href=True)]
+        return self._links
+
+    @property
+    def base_href(self):
+        ''' The href of the page's first <base> tag, or None. '''
+        if self._base is False:
+            if self.tree is not None:
+                hrefs = BASE_XPATH(self.tree)
+                self._base = hrefs[0] if hrefs else None
+            else:
+                base = self.soup.find('base', href=True)
+                self._base = base['href'] if base is not None else None
+        return self._base
+
+
+def get_page(resp):
+    '''
+    Returns the ParsedPage of a Response, parsing it the first time it is
+    asked for and keeping it on resp.page for the next caller.
+    '''
+    if resp.page is None:
+        resp.page = ParsedPage(resp.raw_response.content)
+    return resp.page
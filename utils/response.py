@@ -12,3 +12,5 @@ class Response(object):
                 None)
         except TypeError:
             self.raw_response = None
+        # utils.page.ParsedPage of raw_response.content, set by get_page
+        self.page = None
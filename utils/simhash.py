@@ -0,0 +1,131 @@
+import os
+import time
+from array import array
+from hashlib import blake2b
+from threading import RLock
+
+from utils import metrics
+
+FINGERPRINT_BITS = 64
+LANES = (1 << FINGERPRINT_BITS) - 1
+FLUSH_SERIES = metrics.series("flush_seconds", file="simhash")
+
+
+def shingle_hash(shingle):
+    return int.from_bytes(blake2b(shingle.encode("utf-8"), digest_size=8).digest(), "big")
+
+
+def simhash(tokens, shingle_size=3):
+    '''
+    64-bit SimHash of a token list: each shingle of shingle_size lowercased
+    tokens is hashed, and bit i of the result is set when more than half of
+    the shingle hashes have bit i set. Pages with mostly the same shingles
+    get fingerprints that differ in only a few bits.
+
+    The per-bit counts are kept bit-sliced: planes[j] holds bit j of all 64
+    counters, so adding a hash is a few big-int operations instead of a
+    Python loop over 64 bits.
+    '''
+    tokens = [token.lower() for token in tokens]
+    count = max(len(tokens) - shingle_size + 1, 1)
+    planes = []
+    for i in range(count):
+        carry = shingle_hash(" ".join(tokens[i:i + shingle_size]))
+        for j in range(len(planes)):
+            planes[j], carry = planes[j] ^ carry, planes[j] & carry
+            if not carry:
+                break
+        if carry:
+            planes.append(carry)
+    fingerprint = 0
+    for bit in range(FINGERPRINT_BITS):
+        ones = sum(((plane >> bit) & 1) << j for j, plane in enumerate(planes))
+        if ones * 2 > count:
+            fingerprint |= 1 << bit
+    return fingerprint
+
+
+def hamming_distance(a, b):
+    return bin(a ^ b).count("1")
+
+
+class SimHashIndex(object):
+    '''
+    Set of SimHash fingerprints that answers "is there a stored fingerprint
+    within max_distance bits of this one?" without scanning all of them.
+
+    The 64 bits are split into max_distance + 1 blocks, with one table per
+    block keyed by that block's value. Two fingerprints at most max_distance
+    bits apart agree on at least one whole block, so only the fingerprints
+    sharing a block with the query are compared.
+
+    Fingerprints are persisted as raw 8-byte integers appended to filename
+    at most every flush_interval seconds.
+    '''
+    def __init__(self, filename, max_distance=3, flush_interval=5.0):
+        self.filename = filename
+        self.max_distance = max_distance
+        self.flush_interval = flush_interval
+        blocks = max_distance + 1
+        edges = [FINGERPRINT_BITS * i // blocks for i in range(blocks + 1)]
+        # (shift, mask) of each block
+        self.blocks = [
+            (edges[i], (1 << (edges[i + 1] - edges[i])) - 1) for i in range(blocks)]
+        self.tables = [dict() for _ in self.blocks]
+        self.count = 0
+        self._lock = RLock()
+        self._pending = array("Q")
+        self._last_flush = time.monotonic()
+        if os.path.exists(filename):
+            stored = array("Q")
+            with open(filename, "r+b") as hashfile:
+                data = hashfile.read()
+                # Cuts off a fingerprint torn by a crash mid-write
+                end = len(data) - len(data) % stored.itemsize
+                if end < len(data):
+                    hashfile.truncate(end)
+                stored.frombytes(data[:end])
+            for fingerprint in stored:
+                self._insert(fingerprint)
+
+    def __len__(self):
+        return self.count
+
+    def _insert(self, fingerprint):
+        for table, (shift, mask) in zip(self.tables, self.blocks):
+            table.setdefault((fingerprint >> shift) & mask, list()).append(fingerprint)
+        self.count += 1
+
+    def find(self, fingerprint):
+        ''' Returns a stored fingerprint within max_distance bits, or None. '''
+        with self._lock:
+            for table, (shift, mask) in zip(self.tables, self.blocks):
+                for other in table.get((fingerprint >> shift) & mask, ()):
+                    if hamming_distance(fingerprint, other) <= self.max_distance:
+                        return other
+        return None
+
+    def add_if_new(self, fingerprint):
+        '''
+        Stores fingerprint and returns True, unless a near duplicate is
+        already stored, in which case it returns False.
+        '''
+        with self._lock:
+            if self.find(fingerprint) is not None:
+                return False
+            self._insert(fingerprint)
+            self._pending.append(fingerprint)
+            if time.monotonic() - self._last_flush >= self.flush_interval:
+                self.flush()
+        return True
+
+    def flush(self):
+        with self._lock:
+            self._last_flush = time.monotonic()
+            if self._pending:
+                with metrics.timer(FLUSH_SERIES), open(self.filename, "ab") as hashfile:
+                    self._pending.tofile(hashfile)
+                self._pending = array("Q")
+
+    def close(self):
+        self.flush()
@@ -0,0 +1,150 @@
+import re
+from collections import OrderedDict
+from threading import RLock
+
+DIGITS = re.compile(r"\d+")
+HEX_ID = re.compile(r"^[0-9a-fA-F]{16,}$")
+
+
+def url_parts(url):
+    ''' Splits a canonical url into (host, path segments, query params). '''
+    rest = url.split("://", 1)[-1]
+    hostpath, _, query = rest.partition("?")
+    host, _, path = hostpath.partition("/")
+    segments = [segment for segment in path.split("/") if segment]
+    params = [param.partition("=") for param in query.split("&") if param]
+    return host, segments, params
+
+
+def url_template(host, segments, params):
+    '''
+    Pattern shared by urls that differ only in numbers, dates, ids and query
+    values, e.g. www.ics.uci.edu/events/#/#-#-#?view for
+    www.ics.uci.edu/events/12/2019-01-05?view=day
+    '''
+    template = "/".join(
+        "{id}" if HEX_ID.match(segment) else DIGITS.sub("#", segment)
+        for segment in segments)
+    names = sorted(set(name for name, _, _ in params))
+    return f"{host}/{template}" + ("?" + "&".join(names) if names else "")
+
+
+class TemplateStats(object):
+    __slots__ = ("links", "results", "bad", "values", "throttled")
+
+    def __init__(self):
+        self.links = 0         # new links seen with this template
+        self.results = 0       # pages downloaded with this template
+        self.bad = 0           # ...that were errors, too short or near duplicates
+        self.values = dict()   # query param -> distinct values (up to max_values + 1)
+        self.throttled = False
+
+
+class TrapDetector(object):
+    '''
+    Learns crawler traps from the urls it sees instead of a fixed regex list.
+
+    Urls are grouped by template (see url_template). A template is
+    throttled, so that only one in throttle of its new links is let through,
+    once it has produced max_links links or one of its query parameters has
+    taken more than max_values values. It is banned for good once at least
+    min_pages of its pages were downloaded and at least bad_ratio of them
+    were errors, too short or near duplicates (see record). Urls deeper than
+    max_depth segments or repeating a segment more than max_repeats times
+    are refused on sight.
+
+    Only the max_templates most recently used templates are tracked; banned
+    templates are kept apart and never forgotten (see banned_patterns).
+    '''
+    def __init__(self, max_templates=10000, min_pages=20, bad_ratio=0.8,
+                 max_links=1000, max_values=50, throttle=10,
+                 max_depth=12, max_repeats=2, logger=None):
+        self.max_templates = max_templates
+        self.min_pages = min_pages
+        self.bad_ratio = bad_ratio
+        self.max_links = max_links
+        self.max_values = max_values
+        self.throttle = throttle
+        self.max_depth = max_depth
+        self.max_repeats = max_repeats
+        self.logger = logger
+        self.templates = OrderedDict()
+        self.banned = dict()
+        self._lock = RLock()
+
+    def _stats(self, template):
+        stats = self.templates.get(template)
+        if stats is None:
+            stats = self.templates[template] = TemplateStats()
+            if len(self.templates) > self.max_templates:
+                self.templates.popitem(last=False)
+        else:
+            self.templates.move_to_end(template)
+        return stats
+
+    def allow(self, url):
+        '''
+        Called for every new link. Returns False if url looks like a trap or
+        its template is banned or throttled.
+        '''
+        host, segments, params = url_parts(url)
+        if len(segments) > self.max_depth:
+            return False
+        if segments and max(segments.count(segment) for segment in set(segments)) > self.max_repeats:
+            return False
+        template = url_template(host, segments, params)
+        with self._lock:
+            if template in self.banned:
+                self.banned[template] += 1
+                return False
+            stats = self._stats(template)
+            stats.links += 1
+            for name, _, value in params:
+                values = stats.values.setdefault(name, set())
+                if len(values) <= self.max_values:
+                    values.add(value)
+                    if len(values) > self.max_values:
+                        self._throttle(template, stats,
+                            f"query parameter {name} took more than {self.max_values} values")
+            if stats.links > self.max_links:
+                self._throttle(template, stats, f"more than {self.max_links} links")
+            if stats.throttled:
+                return stats.links % self.throttle == 0
+            return True
+
+    def record(self, url, good):
+        '''
+        Called with the outcome of every downloaded page: good is False for
+        errors, pages with too few words and near duplicates.
+        '''
+        template = url_template(*url_parts(url))
+        with self._lock:
+            if template in self.banned:
+                return
+            stats = self._stats(template)
+            stats.results += 1
+            if not good:
+                stats.bad += 1
+            if stats.results >= self.min_pages and stats.bad >= self.bad_ratio * stats.results:
+                del self.templates[template]
+                self.banned[template] = 0
+                self._log(f"Banned {template}: {stats.bad} of {stats.results} pages were "
+                          f"errors, too short or near duplicates.")
+
+    def _throttle(self, template, stats, reason):
+        if not stats.throttled:
+            stats.throttled = True
+            self._log(f"Throttled {template}: {reason}.")
+
+    def _log(self, message):
+        if self.logger is not None:
+            self.logger.info(message)
+
+    def is_banned(self, url):
+        with self._lock:
+            return url_template(*url_parts(url)) in self.banned
+
+    def banned_patterns(self):
+        ''' Returns {template: links refused since it was banned}. '''
+        with self._lock:
+            return dict(self.banned)
@@ -0,0 +1,51 @@
+import re
+
+
+class UrlFilter(object):
+    '''
+    The rules of scraper.is_banned, compiled once.
+
+    domains: hosts that may be crawled, along with all their subdomains.
+        Checked by walking up the host's labels in a set.
+    domain_paths: host + path prefixes that may be crawled on other hosts.
+    traps: regexes searched in the lowercased netloc + path.
+    query_bans: regexes searched in the lowercased query.
+    extensions: file extensions (without the dot) that are never pages.
+    '''
+    def __init__(self, domains, domain_paths, traps, query_bans, extensions):
+        self.domains = frozenset(domain.lower() for domain in domains)
+        self.domain_paths = tuple(prefix.lower() for prefix in domain_paths)
+        self.traps = re.compile("|".join(f"(?:{trap})" for trap in traps))
+        self.query_bans = re.compile("|".join(f"(?:{ban})" for ban in query_bans))
+        self.extensions = frozenset(extension.lower() for extension in extensions)
+
+    def is_banned(self, scheme, netloc, path, query):
+        '''
+        Takes the parts of a split URL and returns True if any rule catches it.
+        Cheapest checks first; everything is looked at once.
+        '''
+        if scheme not in ("http", "https"):
+            return True
+        path = path.lower()
+        dot = path.rfind(".")
+        if dot != -1 and path[dot + 1:] in self.extensions:
+            return True
+        netloc = netloc.lower()
+        if not self.is_allowed_host(netloc.rpartition("@")[2].partition(":")[0]):
+            if not (netloc + path).startswith(self.domain_paths):
+                return True
+        if self.traps.search(netloc + path):
+            return True
+        if query and self.query_bans.search(query.lower()):
+            return True
+        return False
+
+    def is_allowed_host(self, host):
+        ''' True if host is one of the domains or a subdomain of one. '''
+        while True:
+            if host in self.domains:
+                return True
+            dot = host.find(".")
+            if dot == -1:
+                return False
+            host = host[dot + 1:]
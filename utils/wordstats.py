@@ -0,0 +1,275 @@
+'''
+Approximate word statistics in fixed memory, for WORDSTATS = approx.
+
+    python -m utils.wordstats wordstats.bin [--top 50]
+
+prints the top words of a saved WordStats with their error bounds, without
+reading wordtotals.json.
+'''
+import os
+import math
+import json
+import heapq
+import struct
+from array import array
+from hashlib import blake2b
+from argparse import ArgumentParser
+
+HEADER = struct.Struct("<4sIIIQQ")
+MAGIC = b"WST1"
+
+# English stopwords, left out of the statistics as they are counted
+STOPWORDS = frozenset("""
+a about above after again against all am an and any are aren't as at be because
+been before being below between both but by can't cannot could couldn't did
+didn't do does doesn't doing don't down during each few for from further had
+hadn't has hasn't have haven't having he he'd he'll he's her here here's hers
+herself him himself his how how's i i'd i'll i'm i've if in into is isn't it
+it's its itself let's me more most mustn't my myself no nor not of off on once
+only or other ought our ours ourselves out over own same shan't she she'd
+she'll she's should shouldn't so some such than that that's the their theirs
+them themselves then there there's these they they'd they'll they're they've
+this those through to too under until up very was wasn't we we'd we'll we're
+we've were weren't what what's when when's where where's which while who who's
+whom why why's with won't would wouldn't you you'd you'll you're you've your
+yours yourself yourselves
+""".split())
+
+
+class CountMinSketch(object):
+    '''
+    depth rows of width counters. An item's estimate is the smallest of its
+    depth counters: never below its true count, and above it by more than
+    e / width * total with probability at most e^-depth. Sketches of the
+    same width and depth are merged by adding the counters.
+    '''
+    def __init__(self, width=65536, depth=4, counts=None):
+        self.width = width
+        self.depth = depth
+        self.counts = counts if counts is not None else array("Q", bytes(8 * width * depth))
+        self.total = 0
+
+    def _cells(self, item):
+        value = int.from_bytes(blake2b(item.encode("utf-8"), digest_size=16).digest(), "little")
+        h1, h2 = value & 0xFFFFFFFFFFFFFFFF, (value >> 64) | 1
+        width = self.width
+        return [row * width + (h1 + row * h2) % width for row in range(self.depth)]
+
+    def add(self, item, count=1):
+        ''' Adds count to item and returns its new estimate. '''
+        counts = self.counts
+        cells = self._cells(item)
+        for cell in cells:
+            counts[cell] += count
+        self.total += count
+        return min([counts[cell] for cell in cells])
+
+    def estimate(self, item):
+        counts = self.counts
+        return min(counts[cell] for cell in self._cells(item))
+
+    def error(self):
+        ''' (additive error, probability of exceeding it) of every estimate. '''
+        return math.e / self.width * self.total, math.exp(-self.depth)
+
+    def merge(self, other):
+        if (other.width, other.depth) != (self.width, self.depth):
+            raise ValueError("Count-Min sketches of different sizes cannot be merged.")
+        counts = self.counts
+        for cell, count in enumerate(other.counts):
+            if count:
+                counts[cell] += count
+        self.total += other.total
+
+
+class SpaceSaving(object):
+    '''
+    Space-Saving top-k: counts for at most k items. A new item replaces the
+    item with the smallest count (the floor) and inherits it, so every
+    count is an overestimate by at most its error, and every item not kept
+    occurred at most floor <= total / k times.
+
+    With the estimate of a Count-Min sketch, a new item whose estimate is
+    not above the floor is known to be smaller than every kept item and is
+    not let in, and an item that is let in starts at its estimate if that is
+    below floor + count.
+    '''
+    def __init__(self, k=1000):
+        self.k = k
+        self.counts = dict()   # item -> [count, error]
+        self.heap = list()     # one (count, item) per item; counts may be stale (lower)
+
+    def _min(self):
+        heap, counts = self.heap, self.counts
+        while True:
+            count, item = heap[0]
+            current = counts[item][0]
+            if current == count:
+                return count, item
+            heapq.heapreplace(heap, (current, item))
+
+    def floor(self):
+        ''' Upper bound on the count of every item that is not kept. '''
+        return self._min()[0] if len(self.counts) >= self.k else 0
+
+    def add(self, item, count=1, estimate=None):
+        entry = self.counts.get(item)
+        if entry is not None:
+            entry[0] += count
+            return
+        if len(self.counts) < self.k:
+            self.counts[item] = [count, 0]
+            heapq.heappush(self.heap, (count, item))
+            return
+        floor, smallest = self._min()
+        if estimate is not None and estimate <= floor:
+            return
+        new_count = floor + count
+        if estimate is not None and estimate < new_count:
+            new_count = estimate
+        del self.counts[smallest]
+        self.counts[item] = [new_count, new_count - count]
+        heapq.heapreplace(self.heap, (new_count, item))
+
+    def merge(self, other, sketch=None):
+        '''
+        Adds the counts of other (mergeable summaries: an item missing from
+        one side counts as that side's floor, with the same error). With
+        sketch, the merged Count-Min sketch, counts are capped at its estimate.
+        '''
+        floor, other_floor = self.floor(), other.floor()
+        merged = dict()
+        for item in set(self.counts) | set(other.counts):
+            count, error = self.counts.get(item, (floor, floor))
+            other_count, other_error = other.counts.get(item, (other_floor, other_floor))
+            count, error = count + other_count, error + other_error
+            if sketch is not None:
+                estimate = sketch.estimate(item)
+                if estimate < count:
+                    error = max(error - (count - estimate), 0)
+                    count = estimate
+            merged[item] = [count, error]
+        kept = heapq.nlargest(self.k, merged.items(), key=lambda item: item[1][0])
+        self.counts = dict((item, list(entry)) for item, entry in kept)
+        self.heap = [(entry[0], item) for item, entry in self.counts.items()]
+        heapq.heapify(self.heap)
+
+    def top(self, n):
+        ''' The n largest (item, count, error), largest first. '''
+        return [(item, count, error) for item, (count, error) in heapq.nlargest(
+            n, self.counts.items(), key=lambda item: item[1][0])]
+
+
+class WordStats(object):
+    '''
+    Word frequencies in fixed memory: a SpaceSaving top-k of k words behind
+    a CountMinSketch of width x depth counters (8 bytes each). Stopwords and
+    numbers are dropped as they are added. Unlike wordtotals.json the
+    counts of rare words are lost, but the top words come with error bounds
+    (see bounds) and WordStats of several workers or nodes can be merged.
+    '''
+    def __init__(self, k=1000, width=65536, depth=4, stopwords=STOPWORDS):
+        self.top_k = SpaceSaving(k)
+        self.sketch = CountMinSketch(width, depth)
+        self.stopwords = stopwords
+
+    def add(self, word_counts):
+        ''' Adds one page's word counts (a token dict). '''
+        sketch, top_k, stopwords = self.sketch, self.top_k, self.stopwords
+        for word, count in word_counts.items():
+            if word in stopwords or word.isnumeric():
+                continue
+            top_k.add(word, count, sketch.add(word, count))
+
+    def merge(self, other):
+        self.sketch.merge(other.sketch)
+        self.top_k.merge(other.top_k, self.sketch)
+
+    @property
+    def total(self):
+        return self.sketch.total
+
+    def top(self, n=50):
+        ''' The n most frequent words as (word, count, error), count - error <= true count <= count. '''
+        return self.top_k.top(n)
+
+    def bounds(self):
+        sketch_error, sketch_failure = self.sketch.error()
+        return {
+            "total": self.total,
+            "words_kept": len(self.top_k.counts),
+            "top_k_floor": self.top_k.floor(),
+            "sketch_error": round(sketch_error, 3),
+            "sketch_confidence": round(1 - sketch_failure, 6),
+        }
+
+    def report(self, n=50):
+        '''
+        The top n words with their bounds, and whether they are certainly in
+        the true top n (their lowest possible count is above the highest
+        possible count of every word after them).
+        '''
+        top = self.top(n + 1)
+        after = max(top[n][1] if len(top) > n else 0, self.top_k.floor())
+        return dict(self.bounds(), top=[
+            {"word": word, "count": count, "error": error, "certain": count - error >= after}
+            for word, count, error in top[:n]])
+
+    def save(self, filename):
+        ''' Writes the statistics to filename through a temporary file and a rename. '''
+        items = json.dumps(
+            [[word, count, error] for word, (count, error) in self.top_k.counts.items()]
+        ).encode("utf-8")
+        tmpname = f"{filename}.tmp"
+        with open(tmpname, "wb") as statsfile:
+            statsfile.write(HEADER.pack(
+                MAGIC, self.top_k.k, self.sketch.width, self.sketch.depth,
+                self.sketch.total, len(items)))
+            self.sketch.counts.tofile(statsfile)
+            statsfile.write(items)
+        os.replace(tmpname, filename)
+
+    @classmethod
+    def load(cls, filename, k=1000, width=65536, depth=4):
+        '''
+        Reads statistics written by save. Returns new empty statistics of
+        the given size if the file does not exist or is not a WordStats file.
+        '''
+        try:
+            with open(filename, "rb") as statsfile:
+                magic, file_k, file_width, file_depth, total, size = HEADER.unpack(
+                    statsfile.read(HEADER.size))
+                if magic != MAGIC:
+                    return cls(k, width, depth)
+                stats = cls(file_k, file_width, file_depth)
+                counts = array("Q")
+                counts.fromfile(statsfile, file_width * file_depth)
+                stats.sketch.counts = counts
+                stats.sketch.total = total
+                for word, count, error in json.loads(statsfile.read(size)):
+                    stats.top_k.counts[word] = [count, error]
+                stats.top_k.heap = [(entry[0], word) for word, entry in stats.top_k.counts.items()]
+                heapq.heapify(stats.top_k.heap)
+                return stats
+        except (FileNotFoundError, struct.error, EOFError, ValueError):
+            return cls(k, width, depth)
+
+
+def main():
+    parser = ArgumentParser(description="Top words of a saved WordStats file.")
+    parser.add_argument("filename", nargs="?", default="wordstats.bin")
+    parser.add_argument("--top", type=int, default=50)
+    args = parser.parse_args()
+    if not os.path.exists(args.filename):
+        parser.error(f"{args.filename} does not exist")
+    report = WordStats.load(args.filename).report(args.top)
+    print(f"{report['total']} words counted, {report['words_kept']} kept; counts are "
+          f"at most {report['top_k_floor']} too high (Count-Min: {report['sketch_error']} "
+          f"with probability {report['sketch_confidence']}).")
+    for rank, entry in enumerate(report["top"], 1):
+        mark = "" if entry["certain"] else " ?"
+        print(f"{rank:3}. {entry['word']:<24} {entry['count']:>10} (-{entry['error']}){mark}")
+
+
+if __name__ == "__main__":
+    main()
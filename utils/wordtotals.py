@@ -0,0 +1,116 @@
+import json
+import time
+from collections import Counter
+from threading import Lock, RLock, local
+
+from utils import write_json_atomic, metrics
+from utils.wordstats import WordStats
+
+FLUSH_SERIES = metrics.series("flush_seconds", file="wordtotals")
+
+
+class WordTotals(object):
+    '''
+    In-memory version of wordtotals.json: word -> number of times it was
+    seen over all scraped pages.
+
+    Each thread adds its pages to its own shard, so adding a page costs
+    O(words on the page) and threads never wait on each other. Every
+    checkpoint_pages pages or checkpoint_seconds seconds the shards are
+    merged into the totals and the file is rewritten once.
+    '''
+    def __init__(self, filename, checkpoint_pages=500, checkpoint_seconds=60.0):
+        self.filename = filename
+        self.checkpoint_pages = checkpoint_pages
+        self.checkpoint_seconds = checkpoint_seconds
+        self._lock = RLock()
+        self._local = local()
+        self._shards = list()
+        self._pages = 0
+        self._last_checkpoint = time.monotonic()
+        self.totals = self._load()
+
+    def _load(self):
+        totals = Counter()
+        try:
+            with open(self.filename, "r") as setfile:
+                totals.update(json.load(setfile))
+        except FileNotFoundError:
+            pass
+        return totals
+
+    def _shard(self):
+        shard = getattr(self._local, "shard", None)
+        if shard is None:
+            # [lock, counts]; the lock is only ever shared with merge
+            shard = self._local.shard = [Lock(), Counter()]
+            with self._lock:
+                self._shards.append(shard)
+        return shard
+
+    def add(self, word_counts):
+        ''' Adds one page's word counts (a token dict). '''
+        shard = self._shard()
+        with shard[0]:
+            shard[1].update(word_counts)
+        self._pages += 1
+        if (self._pages >= self.checkpoint_pages
+                or time.monotonic() - self._last_checkpoint >= self.checkpoint_seconds):
+            self.checkpoint(block=False)
+
+    def merge(self):
+        ''' Moves the counts of every shard into totals and returns totals. '''
+        with self._lock:
+            for shard in self._shards:
+                with shard[0]:
+                    counts, shard[1] = shard[1], Counter()
+                self._add(counts)
+            return self.totals
+
+    def _add(self, counts):
+        self.totals.update(counts)
+
+    def _write(self):
+        write_json_atomic(self.filename, self.totals)
+
+    def checkpoint(self, block=True):
+        '''
+        Merges the shards and writes the totals to disk. With block=False
+        it does nothing if another thread is already checkpointing.
+        '''
+        if not self._lock.acquire(blocking=block):
+            return
+        try:
+            self._pages = 0
+            self._last_checkpoint = time.monotonic()
+            with metrics.timer(FLUSH_SERIES):
+                self.merge()
+                self._write()
+        finally:
+            self._lock.release()
+
+    def close(self):
+        self.checkpoint()
+
+
+class ApproxWordTotals(WordTotals):
+    '''
+    WordTotals for WORDSTATS = approx: the shards are merged into a
+    utils.wordstats.WordStats of fixed size (top k words behind a Count-Min
+    sketch of width x depth counters, no stopwords) and saved to filename,
+    instead of an exact count of every word. Only the shards grow with the
+    words seen between two checkpoints.
+    '''
+    def __init__(self, filename, checkpoint_pages=500, checkpoint_seconds=60.0,
+                 k=1000, width=65536, depth=4):
+        self.size = (k, width, depth)
+        super().__init__(filename, checkpoint_pages, checkpoint_seconds)
+
+    def _load(self):
+        return WordStats.load(self.filename, *self.size)
+
+    def _add(self, counts):
+        self.totals.add(counts)
+
+    def _write(self):
+        self.totals.save(self.filename)
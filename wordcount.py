@@ -1,4 +1,4 @@
-import PartA as A
+import tokenizewords as A
 import sys
 
 